@@ -0,0 +1,131 @@
+# backup.py
+# Contém a classe GerenciadorBackup, que faz cópias do banco de dados com o sistema rodando,
+# usando a API de backup do próprio sqlite3 em uma thread separada.
+
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from config import BACKUP_DIR, BACKUP_RETENCAO
+from database import DatabaseManager
+
+PREFIXO_BACKUP = "estoque_backup_"
+
+
+@dataclass
+class ResultadoBackup:
+    """resultado de uma execução de backup"""
+    arquivos: list[str]
+    sucesso: bool
+    mensagem: str = ""
+    inicio: datetime = field(default_factory=datetime.now)
+    fim: datetime | None = None
+
+
+class GerenciadorBackup:
+    """cuida dos backups online do banco (e do banco de arquivo, se tiver um)"""
+    def __init__(self, db_manager: DatabaseManager, diretorio: str = BACKUP_DIR, retencao: int = BACKUP_RETENCAO):
+        self.db = db_manager
+        self.diretorio = diretorio
+        self.retencao = retencao
+        self.ultimo_resultado: ResultadoBackup | None = None
+        # (páginas restantes, total de páginas) do arquivo sendo copiado no momento
+        self.progresso: tuple[int, int] = (0, 0)
+        self._thread: threading.Thread | None = None
+
+    def em_andamento(self) -> bool:
+        """Diz se tem um backup rodando agora."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def iniciar_backup(self) -> bool:
+        """Dispara um backup em segundo plano. Retorna False se já houver um em andamento."""
+        if self.em_andamento():
+            return False
+        # a thread não é daemon: se o programa for fechado no meio, ele espera o backup terminar
+        self._thread = threading.Thread(target=self._executar, name="backup-estoque")
+        self._thread.start()
+        return True
+
+    def aguardar(self, timeout: float | None = None) -> ResultadoBackup | None:
+        """Espera o backup em andamento (se houver) terminar e retorna o resultado."""
+        if self._thread:
+            self._thread.join(timeout)
+        return self.ultimo_resultado
+
+    def listar_backups(self) -> list[str]:
+        """Lista os arquivos de backup do banco principal, do mais novo para o mais antigo."""
+        if not os.path.isdir(self.diretorio):
+            return []
+        nomes = [n for n in os.listdir(self.diretorio) if n.startswith(PREFIXO_BACKUP) and not n.endswith("_arquivo.db")]
+        return [os.path.join(self.diretorio, n) for n in sorted(nomes, reverse=True)]
+
+    def _executar(self):
+        """Corpo da thread: copia os bancos, confere a integridade e aplica a retenção."""
+        resultado = ResultadoBackup(arquivos=[], sucesso=False)
+        self.ultimo_resultado = resultado
+        try:
+            os.makedirs(self.diretorio, exist_ok=True)
+            carimbo = datetime.now().strftime('%Y%m%d_%H%M%S')
+            destinos = {'main': os.path.join(self.diretorio, f"{PREFIXO_BACKUP}{carimbo}.db")}
+            if self.db.arquivo_file and os.path.exists(self.db.arquivo_file):
+                destinos['arquivo'] = os.path.join(self.diretorio, f"{PREFIXO_BACKUP}{carimbo}_arquivo.db")
+            self._copiar(destinos, resultado.arquivos)
+
+            self._aplicar_retencao()
+            resultado.sucesso = True
+            resultado.mensagem = "Backup concluído e verificado."
+        except (sqlite3.Error, OSError, ValueError) as e:
+            # não deixa arquivo pela metade no diretório (senão a retenção apagaria um backup bom no lugar dele)
+            for arquivo in resultado.arquivos:
+                if os.path.exists(arquivo):
+                    os.remove(arquivo)
+            resultado.arquivos = []
+            resultado.mensagem = f"Falha no backup: {e}"
+        finally:
+            resultado.fim = datetime.now()
+
+    def _copiar(self, destinos: dict[str, str], copiados: list[str]):
+        """
+        Copia o banco principal ('main') e o de arquivo ('arquivo', anexado na mesma conexão) dentro de uma
+        transação de leitura só: os dois saem do mesmo instante (um arquivamento no meio não aparece
+        em dobro nem some), e como ninguém grava enquanto ela está aberta, a API de backup não recomeça
+        a cópia. Cada banco vai num passo só; quem for gravar espera o fim da cópia (até o timeout do banco).
+        Cada cópia passa pelo integrity_check. Os arquivos criados vão sendo anotados em 'copiados'.
+        """
+        # a conexão principal não pode ser usada fora da thread dela, então o backup abre a sua
+        # (no modo em memória, o banco principal é o da RAM, não o arquivo salvo da última vez)
+        origem = self.db.nova_conexao(isolation_level=None)
+        try:
+            if 'arquivo' in destinos:
+                origem.execute("ATTACH DATABASE ? AS arquivo", (self.db.arquivo_file,))
+            origem.execute("BEGIN")
+            # a transação só trava (e fixa o instante de) cada banco na primeira leitura dele: lê os dois já
+            for nome in destinos:
+                origem.execute(f"SELECT COUNT(*) FROM {nome}.sqlite_master").fetchone()
+            for nome, destino_file in destinos.items():
+                copiados.append(destino_file)
+                destino = sqlite3.connect(destino_file)
+                try:
+                    origem.backup(destino, name=nome, progress=self._registrar_progresso)
+                    verificacao = destino.execute("PRAGMA integrity_check").fetchone()[0]
+                finally:
+                    destino.close()
+                if verificacao != "ok":
+                    raise ValueError(f"verificação de integridade falhou em '{destino_file}': {verificacao}")
+            origem.execute("COMMIT")
+        finally:
+            origem.close()
+
+    def _registrar_progresso(self, status, restantes, total):
+        """Chamado pelo sqlite a cada passo; guarda o progresso."""
+        self.progresso = (restantes, total)
+
+    def _aplicar_retencao(self):
+        """Apaga os backups mais antigos, mantendo só os 'retencao' mais recentes."""
+        for antigo in self.listar_backups()[self.retencao:]:
+            os.remove(antigo)
+            arquivo_morto = antigo[:-len(".db")] + "_arquivo.db"
+            if os.path.exists(arquivo_morto):
+                os.remove(arquivo_morto)
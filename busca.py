@@ -0,0 +1,187 @@
+# busca.py
+# Contém o IndiceBusca, o índice em memória por trás da busca de produtos "digitando" da CLI (type-ahead):
+# cada produto vira um conjunto de termos (palavras do nome, categoria, código de barras...), os termos ficam
+# numa trie (busca por começo de palavra) e num índice de trigramas (pedaço do meio da palavra e erro de digitação).
+# Assim uma busca olha só os termos que interessam, sem passar pelo catálogo inteiro.
+
+import gc
+import re
+import sys
+import threading
+import unicodedata
+from collections import Counter, deque
+
+_PALAVRA = re.compile(r'[^\W_]+')
+# acentos e outros sinais que sobram soltos depois da decomposição NFKD ('é' -> 'e' + '\u0301')
+_SINAIS = re.compile('[\u0300-\u036f]')
+# chave que marca, num nó da trie, que um termo termina ali (nenhum caractere é a string vazia)
+_FIM = ''
+
+
+def normalizar(texto: str | None) -> list[str]:
+    """Quebra o texto em termos minúsculos e sem acento ('Cabo USB-C Pólo' -> ['cabo', 'usb', 'c', 'polo'])."""
+    if not texto:
+        return []
+    if not texto.isascii():
+        texto = _SINAIS.sub('', unicodedata.normalize('NFKD', texto))
+    return _PALAVRA.findall(texto.casefold())
+
+
+def _trigramas(termo: str) -> set[str]:
+    return {termo[i:i + 3] for i in range(len(termo) - 2)}
+
+
+class IndiceBusca:
+    """
+    Índice id -> termos para busca incremental. adicionar() também serve para atualizar (troca os termos do id).
+    buscar() devolve os ids na ordem: termo igual ao digitado, termos que começam com ele (os mais curtos
+    primeiro), termos que o contêm no meio e, por último, termos parecidos (trigramas em comum).
+    """
+    def __init__(self):
+        self._ids_por_termo: dict[str, set[int]] = {}
+        self._termos_por_id: dict[int, frozenset[str]] = {}
+        self._trie: dict = {}
+        self._termos_por_trigrama: dict[str, set[str]] = {}
+        # reentrante: o 'aceitar' da busca pode acabar carregando produto, que não mexe aqui, mas não custa
+        self._trava = threading.RLock()
+
+    def __len__(self):
+        return len(self._termos_por_id)
+
+    def __contains__(self, item_id):
+        return item_id in self._termos_por_id
+
+    def adicionar(self, item_id: int, *textos: str | None):
+        """Indexa (ou reindexa) o item com os termos dos textos informados."""
+        with self._trava:
+            self._adicionar(item_id, textos)
+
+    def carregar(self, linhas):
+        """Indexa de uma vez uma sequência de (id, *textos); é a montagem inicial, bem mais rápida que um adicionar() por item."""
+        # são milhões de dicts e sets novos: com o coletor de lixo ligado ele rodaria várias vezes à toa no meio
+        coletor_ligado = gc.isenabled()
+        gc.disable()
+        try:
+            with self._trava:
+                for item_id, *textos in linhas:
+                    self._adicionar(item_id, textos)
+        finally:
+            if coletor_ligado:
+                gc.enable()
+
+    def _adicionar(self, item_id: int, textos):
+        # intern: o mesmo termo em milhares de produtos vira um objeto só na memória
+        termos = frozenset(sys.intern(t) for texto in textos for t in normalizar(texto))
+        self._remover(item_id)
+        self._termos_por_id[item_id] = termos
+        for termo in termos:
+            if (ids := self._ids_por_termo.get(termo)) is None:
+                ids = self._ids_por_termo[termo] = set()
+                self._incluir_termo(termo)
+            ids.add(item_id)
+
+    def remover(self, item_id: int) -> bool:
+        with self._trava:
+            return self._remover(item_id)
+
+    def _remover(self, item_id: int) -> bool:
+        if (termos := self._termos_por_id.pop(item_id, None)) is None:
+            return False
+        for termo in termos:
+            ids = self._ids_por_termo[termo]
+            ids.discard(item_id)
+            if not ids:
+                # ninguém mais usa o termo: sai da trie e dos trigramas também
+                del self._ids_por_termo[termo]
+                self._excluir_termo(termo)
+        return True
+
+    def _incluir_termo(self, termo: str):
+        no = self._trie
+        for caractere in termo:
+            no = no.setdefault(caractere, {})
+        no[_FIM] = termo
+        # número (código de barras) só é buscado pelo começo: trigramas de dígitos seriam comuns a milhares
+        # de códigos, gastando memória à toa, e "parecido" não quer dizer nada ali
+        if not termo.isdigit():
+            for trigrama in _trigramas(termo):
+                self._termos_por_trigrama.setdefault(trigrama, set()).add(termo)
+
+    def _excluir_termo(self, termo: str):
+        caminho = [self._trie]
+        for caractere in termo:
+            caminho.append(caminho[-1][caractere])
+        del caminho[-1][_FIM]
+        # poda os nós que ficaram vazios, de baixo pra cima
+        for caractere, pai, no in zip(reversed(termo), reversed(caminho[:-1]), reversed(caminho[1:])):
+            if no:
+                break
+            del pai[caractere]
+        for trigrama in _trigramas(termo) if not termo.isdigit() else ():
+            termos = self._termos_por_trigrama[trigrama]
+            termos.discard(termo)
+            if not termos:
+                del self._termos_por_trigrama[trigrama]
+
+    def buscar(self, texto: str, limite: int = 10, aceitar=None) -> list[int]:
+        """
+        Ids dos itens que casam com o texto digitado, no máximo 'limite'. Com vários termos, o mais longo
+        (o mais seletivo) escolhe os candidatos e os outros têm que aparecer (no começo ou no meio) em algum
+        termo do item. aceitar(item_id), se informado, filtra os candidatos (ex: só os que têm estoque).
+        A busca para assim que junta 'limite' resultados.
+        """
+        termos = normalizar(texto)
+        if not termos or limite <= 0:
+            return []
+        principal = max(termos, key=len)
+        outros = list(termos)
+        outros.remove(principal)
+        encontrados, vistos = [], set()
+        with self._trava:
+            for termo in self._candidatos(principal):
+                for item_id in self._ids_por_termo.get(termo, ()):
+                    if item_id in vistos:
+                        continue
+                    vistos.add(item_id)
+                    termos_item = self._termos_por_id[item_id]
+                    if not all(any(outro in t for t in termos_item) for outro in outros):
+                        continue
+                    if aceitar and not aceitar(item_id):
+                        continue
+                    encontrados.append(item_id)
+                    if len(encontrados) >= limite:
+                        return encontrados
+        return encontrados
+
+    def _candidatos(self, termo: str):
+        """Gera os termos indexados que casam com 'termo', dos melhores para os piores (é preguiçoso: só vai
+        para a próxima faixa se a busca ainda precisar de resultados)."""
+        # 1) começo de palavra: desce a trie até o prefixo e percorre por nível (termos mais curtos primeiro)
+        no = self._trie
+        for caractere in termo:
+            if (no := no.get(caractere)) is None:
+                break
+        if no is not None:
+            fila = deque([no])
+            while fila:
+                no = fila.popleft()
+                for caractere, filho in no.items():
+                    if caractere == _FIM:
+                        yield filho
+                    else:
+                        fila.append(filho)
+        if len(termo) < 3 or termo.isdigit():
+            return
+
+        # 2) pedaço do meio: os termos que têm todos os trigramas do digitado (e confirmando, que trigrama não garante ordem)
+        trigramas = _trigramas(termo)
+        conjuntos = sorted((self._termos_por_trigrama.get(t, set()) for t in trigramas), key=len)
+        if conjuntos[0]:
+            no_meio = set(conjuntos[0]).intersection(*conjuntos[1:])
+            yield from sorted((t for t in no_meio if termo in t and not t.startswith(termo)), key=lambda t: (len(t), t))
+
+        # 3) parecidos (erro de digitação): pelo menos metade dos trigramas em comum
+        em_comum = Counter(t for trigrama in trigramas for t in self._termos_por_trigrama.get(trigrama, ()))
+        minimo = max(1, (len(trigramas) + 1) // 2)
+        parecidos = [t for t, n in em_comum.items() if n >= minimo and termo not in t]
+        yield from sorted(parecidos, key=lambda t: (-em_comum[t], abs(len(t) - len(termo)), t))
@@ -0,0 +1,129 @@
+# carga.py
+# Teste de carga do servidor HTTP (servidor.py): simula centenas de caixas ao mesmo tempo, cada um com
+# sua conexão keep-alive, misturando consultas por código de barras e vendas, e mede a latência (p50/p99).
+# Exemplo (com o servidor rodando em outro terminal):
+#   python carga.py --terminais 300 --requisicoes 50 --local 2
+
+import argparse
+import asyncio
+import json
+import random
+from time import perf_counter
+
+from config import SERVIDOR_HOST, SERVIDOR_PORTA
+
+
+class Terminal:
+    """um caixa simulado: uma conexão aberta com o servidor, mandando uma requisição de cada vez"""
+    def __init__(self, host: str, porta: int):
+        self.host = host
+        self.porta = porta
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+
+    async def conectar(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.porta)
+
+    async def requisitar(self, metodo: str, caminho: str, dados: dict | None = None) -> tuple[int, object]:
+        corpo = json.dumps(dados).encode('utf-8') if dados is not None else b''
+        self.writer.write((f"{metodo} {caminho} HTTP/1.1\r\nHost: {self.host}\r\n"
+                           f"Content-Type: application/json\r\nContent-Length: {len(corpo)}\r\n\r\n").encode('latin-1') + corpo)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        tamanho = 0
+        while (linha := await self.reader.readline()) not in (b'\r\n', b''):
+            nome, _, valor = linha.decode('latin-1').partition(':')
+            if nome.strip().lower() == 'content-length':
+                tamanho = int(valor)
+        resposta = await self.reader.readexactly(tamanho)
+        return status, json.loads(resposta) if resposta.startswith((b'{', b'[')) else resposta.decode('utf-8')
+
+    async def fechar(self):
+        if self.writer:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+
+def _percentil(valores: list[float], p: float) -> float:
+    """percentil pelo método do ranque mais próximo (valores já ordenados)"""
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, max(0, round(p / 100 * len(valores) + 0.5) - 1))]
+
+
+async def _rodar_terminal(host: str, porta: int, requisicoes: int, codigos: list[str], localizacao_id: int,
+                          proporcao_vendas: float, latencias: dict[str, list[float]], erros: dict[str, int], rng: random.Random):
+    terminal = Terminal(host, porta)
+    await terminal.conectar()
+    try:
+        for _ in range(requisicoes):
+            codigo = rng.choice(codigos)
+            if rng.random() < proporcao_vendas:
+                tipo, metodo, caminho = 'venda', 'POST', '/vendas'
+                dados = {'localizacao_id': localizacao_id, 'cliente': "Teste de carga",
+                         'itens': [{'codigo_barras': codigo, 'quantidade': 1}]}
+            else:
+                tipo, metodo, caminho, dados = 'consulta', 'GET', f'/produtos/codigo/{codigo}', None
+            inicio = perf_counter()
+            status, _ = await terminal.requisitar(metodo, caminho, dados)
+            latencias[tipo].append(perf_counter() - inicio)
+            if status >= 400:
+                # venda recusada por falta de estoque também conta aqui (é esperado numa carga longa)
+                erros[tipo] += 1
+    finally:
+        await terminal.fechar()
+
+
+async def executar_carga(host: str = SERVIDOR_HOST, porta: int = SERVIDOR_PORTA, terminais: int = 200,
+                         requisicoes: int = 50, localizacao_id: int | None = None, proporcao_vendas: float = 0.2,
+                         semente: int = 42) -> str:
+    """Roda o teste de carga e devolve o relatório de latências como texto."""
+    if proporcao_vendas > 0 and localizacao_id is None:
+        raise ValueError("Informe a localização das vendas (--local).")
+    rng = random.Random(semente)
+    preparacao = Terminal(host, porta)
+    await preparacao.conectar()
+    try:
+        _, produtos = await preparacao.requisitar('GET', '/produtos')
+    finally:
+        await preparacao.fechar()
+
+    codigos = [p['codigo_barras'] for p in produtos if p['tipo'] == 'individual' and p['estoque_total'] > 0]
+    if not codigos:
+        raise ValueError("Nenhum produto com estoque para o teste de carga.")
+
+    latencias: dict[str, list[float]] = {'consulta': [], 'venda': []}
+    erros: dict[str, int] = {'consulta': 0, 'venda': 0}
+    inicio = perf_counter()
+    await asyncio.gather(*(
+        _rodar_terminal(host, porta, requisicoes, codigos, localizacao_id, proporcao_vendas, latencias, erros,
+                        random.Random(rng.random()))
+        for _ in range(terminais)
+    ))
+    duracao = perf_counter() - inicio
+
+    total = sum(len(v) for v in latencias.values())
+    linhas = [f"--- Teste de carga: {terminais} terminais x {requisicoes} requisições em {duracao:.2f}s "
+              f"({total / duracao:,.0f} req/s) ---",
+              f"{'Tipo':<10} {'Qtde':>8} {'Erros':>7} {'p50 (ms)':>10} {'p99 (ms)':>10} {'máx (ms)':>10}"]
+    for tipo, valores in latencias.items():
+        valores.sort()
+        linhas.append(f"{tipo:<10} {len(valores):>8} {erros[tipo]:>7} {_percentil(valores, 50) * 1000:>10.2f} "
+                      f"{_percentil(valores, 99) * 1000:>10.2f} {(valores[-1] if valores else 0) * 1000:>10.2f}")
+    return "\n".join(linhas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teste de carga do servidor HTTP de estoque.")
+    parser.add_argument('--host', default=SERVIDOR_HOST)
+    parser.add_argument('--porta', type=int, default=SERVIDOR_PORTA)
+    parser.add_argument('--terminais', type=int, default=200, help="caixas simultâneos (padrão: 200)")
+    parser.add_argument('--requisicoes', type=int, default=50, help="requisições por caixa (padrão: 50)")
+    parser.add_argument('--local', type=int, help="ID da localização onde as vendas acontecem")
+    parser.add_argument('--vendas', type=float, default=0.2, help="fração das requisições que são vendas (padrão: 0.2)")
+    args = parser.parse_args()
+    try:
+        print(asyncio.run(executar_carga(args.host, args.porta, args.terminais, args.requisicoes, args.local, args.vendas)))
+    except (ValueError, ConnectionError) as e:
+        print(f"Erro: {e}")
@@ -0,0 +1,113 @@
+# catalogo.py
+# Contém o CatalogoProdutos, usado quando o catálogo é grande demais pra ficar inteiro em memória
+# (config.CATALOGO_MAXIMO_EM_MEMORIA): os produtos são lidos do banco na hora em que alguém pede e só os
+# usados por último ficam guardados (LRU). O resto do sistema continua tratando como o dicionário de sempre.
+# O CatalogoDocumentos faz o mesmo com os documentos (vendas, OCs...), que senão cresceriam com o volume de dados.
+
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from weakref import WeakValueDictionary
+
+
+class CatalogoProdutos(MutableMapping):
+    """
+    Dicionário produto_id -> Produto com no máximo 'maximo' produtos guardados.
+    carregar(produto_id) lê um produto do banco (None se não existir); listar_ids() e contar() consultam o banco.
+    Um produto que saiu do cache mas ainda está em uso (componente de um kit, item de uma venda carregada...)
+    continua sendo o mesmo objeto: nunca existem dois Produto vivos com o mesmo id.
+    """
+    def __init__(self, carregar, listar_ids, contar, maximo: int):
+        if maximo < 1:
+            raise ValueError("O tamanho do cache de produtos deve ser pelo menos 1.")
+        self._carregar = carregar
+        self._listar_ids = listar_ids
+        self._contar = contar
+        self.maximo = maximo
+        self._cache: OrderedDict = OrderedDict()
+        # todos os produtos carregados que ainda existem (no cache ou referenciados por alguém)
+        self._vivos: WeakValueDictionary = WeakValueDictionary()
+        # reentrante: carregar um kit pede os componentes pro próprio catálogo
+        self._trava = threading.RLock()
+        self.acertos = 0
+        self.faltas = 0
+
+    def __getitem__(self, produto_id):
+        with self._trava:
+            if (produto := self._cache.get(produto_id)) is not None:
+                self._cache.move_to_end(produto_id)
+                self.acertos += 1
+                return produto
+            self.faltas += 1
+            if (produto := self._vivos.get(produto_id)) is None:
+                if (produto := self._carregar(produto_id)) is None:
+                    raise KeyError(produto_id)
+            self[produto_id] = produto
+            return produto
+
+    def __setitem__(self, produto_id, produto):
+        with self._trava:
+            self._cache[produto_id] = produto
+            self._cache.move_to_end(produto_id)
+            self._vivos[produto_id] = produto
+            while len(self._cache) > self.maximo:
+                self._cache.popitem(last=False)
+
+    def __delitem__(self, produto_id):
+        with self._trava:
+            encontrado = self._cache.pop(produto_id, None) is not None
+            if self._vivos.pop(produto_id, None) is None and not encontrado:
+                raise KeyError(produto_id)
+
+    def __iter__(self):
+        # a lista de ids vem inteira do banco (o cursor é compartilhado, não dá pra ir lendo enquanto carrega)
+        return iter(self._listar_ids())
+
+    def __len__(self):
+        return self._contar()
+
+    def clear(self):
+        with self._trava:
+            self._cache.clear()
+            self._vivos.clear()
+
+    def residentes(self) -> list:
+        """os produtos que estão em memória agora (no cache ou ainda em uso), sem ir ao banco"""
+        with self._trava:
+            return list(self._vivos.values())
+
+
+class CatalogoDocumentos(CatalogoProdutos):
+    """
+    O mesmo cache, para os documentos (OCs, transferências, montagens, vendas, devoluções) no catálogo sob demanda:
+    documento_id -> documento lido do banco com os itens quando alguém pede, só os usados por último guardados.
+    """
+
+
+class ReferenciaProduto:
+    """
+    Produto de um documento (venda, OC, transferência, histórico...) guardado só pelo id, no catálogo sob demanda:
+    cada acesso a um atributo pede o produto ao catálogo. Assim milhares de documentos carregados não seguram o
+    catálogo inteiro em memória (um Produto de verdade no documento nunca sairia do WeakValueDictionary).
+    """
+    __slots__ = ('id', '_catalogo')
+
+    def __init__(self, produto_id: int, catalogo: CatalogoProdutos):
+        self.id = produto_id
+        self._catalogo = catalogo
+
+    def __getattr__(self, nome):
+        # só é chamado pro que não é 'id': nome, preços, estoque... vêm do produto atual no catálogo
+        return getattr(self._catalogo[self.id], nome)
+
+    def __eq__(self, outro):
+        return getattr(outro, 'id', None) == self.id and hasattr(outro, 'tipoProduto')
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return str(self._catalogo[self.id])
+
+    def __repr__(self):
+        return f"ReferenciaProduto({self.id})"
@@ -5,11 +5,13 @@
 # daí vem o nome "peba" do repositório
 
 import os
+from bisect import bisect_left, bisect_right
 from datetime import datetime, time
 
 from manager import GerenciadorEstoque
-from models import Produto, Localizacao, OrdemCompra, Devolucao # Para type hints e checagens de instância
-from config import REPORTLAB_DISPONIVEL # Flag para saber se pode gerar PDF
+from models import Produto, Localizacao, OrdemCompra, Devolucao, Pagina # Para type hints e checagens de instância
+from config import REPORTLAB_DISPONIVEL, PAGINA_TAMANHO, BUSCA_RESULTADOS # Flag para saber se pode gerar PDF
+from backup import GerenciadorBackup
 
 # Condicional para importar o ReportLab apenas se disponível.
 if REPORTLAB_DISPONIVEL:
@@ -24,6 +26,8 @@ class CliApp:
 
     def __init__(self, gerenciador: GerenciadorEstoque):
         self.gerenciador = gerenciador
+        # backups online do banco, rodando em segundo plano
+        self.backup = GerenciadorBackup(gerenciador.db)
         # O dicionário 'self.barcode_buffer' simula a espera pelo Enter do scanner
         self.barcode_buffer = ""
 
@@ -79,8 +83,7 @@ class CliApp:
             print("Nenhum item disponível.")
             return None
 
-        # Itera sobre os valores do dicionário, ordenados pelo ID.
-        for item_obj in sorted(dicionario.values(), key=lambda item: item.id):
+        def imprimir(item_obj):
             # Verifica se o item é uma Localização e se temos um produto como contexto
             if isinstance(item_obj, Localizacao) and contexto_produto:
                 estoque_no_local = contexto_produto.estoque_por_local.get(item_obj.nome, 0)
@@ -89,14 +92,130 @@ class CliApp:
                 # Comportamento padrão para Produtos e outros objetos
                 print(str(item_obj))
 
+        prompt = prompt_personalizado if prompt_personalizado is not None else "Digite o ID do item desejado (ou 0 para cancelar): "
+        if len(dicionario) <= PAGINA_TAMANHO:
+            # Itera sobre os valores do dicionário, ordenados pelo ID.
+            for item_obj in sorted(dicionario.values(), key=lambda item: item.id):
+                imprimir(item_obj)
+            while True:
+                id_selecionado = self._obter_input(prompt, tipo='int')
+                if id_selecionado == 0:
+                    return None
+                if id_selecionado in dicionario:
+                    return id_selecionado
+                print("ID inválido. Tente novamente.")
+
+        # lista grande: mostra uma página por vez (o catálogo inteiro vem paginado do banco)
+        g = self.gerenciador
+        listagens = {id(g.produtos): g.listar_produtos, id(g.vendas): g.listar_vendas, id(g.ordens_compra): g.listar_ordens_compra,
+                     id(g.devolucoes): g.listar_devolucoes, id(g.transferencias): g.listar_transferencias}
+        if listar := listagens.get(id(dicionario)):
+            buscar = lambda **cursor: listar(limite=PAGINA_TAMANHO, **cursor)
+        else:
+            buscar = self._paginador_em_memoria(dicionario)
+        pagina = buscar()
+        while True:
+            for item_obj in pagina.itens:
+                imprimir(item_obj)
+            navegacao = ("[p] próxima  " if pagina.tem_proxima else "") + ("[a] anterior  " if pagina.tem_anterior else "")
+            if navegacao:
+                print(navegacao.strip())
+            while True:
+                valor = input(prompt).strip().lower()
+                if valor == 'p' and pagina.tem_proxima:
+                    pagina = buscar(depois_de=pagina.ultimo_id)
+                    break
+                if valor == 'a' and pagina.tem_anterior:
+                    pagina = buscar(antes_de=pagina.primeiro_id)
+                    break
+                try:
+                    id_selecionado = int(valor)
+                except ValueError:
+                    print("Erro: Por favor, insira um número inteiro válido.")
+                    continue
+                if id_selecionado == 0:
+                    return None
+                if id_selecionado in dicionario:
+                    return id_selecionado
+                print("ID inválido. Tente novamente.")
+            print()
+
+    @staticmethod
+    def _paginador_em_memoria(dicionario: dict):
+        """páginas por cursor (mesma interface das listagens do gerenciador) sobre um dicionário já em memória"""
+        ids = sorted(dicionario)
+
+        def buscar(depois_de: int | None = None, antes_de: int | None = None) -> Pagina:
+            if antes_de is not None:
+                fim = bisect_left(ids, antes_de)
+                inicio = max(0, fim - PAGINA_TAMANHO)
+            else:
+                inicio = bisect_right(ids, depois_de) if depois_de is not None else 0
+                fim = inicio + PAGINA_TAMANHO
+            return Pagina([dicionario[i] for i in ids[inicio:fim]], tem_anterior=inicio > 0, tem_proxima=fim < len(ids))
+        return buscar
+
+    @staticmethod
+    def _juntar_paginas(buscar) -> dict:
+        """
+        Junta num dicionário {id: item} todas as páginas de uma listagem filtrada do gerenciador, pra seleção
+        numa lista curta (ex: só os documentos em aberto) sem percorrer os documentos todos em memória.
+        """
+        itens, pagina = {}, buscar()
+        while True:
+            itens.update((item.id, item) for item in pagina.itens)
+            if not pagina.tem_proxima:
+                return itens
+            pagina = buscar(depois_de=pagina.ultimo_id)
+
+    def _navegar_paginas(self, buscar, imprimir):
+        """
+        Mostra uma listagem paginada do gerenciador: buscar(depois_de=..., antes_de=...) devolve a Pagina
+        e imprimir(item) mostra um item. O usuário anda com [p] próxima e [a] anterior; Enter sai.
+        """
+        pagina = buscar()
+        if not pagina.itens:
+            print("Nenhum item encontrado.")
+            return
+        while True:
+            for item in pagina.itens:
+                imprimir(item)
+            opcoes = ("[p] próxima  " if pagina.tem_proxima else "") + ("[a] anterior  " if pagina.tem_anterior else "")
+            if not opcoes:
+                return
+            escolha = input(f"\n{opcoes}[Enter] sair: ").strip().lower()
+            if escolha == 'p' and pagina.tem_proxima:
+                pagina = buscar(depois_de=pagina.ultimo_id)
+            elif escolha == 'a' and pagina.tem_anterior:
+                pagina = buscar(antes_de=pagina.primeiro_id)
+            elif not escolha:
+                return
+            print()
+
+    def _selecionar_produto(self, titulo: str, filtro=None, detalhe=None) -> int | None:
+        """
+        Seleção de produto por busca: o usuário digita parte do nome, da categoria ou do código de barras
+        e escolhe pelo número entre os primeiros resultados (ou digita de novo para refinar).
+        filtro(produto) restringe quem aparece; detalhe(produto) é um texto extra ao lado de cada um.
+        Retorna o ID do produto, ou None se o usuário sair com Enter ou 0.
+        """
+        print(f"\n--- {titulo} ---")
+        resultados: list[Produto] = []
         while True:
-            prompt = prompt_personalizado if prompt_personalizado is not None else "Digite o ID do item desejado (ou 0 para cancelar): "
-            id_selecionado = self._obter_input(prompt, tipo='int')
-            if id_selecionado == 0:
+            escolher = f"1-{len(resultados)} escolhe da lista, " if resultados else ""
+            valor = input(f"\nDigite parte do nome, categoria ou código de barras ({escolher}Enter ou 0 para sair): ").strip()
+            if not valor or valor == '0':
                 return None
-            if id_selecionado in dicionario:
-                return id_selecionado
-            print("ID inválido. Tente novamente.")
+            if valor.isdigit() and 1 <= int(valor) <= len(resultados):
+                return resultados[int(valor) - 1].id
+
+            resultados = self.gerenciador.buscar_produtos(valor, BUSCA_RESULTADOS, filtro)
+            if not resultados:
+                print(f"Nenhum produto encontrado para '{valor}'.")
+                continue
+            for numero, produto in enumerate(resultados, 1):
+                extra = detalhe(produto) if detalhe else ""
+                print(f"  {numero:>2}. [ID {produto.id}] {produto.nome} ({produto.categoria or 'sem categoria'}) {extra}".rstrip())
 
     # --- Funções de Menu ---
     def run(self):
@@ -119,7 +238,8 @@ class CliApp:
             print("5. Gerenciar Ordens de Compra")
             print("6. Gerar Relatórios")
             print("7. Gerenciar Devoluções e Trocas")
-            print("8. Sair")
+            print("8. Manutenção do Banco de Dados")
+            print("9. Sair")
 
             escolha = self._obter_input("\nEscolha uma opção: ")
 
@@ -130,7 +250,8 @@ class CliApp:
             elif escolha == '5': self._menu_ordens_compra()
             elif escolha == '6': self._menu_relatorios()
             elif escolha == '7': self._menu_devolucoes()
-            elif escolha == '8':
+            elif escolha == '8': self._menu_manutencao()
+            elif escolha == '9':
                 print("Saindo do sistema...")
                 break
             else:
@@ -144,10 +265,13 @@ class CliApp:
             print("1. Listar todos os produtos (Individuais e Kits)")
             print("2. Adicionar novo produto/kit")
             print("3. Atualizar produto/kit existente")
-            print("4. Gerenciar Composição de Kits") 
+            print("4. Gerenciar Kits (composição e montagem)")
             print("5. Remover produto/kit")
             print("6. Buscar produto por Código de Barras")
             print("7. Registrar Entrada Manual de Estoque (Apenas produtos individuais)")
+            print("8. Importar cadastro em lote (CSV)")
+            print("9. Conciliar Contagem Física de Inventário")
+            print("10. Atualizar preços/ressuprimento em lote")
             print("0. Voltar ao Menu Principal")
 
             escolha = self._obter_input("\nEscolha uma opção: ")
@@ -159,21 +283,79 @@ class CliApp:
             elif escolha == '5': self._remover_produto()
             elif escolha == '6': self._buscar_por_barcode()
             elif escolha == '7': self._registrar_entrada_manual()
+            elif escolha == '8': self._importar_csv()
+            elif escolha == '9': self._conciliar_inventario()
+            elif escolha == '10': self._atualizar_em_lote()
             elif escolha == '0': break
             else: print("Opção inválida!")
             self._esperar_enter()
             
     def _menu_kits(self):
-        """Submenu para gerenciar a composição dos kits."""
+        """Submenu dos kits: composição e ordens de montagem/desmontagem (kits prontos em estoque)."""
+        while True:
+            self._imprimir_cabecalho("Gerenciar Kits")
+            print("1. Definir composição de um kit")
+            print("2. Montar kits (componentes -> kits prontos)")
+            print("3. Desmontar kits (kits prontos -> componentes)")
+            print("4. Listar ordens de montagem/desmontagem")
+            print("0. Voltar")
+
+            escolha = self._obter_input("\nEscolha uma opção: ")
+
+            if escolha == '1': self._definir_composicao_kit()
+            elif escolha == '2': self._ordem_montagem(desmontar=False)
+            elif escolha == '3': self._ordem_montagem(desmontar=True)
+            elif escolha == '4': self._listar_ordens_montagem()
+            elif escolha == '0': break
+            else: print("Opção inválida!")
+            self._esperar_enter()
+
+    def _ordem_montagem(self, desmontar: bool):
+        """Monta (ou desmonta) kits numa localização, convertendo o estoque dos componentes no do kit pronto."""
+        self._imprimir_cabecalho("Desmontar Kits" if desmontar else "Montar Kits")
+        if not self.gerenciador.contar_produtos(tipo='kit', com_componentes=True):
+            print("Nenhum kit com componentes cadastrado.")
+            return
+        kit_id = self._selecionar_produto("Busque o kit", filtro=lambda p: p.tipoProduto == 'kit' and p.componentes)
+        if kit_id is None:
+            return
+        local_id = self._selecionar_em_lista("Selecione a localização", self.gerenciador.localizacoes)
+        if local_id is None:
+            return
+        kit, local = self.gerenciador.produtos[kit_id], self.gerenciador.localizacoes[local_id]
+        print(f"\nKits prontos em '{local.nome}': {kit.estoque_por_local.get(local.nome, 0)}")
+        print(f"Disponível para venda (prontos + montáveis): {self.gerenciador.estoque_kit_no_local(kit_id, local_id)}")
+        quantidade = self._obter_input("Quantidade: ", tipo='int')
+        if not quantidade or quantidade <= 0:
+            print("Quantidade inválida.")
+            return
+        try:
+            if desmontar:
+                ordem = self.gerenciador.desmontar_kits(kit_id, local_id, quantidade)
+            else:
+                ordem = self.gerenciador.montar_kits(kit_id, local_id, quantidade)
+            print(f"\n{ordem}")
+        except ValueError as e:
+            print(f"\nErro: {e}")
+
+    def _listar_ordens_montagem(self):
+        """Exibe as ordens de montagem e desmontagem, das mais recentes para as mais antigas."""
+        self._imprimir_cabecalho("Ordens de Montagem/Desmontagem")
+        if not self.gerenciador.ordens_montagem:
+            print("Nenhuma ordem de montagem registrada.")
+            return
+        self._navegar_paginas(lambda **cursor: self.gerenciador.listar_ordens_montagem(limite=PAGINA_TAMANHO, **cursor), print)
+
+    def _definir_composicao_kit(self):
+        """Define (substitui) a lista de componentes de um kit."""
         self._imprimir_cabecalho("Gerenciar Composição de Kits")
 
         # Filtra para mostrar apenas produtos que são kits
-        kits_disponiveis = {pid: p for pid, p in self.gerenciador.produtos.items() if p.tipoProduto == 'kit'}
-        if not kits_disponiveis:
+        if not self.gerenciador.contar_produtos(tipo='kit'):
             print("Nenhum kit cadastrado. Crie um kit no menu 'Adicionar novo produto/kit'.")
             return
 
-        kit_id = self._selecionar_em_lista("Selecione o Kit para gerenciar", kits_disponiveis)
+        kit_id = self._selecionar_produto("Busque o Kit para gerenciar", filtro=lambda p: p.tipoProduto == 'kit')
         if kit_id is None:
             return
 
@@ -193,22 +375,21 @@ class CliApp:
         print("(A lista de componentes atual será substituída pela nova)")
 
         novos_componentes = []
-        # Filtra para mostrar apenas produtos individuais como possíveis componentes
-        produtos_individuais = {pid: p for pid, p in self.gerenciador.produtos.items() if p.tipoProduto == 'individual'}
-
         while True:
-            comp_id = self._selecionar_em_lista(
-                "Selecione um produto para adicionar como componente",
-                produtos_individuais,
-                prompt_personalizado="\nDigite o ID do componente (ou 0 para finalizar): "
+            # Qualquer produto pode ser componente, inclusive outro kit (o gerenciador recusa se formar um ciclo)
+            comp_id = self._selecionar_produto(
+                "Busque um produto para adicionar como componente (Enter para finalizar)",
+                filtro=lambda p: p.id != kit_id,
+                detalhe=lambda p: "(Kit)" if p.tipoProduto == 'kit' else ""
             )
             if comp_id is None:
                 break
 
-            quantidade = self._obter_input(f"Quantidade de '{produtos_individuais[comp_id].nome}' por kit: ", tipo='int')
+            componente = self.gerenciador.produtos[comp_id]
+            quantidade = self._obter_input(f"Quantidade de '{componente.nome}' por kit: ", tipo='int')
             if quantidade > 0:
                 novos_componentes.append({'produto_id': comp_id, 'quantidade': quantidade})
-                print(f"Adicionado: {quantidade}x {produtos_individuais[comp_id].nome}")
+                print(f"Adicionado: {quantidade}x {componente.nome}")
             else:
                 print("Quantidade deve ser maior que zero.")
 
@@ -252,6 +433,9 @@ class CliApp:
             print("3. Atualizar localização existente")
             print("4. Remover localização")
             print("5. Realizar Transferência de Estoque (Produtos Individuais)")
+            print("6. Nova Transferência com Vários Itens (Documento)")
+            print("7. Receber/Cancelar Transferência em Trânsito")
+            print("8. Listar Transferências")
             print("0. Voltar ao Menu Principal")
 
             escolha = self._obter_input("\nEscolha uma opção: ")
@@ -261,6 +445,9 @@ class CliApp:
             elif escolha == '3': self._atualizar_localizacao()
             elif escolha == '4': self._remover_localizacao()
             elif escolha == '5': self._realizar_transferencia()
+            elif escolha == '6': self._criar_documento_transferencia()
+            elif escolha == '7': self._encerrar_transferencia()
+            elif escolha == '8': self._listar_transferencias()
             elif escolha == '0': break
             else: print("Opção inválida!")
             self._esperar_enter()
@@ -273,6 +460,7 @@ class CliApp:
             print("2. Criar nova OC")
             print("3. Atualizar status de uma OC")
             print("4. Visualizar/Salvar recibo de uma OC")
+            print("5. Receber OCs em Lote (permite recebimento parcial)")
             print("0. Voltar ao Menu Principal")
 
             escolha = self._obter_input("\nEscolha uma opção: ")
@@ -281,6 +469,7 @@ class CliApp:
             elif escolha == '2': self._criar_oc()
             elif escolha == '3': self._atualizar_status_oc()
             elif escolha == '4': self._visualizar_salvar_oc()
+            elif escolha == '5': self._receber_ocs_em_lote()
             elif escolha == '0': break
             else: print("Opção inválida!")
             self._esperar_enter()
@@ -294,7 +483,8 @@ class CliApp:
                 "Produtos com Baixo Estoque", "Produtos Mais Vendidos",
                 "Relatório de Vendas por Período", "Relatório de Devoluções por Motivo", 
                 "Relatório de Kits Mais Vendidos", "Relatório de Componentes Limitantes de Kits",
-                "Histórico de Movimentação"
+                "Histórico de Movimentação", "Verificar Consistência do Estoque",
+                "Valor do Inventário em uma Data"
             ]
             for i, tipo in enumerate(tipos, 1):
                 print(f"{i}. {tipo}")
@@ -316,6 +506,10 @@ class CliApp:
                     self._menu_historico_movimentacoes()
                 elif nome_relatorio == "Relatório de Vendas por Período":
                     self._gerar_relatorio_vendas_por_periodo()
+                elif nome_relatorio == "Verificar Consistência do Estoque":
+                    self._verificar_consistencia_estoque()
+                elif nome_relatorio == "Valor do Inventário em uma Data":
+                    self._gerar_relatorio_valor_em_data()
                 else:
                     self._gerar_relatorio_detalhado(nome_relatorio)
                 self._esperar_enter()
@@ -330,15 +524,28 @@ class CliApp:
             print("1. Por Produto")
             print("2. Por Fornecedor")
             print("3. Por Localização")
+            print("4. Últimas movimentações (página por página)")
             print("0. Voltar")
 
             escolha = self._obter_input("\nEscolha o tipo de filtro para o histórico: ", tipo='int')
             if escolha == 1: self._exibir_historico_por_produto()
             elif escolha == 2: self._exibir_historico_por_fornecedor()
             elif escolha == 3: self._exibir_historico_por_localizacao()
+            elif escolha == 4: self._navegar_movimentacoes()
             elif escolha == 0: break
             else: print("Opção inválida!"); self._esperar_enter()
 
+    def _navegar_movimentacoes(self):
+        """Mostra o histórico de movimentações do mais recente pro mais antigo, uma página por vez."""
+        self._imprimir_cabecalho("Últimas Movimentações")
+
+        def imprimir(mov):
+            print(f"{mov.data.strftime('%d/%m/%Y %H:%M')} | {mov.tipo:<22} | {mov.quantidade:>6} | "
+                  f"{mov.produto.nome} @ {mov.localizacao.nome}")
+
+        self._navegar_paginas(lambda **cursor: self.gerenciador.listar_movimentos(limite=PAGINA_TAMANHO, **cursor), imprimir)
+        self._esperar_enter()
+
     def _exibir_historico_por_produto(self):
         """Exibe o histórico de movimentação para um produto específico."""
         produto_id = self._selecionar_em_lista("Selecione o produto", self.gerenciador.produtos)
@@ -385,50 +592,85 @@ class CliApp:
             else: print("Opção inválida!")
             self._esperar_enter()
 
+    def _menu_manutencao(self):
+        """Exibe o submenu de manutenção do banco de dados."""
+        while True:
+            self._imprimir_cabecalho("Manutenção do Banco de Dados")
+            print("1. Arquivar histórico de movimentações antigo")
+            print("2. Fazer backup do banco (em segundo plano)")
+            print("3. Status do backup e backups existentes")
+            print("4. Importar log de vendas do PDV (JSONL)")
+            print("5. Feed de eventos: consumidores e compactação")
+            print("0. Voltar ao Menu Principal")
+
+            escolha = self._obter_input("\nEscolha uma opção: ")
+
+            if escolha == '1': self._arquivar_historico()
+            elif escolha == '2': self._iniciar_backup()
+            elif escolha == '3': self._status_backup()
+            elif escolha == '4': self._ingerir_log_vendas()
+            elif escolha == '5': self._feed_eventos()
+            elif escolha == '0': break
+            else: print("Opção inválida!")
+            self._esperar_enter()
+
     # --- Implementação das Ações ---
 
     # Produtos
     def _listar_produtos(self):
         """Exibe uma lista detalhada de todos os produtos cadastrados."""
         self._imprimir_cabecalho("Lista de Produtos (Individuais e Kits)")
-        produtos = self.gerenciador.produtos
-        if not produtos:
+        if not self.gerenciador.produtos:
             print("Nenhum produto cadastrado.")
             return
 
-        separador = "-" * 40
-        for p in sorted(produtos.values(), key=lambda x: x.id):
-            print(separador)
-            print(f"ID: {p.id}")
-            print(f"Nome: {p.nome}")
-            
-            tipo_str = "Kit" if p.tipoProduto == 'kit' else "Individual"
-            print(f"Tipo: {tipo_str}")
-            
-            print(f"Categoria: {p.categoria}")
-            print(f"Fornecedor: {p.fornecedor.nome} ({p.fornecedor.empresa})")
-            print(f"Preço Venda: R$ {p.preco_venda:,.2f}")
-            
-            estoque_calculado = p.get_estoque_total()
-            if p.tipoProduto == 'kit':
-                print(f"Estoque Montável: {estoque_calculado} unidades (calculado)")
-                if componentes := p.componentes:
-                    print("Componentes do Kit:")
-                    for comp in componentes:
-                        print(f"  - {comp.quantidade}x {comp.produto.nome} (Estoque: {comp.produto.get_estoque_total()})")
-                else:
-                    print("  - Kit sem componentes definidos.")
+        filtro = self._obter_input("Filtrar por nome, categoria ou código (Enter = todos): ", obrigatorio=False)
+        ordenacao = 'nome' if self._obter_input("Ordenar por (1) ID (2) Nome [1]: ", obrigatorio=False) == '2' else 'id'
+        self._navegar_paginas(
+            lambda **cursor: self.gerenciador.listar_produtos(limite=PAGINA_TAMANHO, filtro=filtro, ordenacao=ordenacao, **cursor),
+            self._imprimir_produto)
+
+    def _imprimir_produto(self, p: Produto):
+        """Mostra os detalhes de um produto (ou kit) na listagem."""
+        print("-" * 40)
+        print(f"ID: {p.id}")
+        print(f"Nome: {p.nome}")
+        
+        tipo_str = "Kit" if p.tipoProduto == 'kit' else "Individual"
+        print(f"Tipo: {tipo_str}")
+        
+        print(f"Categoria: {p.categoria}")
+        print(f"Fornecedor: {p.fornecedor.nome} ({p.fornecedor.empresa})")
+        print(f"Preço Venda: R$ {p.preco_venda:,.2f}")
+        
+        estoque_calculado = p.get_estoque_total()
+        if p.tipoProduto == 'kit':
+            print(f"Estoque Montável: {estoque_calculado} unidades (calculado, {p.get_estoque_montado()} já montada(s))")
+            # o kit só é vendido onde os componentes estão juntos: mostra os prontos + montáveis em cada local
+            if montavel_por_local := self.gerenciador.estoque_kit_por_local(p.id):
+                for loc, qtd in montavel_por_local.items():
+                    prontos = p.estoque_por_local.get(loc, 0)
+                    print(f"   - {loc}: {qtd} disponível(is)" + (f" ({prontos} pronto(s))" if prontos else ""))
             else:
-                print(f"Estoque Total: {estoque_calculado} unidades")
-                print("Estoque por Local:")
-                estoque_local_items = p.estoque_por_local.items()
-                if any(qtd > 0 for _, qtd in estoque_local_items):
-                    for loc, qtd in estoque_local_items:
-                        if qtd > 0:
-                            print(f"   - {loc}: {qtd} unidades")
-                else:
-                    print("   - Nenhum estoque registrado.")
-        print(separador)
+                print("   - Nenhuma localização com todos os componentes.")
+            if componentes := p.componentes:
+                print("Componentes do Kit:")
+                for comp in componentes:
+                    print(f"  - {comp.quantidade}x {comp.produto.nome} (Estoque: {comp.produto.get_estoque_total()})")
+            else:
+                print("  - Kit sem componentes definidos.")
+        else:
+            print(f"Estoque Total: {estoque_calculado} unidades")
+            print("Estoque por Local:")
+            estoque_local_items = p.estoque_por_local.items()
+            if any(qtd > 0 for _, qtd in estoque_local_items):
+                for loc, qtd in estoque_local_items:
+                    if qtd > 0:
+                        local = next((l for l in self.gerenciador.localizacoes.values() if l.nome == loc), None)
+                        reservado = self.gerenciador.reservado(p.id, local.id) if local else 0
+                        print(f"   - {loc}: {qtd} unidades" + (f" ({reservado} reservada(s))" if reservado else ""))
+            else:
+                print("   - Nenhum estoque registrado.")
 
 
     def _adicionar_produto(self):
@@ -494,7 +736,7 @@ class CliApp:
                 print("\nAgora, vamos definir os componentes deste kit.")
                 self._esperar_enter()
                 # Chamar a função que edita os componentes, passando o novo kit.
-                self._menu_kits()
+                self._definir_composicao_kit()
 
 
         except Exception as e:
@@ -543,7 +785,7 @@ class CliApp:
             print("\nProduto/Kit atualizado com sucesso!")
             
             if p.tipoProduto == 'kit':
-                print("\nPara alterar os componentes, use a opção 'Gerenciar Composição de Kits'.")
+                print("\nPara alterar os componentes, use a opção 'Gerenciar Kits'.")
 
         except Exception as e:
             print(f"\nErro ao atualizar produto: {e}")
@@ -591,12 +833,11 @@ class CliApp:
         self._imprimir_cabecalho("Registrar Entrada Manual de Estoque")
         
         # Filtra para permitir entrada apenas em produtos individuais
-        produtos_individuais = {pid: p for pid, p in self.gerenciador.produtos.items() if p.tipoProduto == 'individual'}
-        if not produtos_individuais:
+        if not self.gerenciador.contar_produtos(tipo='individual'):
             print("Nenhum produto individual cadastrado para adicionar estoque.")
             return
 
-        produto_id = self._selecionar_em_lista("Selecione o produto (apenas individuais)", produtos_individuais)
+        produto_id = self._selecionar_produto("Busque o produto (apenas individuais)", filtro=lambda p: p.tipoProduto == 'individual')
         if produto_id is None: return
 
         produto_selecionado = self.gerenciador.produtos[produto_id]
@@ -615,11 +856,107 @@ class CliApp:
                 return
 
             self.gerenciador.movimentar_estoque(produto_id, local_id, quantidade, "Entrada Manual")
+            # com a escrita adiada, só confirma pro usuário depois que a entrada estiver gravada no banco
+            self.gerenciador.sincronizar_escrita()
             print("\nEntrada de estoque registrada com sucesso!")
         except Exception as e:
             print(f"\nErro ao registrar entrada: {e}")
 
 
+    def _importar_csv(self):
+        """Importa fornecedores, produtos e estoque inicial de arquivos CSV (deixe em branco o que não for importar)."""
+        self._imprimir_cabecalho("Importar Cadastro em Lote (CSV)")
+        print("Colunas esperadas (com cabeçalho):")
+        print(" - Fornecedores: nome, empresa, telefone, email, morada")
+        print(" - Produtos: nome, descricao, categoria, codigo_barras, preco_compra, preco_venda,")
+        print("   ponto_ressuprimento, fornecedor (empresa), tipo (individual/kit), componentes (codigo:qtd|codigo:qtd)")
+        print(" - Estoque: codigo_barras, localizacao (nome), quantidade (de kit, os kits já montados)\n")
+        fornecedores = self._obter_input("Arquivo de fornecedores: ", obrigatorio=False)
+        produtos = self._obter_input("Arquivo de produtos: ", obrigatorio=False)
+        estoque = self._obter_input("Arquivo de estoque inicial: ", obrigatorio=False)
+        if not (fornecedores or produtos or estoque):
+            print("\nImportação cancelada.")
+            return
+        try:
+            resultado = self.gerenciador.importar_csv(fornecedores or None, produtos or None, estoque or None)
+        except (OSError, ValueError) as e:
+            print(f"\nErro na importação (nada foi gravado): {e}")
+            return
+        print(f"\n{resultado}")
+        for arquivo, linha, motivo in resultado.rejeitadas:
+            print(f"   - {arquivo}, linha {linha}: {motivo}")
+
+    def _conciliar_inventario(self):
+        """Compara um arquivo de contagem física com o sistema, mostra a prévia e lança os ajustes se confirmado."""
+        self._imprimir_cabecalho("Conciliar Contagem Física de Inventário")
+        print("Colunas do arquivo (com cabeçalho): codigo_barras (ou produto_id), localizacao (nome ou ID), quantidade")
+        arquivo = self._obter_input("Arquivo de contagem (deixe em branco para cancelar): ", obrigatorio=False)
+        if not arquivo:
+            print("\nConciliação cancelada.")
+            return
+        try:
+            conciliacao = self.gerenciador.conciliar_contagem(arquivo)
+        except OSError as e:
+            print(f"\nErro ao ler o arquivo: {e}")
+            return
+
+        print("\n" + self.gerenciador.gerar_relatorio_conciliacao(conciliacao))
+        if not conciliacao.divergencias:
+            print("Nenhum ajuste necessário.")
+            return
+        if self._obter_input("Lançar os ajustes de inventário? (s/n): ").lower() != 's':
+            print("\nNenhum ajuste lançado.")
+            return
+        try:
+            lancados, alertas = self.gerenciador.aplicar_ajustes_inventario(conciliacao)
+            print(f"\n{lancados} ajuste(s) de inventário lançado(s) com sucesso!")
+            if alertas:
+                print("Alerta de baixo estoque para:", ", ".join(p.nome for p in alertas))
+        except ValueError as e:
+            print(f"\nErro ao lançar ajustes (nada foi gravado): {e}")
+
+    def _atualizar_em_lote(self):
+        """Reajusta preço ou ponto de ressuprimento de vários produtos de uma vez (por fornecedor, categoria ou IDs)."""
+        self._imprimir_cabecalho("Atualizar em Lote")
+        campos = {'1': 'preco_compra', '2': 'preco_venda', '3': 'ponto_ressuprimento'}
+        print("1. Preço de compra  2. Preço de venda  3. Ponto de ressuprimento")
+        if not (campo := campos.get(self._obter_input("Campo: "))):
+            print("Opção inválida!")
+            return
+        modos = {'1': 'definir', '2': 'percentual', '3': 'delta'}
+        print("1. Definir valor  2. Reajuste percentual (ex: 10 ou -5)  3. Somar/subtrair valor")
+        if not (modo := modos.get(self._obter_input("Modo: "))):
+            print("Opção inválida!")
+            return
+        valor = self._obter_input("Valor: ", tipo='float')
+
+        print("\nSeleção (deixe em branco o que não quiser filtrar):")
+        fornecedor_id = None
+        if self._obter_input("Filtrar por fornecedor? (s/n): ").lower() == 's':
+            if (fornecedor_id := self._selecionar_em_lista("Fornecedores", self.gerenciador.fornecedores)) is None:
+                return
+        categorias = self.gerenciador.get_todas_categorias()
+        if categorias:
+            print("Categorias: " + ", ".join(categorias))
+        categoria = self._obter_input("Categoria: ", obrigatorio=False)
+        ids_texto = self._obter_input("IDs dos produtos (separados por vírgula): ", obrigatorio=False)
+        try:
+            produto_ids = [int(i) for i in ids_texto.split(',') if i.strip()] if ids_texto else None
+        except ValueError:
+            print("\nErro: IDs inválidos.")
+            return
+
+        try:
+            alterados = self.gerenciador.atualizar_em_lote(campo, modo, valor, fornecedor_id=fornecedor_id,
+                                                           categoria=categoria, produto_ids=produto_ids)
+        except ValueError as e:
+            print(f"\nErro: {e}")
+            return
+        print(f"\n{len(alterados)} produto(s) atualizado(s).")
+        if campo == 'preco_compra' and alterados:
+            print("O preço de compra dos kits que usam esses produtos foi recalculado.")
+
+
     # Fornecedores
     def _listar_fornecedores(self):
         """Exibe uma lista de todos os fornecedores."""
@@ -763,15 +1100,12 @@ class CliApp:
 
     def _realizar_transferencia(self):
         """Guia o usuário no processo de transferir estoque entre localizações."""
-        self._imprimir_cabecalho("Transferir Estoque (Produtos Individuais)")
+        self._imprimir_cabecalho("Transferir Estoque")
         try:
-            # Filtra para permitir transferência apenas de produtos individuais
-            produtos_individuais = {pid: p for pid, p in self.gerenciador.produtos.items() if p.tipoProduto == 'individual'}
-            if not produtos_individuais:
-                print("Nenhum produto individual disponível para transferência.")
-                return
-
-            produto_id = self._selecionar_em_lista("Selecione o produto a ser transferido", produtos_individuais)
+            # kit só entra se tiver kits já montados (é o estoque próprio dele que é transferido)
+            produto_id = self._selecionar_produto(
+                "Busque o produto a ser transferido", filtro=lambda p: p.tipoProduto == 'individual' or p.get_estoque_montado() > 0,
+                detalhe=lambda p: f"- estoque total {p.get_estoque_total() if p.tipoProduto == 'individual' else p.get_estoque_montado()}")
             if produto_id is None: return
 
             produto_selecionado = self.gerenciador.produtos[produto_id]
@@ -799,10 +1133,89 @@ class CliApp:
         except Exception as e:
             print(f"\nErro na transferência: {e}")
 
+    def _criar_documento_transferencia(self):
+        """Monta um documento de transferência com vários produtos, validado e gravado de uma vez só."""
+        self._imprimir_cabecalho("Nova Transferência (Documento)")
+        try:
+            print("\n--- Localização de ORIGEM ---")
+            origem_id = self._selecionar_em_lista("Selecione a localização de origem", self.gerenciador.localizacoes)
+            if origem_id is None: return
+            print("\n--- Localização de DESTINO ---")
+            destino_id = self._selecionar_em_lista("Selecione a localização de destino", self.gerenciador.localizacoes)
+            if destino_id is None: return
+
+            origem = self.gerenciador.localizacoes[origem_id]
+            # só aparecem os produtos que têm estoque na origem (de kit, os já montados)
+            def na_origem(p: Produto) -> bool:
+                return p.estoque_por_local.get(origem.nome, 0) > 0
+            if not self.gerenciador.contar_produtos(com_estoque=True, localizacao_id=origem_id):
+                print(f"\nNão há produtos com estoque em '{origem.nome}'.")
+                return
+
+            itens = []
+            while True:
+                print(f"\n--- Adicionar Item à Transferência ({len(itens)} item(ns) até agora) ---")
+                produto_id = self._selecionar_produto(
+                    "Busque o produto", filtro=na_origem,
+                    detalhe=lambda p: f"- {p.estoque_por_local.get(origem.nome, 0)} un. em {origem.nome}")
+                if produto_id is None: break
+                quantidade = self._obter_input("Quantidade a transferir: ", tipo='int')
+                itens.append({'produto_id': produto_id, 'quantidade': quantidade})
+                print(f"Item '{self.gerenciador.produtos[produto_id].nome}' adicionado.")
+                continuar = self._obter_input("Adicionar outro item? (s/n): ")
+                if continuar and continuar.lower() != 's': break
+
+            if not itens:
+                print("\nNenhum item. Transferência cancelada.")
+                return
+
+            em_transito = self._obter_input("A mercadoria vai ficar em trânsito até ser recebida no destino? (s/n): ").lower() == 's'
+            documento = self.gerenciador.criar_transferencia(origem_id, destino_id, itens, em_transito=em_transito)
+            print(f"\n{documento}")
+            print("Transferência registrada com sucesso!")
+        except Exception as e:
+            print(f"\nErro na transferência: {e}")
+
+    def _encerrar_transferencia(self):
+        """Recebe no destino (ou cancela, devolvendo à origem) uma transferência em trânsito."""
+        self._imprimir_cabecalho("Receber/Cancelar Transferência em Trânsito")
+        em_transito = self._juntar_paginas(lambda **cursor: self.gerenciador.listar_transferencias(
+            limite=PAGINA_TAMANHO, status="Em Trânsito", ordenacao='antigos', **cursor))
+        if not em_transito:
+            print("Nenhuma transferência em trânsito.")
+            return
+        transferencia_id = self._selecionar_em_lista("Selecione a transferência", em_transito)
+        if transferencia_id is None: return
+
+        documento = em_transito[transferencia_id]
+        for item in documento.itens:
+            print(f" - {item.quantidade}x {item.produto.nome}")
+        acao = self._obter_input("\n(R)eceber no destino ou (C)ancelar e devolver à origem? ").lower()
+        try:
+            if acao == 'r':
+                self.gerenciador.receber_transferencia(transferencia_id)
+                print(f"\nTransferência recebida em '{documento.destino.nome}'.")
+            elif acao == 'c':
+                self.gerenciador.cancelar_transferencia(transferencia_id)
+                print(f"\nTransferência cancelada; mercadoria devolvida a '{documento.origem.nome}'.")
+            else:
+                print("\nNada foi alterado.")
+        except Exception as e:
+            print(f"\nErro: {e}")
+
+    def _listar_transferencias(self):
+        """Lista os documentos de transferência, mais recentes primeiro."""
+        self._imprimir_cabecalho("Lista de Transferências")
+        if not self.gerenciador.transferencias:
+            print("Nenhuma transferência registrada.")
+            return
+        self._navegar_paginas(lambda **cursor: self.gerenciador.listar_transferencias(limite=PAGINA_TAMANHO, **cursor), print)
+
     # Vendas
     def _registrar_venda(self):
         """Gerencia a interface para registrar uma nova venda, item por item."""
         self._imprimir_cabecalho("Registrar Nova Venda")
+        carrinho = None
         try:
             local_id = self._selecionar_em_lista("Selecione o local da venda", self.gerenciador.localizacoes)
             if local_id is None:
@@ -813,59 +1226,36 @@ class CliApp:
             nome_cliente = self._obter_input("Nome do Cliente: ")
             local_selecionado = self.gerenciador.localizacoes[local_id]
 
-            # Dicionário para gerenciar o estado do estoque *durante* esta venda.
-            estoque_temporario = {}
-            for p in self.gerenciador.produtos.values():
-                 # Para kits, o estoque temporário é o estoque calculável. Para individuais, o estoque do local.
-                 if p.tipoProduto == 'kit':
-                     estoque_temporario[p.id] = p.get_estoque_total()
-                 else:
-                     estoque_temporario[p.id] = p.estoque_por_local.get(local_selecionado.nome, 0)
-
-            itens_venda = []
+            # O carrinho guarda o que a venda já comprometeu do estoque do local, então o disponível
+            # de cada produto/kit (inclusive kits que dividem componentes) já vem descontado.
+            # Cada item colocado nele fica reservado, pra outro caixa não vender a mesma unidade.
+            carrinho = self.gerenciador.novo_carrinho(local_id)
 
             while True:
                 self._imprimir_cabecalho(f"Venda em andamento - Local: {local_selecionado.nome}")
                 print(f"Cliente: {nome_cliente}")
 
                 # Exibe o carrinho de compras atual
-                total_parcial = 0
-                if itens_venda:
+                if carrinho.itens:
                     print("\n--- Carrinho Atual ---")
-                    for item in itens_venda:
-                        produto_carrinho = self.gerenciador.produtos[item['produto_id']]
-                        subtotal_item = item['quantidade'] * produto_carrinho.preco_venda
-                        total_parcial += subtotal_item
-                        print(f"   - {item['quantidade']}x {produto_carrinho.nome} @ R$ {produto_carrinho.preco_venda:,.2f}")
+                    for item in carrinho.itens.values():
+                        print(f"   - {item.quantidade}x {item.produto.nome} @ R$ {item.preco_venda_unitario:,.2f}")
                     print(f"----------------------")
-                    print(f"Subtotal: R$ {total_parcial:,.2f}")
+                    print(f"Subtotal: R$ {carrinho.valor_total:,.2f}")
                 else:
                     print("\nCarrinho vazio.")
 
-                print("\n--- Adicionar Produto/Kit ---")
-                print("Itens disponíveis para venda:")
-                ids_disponiveis = [pid for pid, qtd in estoque_temporario.items() if qtd > 0]
-
-                if not ids_disponiveis:
-                    print("Nenhum produto com estoque restante para esta venda.")
-                else:
-                    produtos_disponiveis_dict = {pid: self.gerenciador.produtos[pid] for pid in ids_disponiveis}
-                    for produto in sorted(produtos_disponiveis_dict.values(), key=lambda p: p.nome):
-                          tipo_str = " (Kit)" if produto.tipoProduto == 'kit' else ""
-                          print(f"   {produto.id} - {produto.nome}{tipo_str} ({estoque_temporario[produto.id]})")
-
-                id_selecionado = self._obter_input("\nDigite o ID do produto/kit (ou 0 para finalizar): ", tipo='int')
+                # a busca só mostra o que ainda tem estoque disponível para esta venda
+                id_selecionado = self._selecionar_produto(
+                    "Adicionar Produto/Kit (Enter para finalizar)",
+                    filtro=lambda p: carrinho.disponivel(p) > 0,
+                    detalhe=lambda p: ("(Kit) " if p.tipoProduto == 'kit' else "") + f"- {carrinho.disponivel(p)} disponível(is)")
 
-                if id_selecionado == 0:
+                if id_selecionado is None:
                     break
 
-                if id_selecionado not in self.gerenciador.produtos:
-                    print("ID inválido. Tente novamente.")
-                    self._esperar_enter()
-                    continue
-
                 produto = self.gerenciador.produtos[id_selecionado]
-                estoque_disponivel_item = estoque_temporario.get(id_selecionado, 0)
+                estoque_disponivel_item = carrinho.disponivel(produto)
 
                 if estoque_disponivel_item <= 0:
                     print("Este item não tem mais estoque disponível para esta venda.")
@@ -883,38 +1273,17 @@ class CliApp:
                     else:
                         break
 
-                # Subtrai do estoque temporário
-                # Se for kit, precisa recalcular o estoque de outros kits que usam os mesmos componentes
-                estoque_temporario[id_selecionado] -= qtd_desejada
-                if produto.tipoProduto == 'kit':
-                    # Pega todos os componentes que foram "usados"
-                    componentes_usados = produto.componentes
-                    for _ in range(qtd_desejada): # Para cada kit vendido
-                        # Atualiza o estoque temporário dos componentes
-                        for comp in componentes_usados:
-                            estoque_temporario[comp.produto.id] -= comp.quantidade
-                    
-                    # Recalcula o estoque de todos os kits
-                    for p_id, p_obj in self.gerenciador.produtos.items():
-                        if p_obj.tipoProduto == 'kit':
-                            try:
-                                # Calcula o novo estoque possível baseado no estoque temporário dos componentes
-                                estoque_recalculado = min((estoque_temporario.get(c.produto.id, 0) // c.quantidade) for c in p_obj.componentes)
-                                estoque_temporario[p_id] = estoque_recalculado
-                            except (ValueError, ZeroDivisionError):
-                                estoque_temporario[p_id] = 0
-
-                # Adiciona ao carrinho
-                item_existente = next((item for item in itens_venda if item['produto_id'] == id_selecionado), None)
-                if item_existente:
-                    item_existente['quantidade'] += qtd_desejada
-                else:
-                    itens_venda.append({'produto_id': id_selecionado, 'quantidade': qtd_desejada})
-
+                try:
+                    self.gerenciador.adicionar_ao_carrinho(carrinho, produto.id, qtd_desejada)
+                except ValueError as e:
+                    # alguém reservou ou vendeu essas unidades enquanto a quantidade era digitada
+                    print(f"Não foi possível adicionar: {e}")
+                    self._esperar_enter()
+                    continue
                 print(f"'{produto.nome}' adicionado ao carrinho.")
                 self._esperar_enter()
 
-            if not itens_venda:
+            if not carrinho.itens:
                 print("\nNenhum item adicionado. Venda cancelada.")
                 self._esperar_enter()
                 return
@@ -922,7 +1291,7 @@ class CliApp:
             # Confirmação final
             confirmacao = self._obter_input("\nConfirmar e registrar esta venda? (s/n): ")
             if confirmacao and confirmacao.lower() == 's':
-                _, produtos_alertados = self.gerenciador.registrar_venda(itens_venda, nome_cliente, local_id)
+                _, produtos_alertados = self.gerenciador.registrar_venda_carrinho(carrinho, nome_cliente)
                 print("\nVenda registrada com sucesso!")
                 if produtos_alertados:
                     print("\nAlerta de baixo estoque para:", ", ".join([p.nome for p in produtos_alertados]))
@@ -932,6 +1301,9 @@ class CliApp:
         except Exception as e:
             print(f"\nErro ao registrar venda: {e}")
         finally:
+            # venda registrada já consumiu as reservas; cancelada (ou com erro) devolve o que estava separado
+            if carrinho is not None:
+                self.gerenciador.cancelar_carrinho(carrinho)
             self._esperar_enter()
 
 
@@ -939,15 +1311,12 @@ class CliApp:
     def _listar_ocs(self):
         """Exibe uma lista de todas as Ordens de Compra."""
         self._imprimir_cabecalho("Lista de Ordens de Compra")
-        ocs = self.gerenciador.ordens_compra
-        if not ocs:
+        if not self.gerenciador.ordens_compra:
             print("Nenhuma Ordem de Compra registrada.")
             return
 
-        separador = "-" * 80
-        # Mostra as mais recentes primeiro
-        for oc in sorted(ocs.values(), key=lambda o: o.id, reverse=True):
-            print(str(oc))
+        # Mostra as mais recentes primeiro, uma página por vez
+        self._navegar_paginas(lambda **cursor: self.gerenciador.listar_ordens_compra(limite=PAGINA_TAMANHO, **cursor), print)
 
 
     def _criar_oc(self):
@@ -962,17 +1331,19 @@ class CliApp:
             fornecedor = self.gerenciador.fornecedores[fornecedor_id]
             # Filtra produtos para mostrar apenas os do fornecedor selecionado.
             # Apenas produtos individuais podem ser comprados.
-            produtos_fornecedor = {pid: p for pid, p in self.gerenciador.produtos.items() 
-                                     if p.fornecedor.id == fornecedor_id and p.tipoProduto == 'individual'}
+            def do_fornecedor(p: Produto) -> bool:
+                return p.fornecedor.id == fornecedor_id and p.tipoProduto == 'individual'
 
-            if not produtos_fornecedor:
+            if not self.gerenciador.contar_produtos(tipo='individual', fornecedor_id=fornecedor_id):
                 print(f"\nO fornecedor '{fornecedor.empresa}' não possui produtos individuais cadastrados.")
                 return
 
             itens_oc = []
             while True:
                 print(f"\n--- Adicionar Item à OC (Fornecedor: {fornecedor.empresa}) ---")
-                produto_id = self._selecionar_em_lista("Selecione o produto", produtos_fornecedor)
+                produto_id = self._selecionar_produto(
+                    "Busque o produto", filtro=do_fornecedor,
+                    detalhe=lambda p: f"- R$ {p.preco_compra:,.2f}, estoque {p.get_estoque_total()}")
                 if produto_id is None: break
 
                 quantidade = self._obter_input("Quantidade a comprar: ", tipo='int')
@@ -1004,7 +1375,7 @@ class CliApp:
 
         oc = self.gerenciador.ordens_compra[oc_id]
         print(f"\nStatus atual da OC #{oc.id}: {oc.status}")
-        print("Opções de Status: Pendente, Recebida, Cancelada")
+        print("Opções de Status: Pendente, Recebida, Cancelada (para receber só uma parte, use 'Receber OCs em Lote')")
         novo_status = self._obter_input("Digite o novo status: ").capitalize()
 
         try:
@@ -1027,6 +1398,61 @@ class CliApp:
         except Exception as e:
             print(f"\nErro ao atualizar status: {e}")
 
+    def _receber_ocs_em_lote(self):
+        """Recebe várias OCs de uma vez, informando quanto chegou de cada linha (Enter = chegou tudo)."""
+        self._imprimir_cabecalho("Receber OCs em Lote")
+        aguardando = {}
+        for status in ("Pendente", "Parcialmente Recebida"):
+            aguardando.update(self._juntar_paginas(lambda **cursor: self.gerenciador.listar_ordens_compra(
+                limite=PAGINA_TAMANHO, status=status, ordenacao='antigos', **cursor)))
+        if not aguardando:
+            print("Nenhuma OC aguardando recebimento.")
+            return
+        for oc in sorted(aguardando.values(), key=lambda o: o.id):
+            print(str(oc))
+
+        texto_ids = self._obter_input("\nIDs das OCs a receber, separados por vírgula (deixe em branco para cancelar): ", obrigatorio=False)
+        if not texto_ids:
+            print("\nRecebimento cancelado.")
+            return
+        try:
+            ids = [int(parte) for parte in texto_ids.replace(' ', '').split(',') if parte]
+        except ValueError:
+            print("\nIDs inválidos.")
+            return
+        if faltando := [oc_id for oc_id in ids if oc_id not in aguardando]:
+            print(f"\nOC(s) não encontrada(s) ou não aguardando recebimento: {faltando}")
+            return
+
+        local_id = self._selecionar_em_lista("Selecione a localização de entrada do estoque", self.gerenciador.localizacoes)
+        if local_id is None:
+            print("\nRecebimento cancelado.")
+            return
+
+        recebimentos = {}
+        for oc_id in ids:
+            oc = aguardando[oc_id]
+            print(f"\n--- OC #{oc.id} ({oc.fornecedor.empresa}) ---")
+            quantidades = {}
+            for item in oc.itens:
+                if not item.quantidade_pendente:
+                    continue
+                qtd = self._obter_input(f"{item.produto.nome} - recebido agora [{item.quantidade_pendente}]: ",
+                                        obrigatorio=False, tipo='int')
+                quantidades[item.produto.id] = quantidades.get(item.produto.id, 0) + (item.quantidade_pendente if qtd is None else qtd)
+            recebimentos[oc_id] = quantidades
+
+        if self._obter_input("\nConfirmar o recebimento? (s/n): ").lower() != 's':
+            print("\nRecebimento cancelado.")
+            return
+        try:
+            self.gerenciador.receber_ordens_compra(recebimentos, local_id)
+            print("\nRecebimento registrado com sucesso!")
+            for oc_id in ids:
+                print(str(self.gerenciador.ordens_compra[oc_id]))
+        except Exception as e:
+            print(f"\nErro no recebimento (nada foi gravado): {e}")
+
     def _visualizar_salvar_oc(self):
         """Exibe o recibo de uma OC e oferece opções para salvá-lo."""
         self._imprimir_cabecalho("Visualizar/Salvar Recibo de OC")
@@ -1054,38 +1480,7 @@ class CliApp:
 
     def _gerar_texto_recibo_oc(self, ordem: OrdemCompra) -> str:
         """Formata os dados de uma Ordem de Compra em um texto legível."""
-        linhas = [
-            "==========================================",
-            "        ORDEM DE COMPRA (RECIBO)          ",
-            "==========================================",
-            f"Número do Pedido: {ordem.id}",
-            f"Data de Emissão: {ordem.data_criacao.strftime('%d/%m/%Y %H:%M:%S')}",
-            f"Status: {ordem.status}",
-            "\n--- DADOS DO FORNECEDOR ---",
-            f"Empresa: {ordem.fornecedor.empresa}",
-            f"Nome do Contato: {ordem.fornecedor.nome}",
-            f"Telefone: {ordem.fornecedor.telefone}",
-            f"Email: {ordem.fornecedor.email}",
-            f"Endereço: {ordem.fornecedor.morada}",
-            "\n--- ITENS DO PEDIDO ---"
-        ]
-
-        header = f'{"ID":<5}{"Produto":<30}{"Qtd":>5} {"Preço Un.":>15} {"Subtotal":>15}'
-        linhas.append(header)
-        linhas.append("-" * len(header))
-
-        for item in ordem.itens:
-            linha_item = (f"{item.produto.id:<5}"
-                          f"{item.produto.nome[:29]:<30}"
-                          f"{item.quantidade:>5} "
-                          f"{f'R$ {item.preco_unitario:,.2f}':>15}"
-                          f"{f'R$ {item.subtotal:,.2f}':>15}")
-            linhas.append(linha_item)
-
-        linhas.append("-" * len(header))
-        linhas.append(f"{'VALOR TOTAL:':>56} {f'R$ {ordem.valor_total:,.2f}':>15}")
-
-        return "\n".join(linhas)
+        return self.gerenciador.gerar_recibo_ordem_compra(ordem.id)
 
     def _salvar_oc_txt(self, ordem: OrdemCompra, texto_recibo: str):
         """Salva o recibo de uma OC em um arquivo de texto."""
@@ -1176,7 +1571,7 @@ class CliApp:
         self._imprimir_cabecalho("Iniciar Nova Devolução/Troca")
         
         # Seleciona a venda original
-        vendas_validas = {v.id: v for v in self.gerenciador.vendas.values()}
+        vendas_validas = self.gerenciador.vendas
         if not vendas_validas:
             print("Não há vendas registradas para iniciar uma devolução.")
             self._esperar_enter()
@@ -1233,20 +1628,19 @@ class CliApp:
     def _listar_devolucoes(self):
         """Exibe a lista de devoluções com seus status."""
         self._imprimir_cabecalho("Lista de Devoluções")
-        devolucoes = self.gerenciador.devolucoes
-        if not devolucoes:
+        if not self.gerenciador.devolucoes:
             print("Nenhuma devolução registrada.")
             return
 
-        for dev in sorted(devolucoes.values(), key=lambda d: d.id, reverse=True):
-            print(str(dev))
+        self._navegar_paginas(lambda **cursor: self.gerenciador.listar_devolucoes(limite=PAGINA_TAMANHO, **cursor), print)
 
     # método de UI para processar devolução
     def _processar_devolucao_cli(self):
         """Interface para processar uma devolução pendente."""
         self._imprimir_cabecalho("Processar Devolução")
         
-        devolucoes_em_aberto = {d.id: d for d in self.gerenciador.devolucoes.values() if d.status == 'solicitada'}
+        devolucoes_em_aberto = self._juntar_paginas(lambda **cursor: self.gerenciador.listar_devolucoes(
+            limite=PAGINA_TAMANHO, status='solicitada', ordenacao='antigos', **cursor))
         if not devolucoes_em_aberto:
             print("Não há devoluções pendentes para processar.")
             return
@@ -1277,16 +1671,14 @@ class CliApp:
             
             while True:
                 print("\nAdicionar item para a troca (ou 0 para finalizar):")
-                produtos_disponiveis = {pid: p for pid, p in self.gerenciador.produtos.items() if p.get_estoque_total() > 0}
-                if not produtos_disponiveis:
+                # kit sem nenhum montado só é montável se algum individual tiver estoque, então a contagem basta
+                if not self.gerenciador.contar_produtos(com_estoque=True):
                     print("Nenhum produto disponível para troca.")
                     break
 
-                produto_id = self._selecionar_em_lista(
-                    "Selecione o produto",
-                    produtos_disponiveis,
-                    prompt_personalizado="Digite o ID do produto para troca: "
-                )
+                produto_id = self._selecionar_produto(
+                    "Busque o produto para troca", filtro=lambda p: p.get_estoque_total() > 0,
+                    detalhe=lambda p: f"- estoque {p.get_estoque_total()}")
                 if produto_id is None: break
                 
                 quantidade = self._obter_input("Quantidade: ", tipo='int')
@@ -1308,6 +1700,81 @@ class CliApp:
         except Exception as e:
             print(f"\nErro ao processar devolução: {e}")
     
+    # Manutenção
+    def _ingerir_log_vendas(self):
+        """Importa as vendas do log do PDV; se o arquivo já foi lido antes, continua de onde parou."""
+        self._imprimir_cabecalho("Importar Log de Vendas do PDV")
+        arquivo = self._obter_input("Arquivo JSONL do PDV (deixe em branco para cancelar): ", obrigatorio=False)
+        if not arquivo:
+            print("\nImportação cancelada.")
+            return
+        try:
+            resultado = self.gerenciador.ingerir_log_vendas(arquivo)
+        except OSError as e:
+            print(f"\nErro ao ler o arquivo: {e}")
+            return
+        print(f"\n{resultado}")
+        for num_linha, motivo in resultado.rejeitadas[:20]:
+            print(f"   - linha {num_linha}: {motivo}")
+        if len(resultado.rejeitadas) > 20:
+            print(f"   ... e mais {len(resultado.rejeitadas) - 20} linha(s) rejeitada(s).")
+
+    def _arquivar_historico(self):
+        """Move as movimentações antigas para o banco de arquivo."""
+        self._imprimir_cabecalho("Arquivar Histórico de Movimentações")
+        dias = self._obter_input("Arquivar movimentos com mais de quantos dias? (Enter para o padrão): ", obrigatorio=False, tipo='int')
+        try:
+            if dias is None:
+                arquivados = self.gerenciador.arquivar_movimentos()
+            else:
+                arquivados = self.gerenciador.arquivar_movimentos(horizonte_dias=dias)
+            print(f"\n{arquivados} movimentação(ões) arquivada(s).")
+        except Exception as e:
+            print(f"\nErro ao arquivar histórico: {e}")
+
+    def _feed_eventos(self):
+        """Mostra onde cada integração está no feed de eventos e, se confirmado, compacta o que todas já leram."""
+        self._imprimir_cabecalho("Feed de Eventos (Outbox)")
+        consumidores = self.gerenciador.listar_consumidores_eventos()
+        if not consumidores:
+            print("Nenhuma integração lendo o feed ainda (sem consumidores, nada é compactado).")
+            return
+        for nome, cursor, pendentes in consumidores:
+            print(f"- {nome}: leu até o evento #{cursor}, {pendentes} pendente(s)")
+        if self._obter_input("\nCompactar os eventos que todos já confirmaram? (s/n): ").lower() == 's':
+            try:
+                print(f"\n{self.gerenciador.compactar_eventos()} evento(s) compactado(s).")
+            except Exception as e:
+                print(f"\nErro ao compactar eventos: {e}")
+
+    def _iniciar_backup(self):
+        """Dispara o backup online; o sistema continua funcionando enquanto ele roda."""
+        self._imprimir_cabecalho("Backup do Banco de Dados")
+        if self.backup.iniciar_backup():
+            print("Backup iniciado em segundo plano. Você pode continuar usando o sistema normalmente.")
+            print("Use a opção 'Status do backup' para acompanhar.")
+        else:
+            print("Já existe um backup em andamento.")
+
+    def _status_backup(self):
+        """Mostra o andamento/resultado do último backup e a lista de backups guardados."""
+        self._imprimir_cabecalho("Status do Backup")
+        if self.backup.em_andamento():
+            restantes, total = self.backup.progresso
+            copiadas = total - restantes
+            print(f"Backup em andamento: {copiadas}/{total} páginas copiadas.")
+        elif resultado := self.backup.ultimo_resultado:
+            print(f"Último backup ({resultado.inicio.strftime('%d/%m/%Y %H:%M:%S')}): {resultado.mensagem}")
+        else:
+            print("Nenhum backup feito nesta sessão.")
+
+        backups = self.backup.listar_backups()
+        print(f"\nBackups guardados em '{self.backup.diretorio}' (retenção: {self.backup.retencao}):")
+        if not backups:
+            print("   - Nenhum backup encontrado.")
+        for arquivo in backups:
+            print(f"   - {arquivo}")
+
     # método de UI para relatório de devoluções
     def _gerar_relatorio_devolucoes(self):
         """chama o relatório de devoluções"""
@@ -1315,6 +1782,42 @@ class CliApp:
         report = self.gerenciador.gerar_relatorio_devolucoes_por_motivo()
         print(report)
 
+    def _verificar_consistencia_estoque(self):
+        """Compara o estoque gravado com o histórico e, se o usuário quiser, reconstrói o estoque."""
+        self._imprimir_cabecalho("Verificar Consistência do Estoque")
+        divergencias = self.gerenciador.verificar_consistencia_estoque()
+        if not divergencias:
+            print("Nenhuma divergência encontrada. O estoque bate com o histórico de movimentos.")
+            return
+
+        print(f"{len(divergencias)} divergência(s) encontrada(s):\n")
+        for produto_id, localizacao_id, qtd_estoque, qtd_historico in divergencias:
+            produto = self.gerenciador.produtos.get(produto_id)
+            localizacao = self.gerenciador.localizacoes.get(localizacao_id)
+            nome_produto = produto.nome if produto else f"Produto #{produto_id}"
+            nome_local = localizacao.nome if localizacao else f"Local #{localizacao_id}"
+            print(f"   - {nome_produto} em {nome_local}: estoque {qtd_estoque} | histórico {qtd_historico}")
+
+        confirmacao = self._obter_input("\nReconstruir o estoque a partir do histórico? (s/n): ")
+        if confirmacao and confirmacao.lower() == 's':
+            try:
+                celulas = self.gerenciador.reconstruir_estoque_do_historico()
+                print(f"\nEstoque reconstruído com sucesso ({celulas} registros gravados).")
+            except Exception as e:
+                print(f"\nErro ao reconstruir o estoque: {e}")
+        else:
+            print("\nNenhuma alteração feita.")
+
+    def _gerar_relatorio_valor_em_data(self):
+        """Pede uma data e mostra o estoque/valor do inventário no fim daquele dia."""
+        try:
+            str_data = self._obter_input("Data (DD/MM/AAAA): ")
+            data = datetime.combine(datetime.strptime(str_data, "%d/%m/%Y"), time.max)
+            self._imprimir_cabecalho("Valor do Inventário em uma Data")
+            print(self.gerenciador.gerar_relatorio_valor_estoque_em(data))
+        except ValueError as e:
+            print(f"Erro de formato de data: {e}. Use o formato DD/MM/AAAA.")
+
     def _gerar_relatorio_vendas_por_periodo(self):
         """Método para solicitar e gerar o relatório de vendas por período."""
         try:
@@ -0,0 +1,429 @@
+# comandos.py
+# Contém o modo em lote (sem menus) do sistema: subcomandos que chamam o GerenciadorEstoque direto,
+# pra dar pra rodar jobs noturnos e operações em volume por script, sem ninguém digitando nos prompts.
+# Exemplo: python main.py venda --local 2 --cliente "João" --item 1:2 --item 3:1
+
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+from datetime import datetime, time
+
+from config import (DB_FILE, ARQUIVO_DB_FILE, DB_EM_MEMORIA, DB_EM_MEMORIA_SALVAR_A_CADA_SEGUNDOS, ESCRITA_ADIADA,
+                    CATALOGO_MAXIMO_EM_MEMORIA, INGESTAO_VENDAS_POR_LOTE, INGESTAO_INTERVALO_MS, SERVIDOR_HOST, SERVIDOR_PORTA)
+from database import DatabaseManager
+from manager import GerenciadorEstoque
+from backup import GerenciadorBackup
+
+
+# --- Conversores de argumentos ---
+
+def _item_quantidade(valor: str) -> dict:
+    """converte 'ID:QTD' em {'produto_id': ID, 'quantidade': QTD}"""
+    try:
+        produto_id, quantidade = valor.split(':')
+        return {'produto_id': int(produto_id), 'quantidade': int(quantidade)}
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"item inválido '{valor}', use o formato ID:QTD (ex: 3:2)")
+
+
+def _data(valor: str) -> datetime:
+    """converte DD/MM/AAAA em datetime"""
+    try:
+        return datetime.strptime(valor, "%d/%m/%Y")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"data inválida '{valor}', use o formato DD/MM/AAAA")
+
+
+def _fim_do_dia(data: datetime) -> datetime:
+    return datetime.combine(data, time.max)
+
+
+def _emitir(texto: str, arquivo: str | None):
+    """imprime o texto na saída padrão ou grava no arquivo pedido"""
+    if arquivo:
+        with open(arquivo, 'w', encoding='utf-8') as f:
+            f.write(texto)
+    else:
+        print(texto)
+
+
+def _exigir(args, *campos):
+    """garante que os argumentos opcionais necessários para um relatório foram passados"""
+    faltando = [f"--{c.replace('_', '-')}" for c in campos if getattr(args, c) is None]
+    if faltando:
+        raise ValueError(f"Este relatório precisa de: {', '.join(faltando)}")
+
+
+# --- Relatórios disponíveis no modo em lote ---
+
+RELATORIOS = {
+    'estoque': lambda g, a: g.gerar_relatorio_estoque_simplificado(),
+    'valor': lambda g, a: g.gerar_relatorio_valor_total(),
+    'baixo-estoque': lambda g, a: g.gerar_relatorio_baixo_estoque(),
+    'mais-vendidos': lambda g, a: g.gerar_relatorio_mais_vendidos(),
+    'kits-mais-vendidos': lambda g, a: g.gerar_relatorio_kits_mais_vendidos(),
+    'componentes-limitantes': lambda g, a: g.gerar_relatorio_componente_limitante(),
+    'devolucoes': lambda g, a: g.gerar_relatorio_devolucoes_por_motivo(),
+    'vendas-periodo': lambda g, a: (_exigir(a, 'inicio', 'fim') or
+                                    g.gerar_relatorio_vendas_periodo(a.inicio, _fim_do_dia(a.fim))),
+    'valor-em-data': lambda g, a: _exigir(a, 'data') or g.gerar_relatorio_valor_estoque_em(_fim_do_dia(a.data)),
+    'movimentacao-produto': lambda g, a: _exigir(a, 'produto') or g.gerar_relatorio_movimentacao_item(a.produto),
+    'movimentacao-fornecedor': lambda g, a: _exigir(a, 'fornecedor') or g.gerar_relatorio_movimentacao_fornecedor(a.fornecedor),
+    'movimentacao-local': lambda g, a: _exigir(a, 'local') or g.gerar_relatorio_movimentacao_localizacao(a.local),
+}
+
+
+# --- Subcomandos ---
+
+def _cmd_venda(gerenciador: GerenciadorEstoque, args) -> int:
+    venda, alertas = gerenciador.registrar_venda(args.item, args.cliente, args.local)
+    print(f"Venda #{venda.id} registrada. Total: R$ {venda.valor_total:,.2f}")
+    if alertas:
+        print("Alerta de baixo estoque para:", ", ".join(p.nome for p in alertas))
+    return 0
+
+
+def _linha_oc(valor: str) -> tuple[int, int, int]:
+    """converte 'OC:PRODUTO:QTD' em (oc_id, produto_id, quantidade)"""
+    try:
+        oc_id, produto_id, quantidade = (int(parte) for parte in valor.split(':'))
+        return oc_id, produto_id, quantidade
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"linha inválida '{valor}', use o formato OC:PRODUTO:QTD (ex: 4:12:30)")
+
+
+def _cmd_receber_oc(gerenciador: GerenciadorEstoque, args) -> int:
+    # OCs passadas só com --oc recebem tudo o que está pendente; com --linha, só o que foi informado
+    recebimentos = {oc_id: None for oc_id in args.oc or []}
+    if conflito := sorted({oc_id for oc_id, _, _ in args.linha or []} & set(recebimentos)):
+        raise ValueError(f"OC #{conflito[0]} informada com --oc (receber tudo) e com --linha (parcial): use só um dos dois")
+    for oc_id, produto_id, quantidade in args.linha or []:
+        quantidades = recebimentos.get(oc_id) or {}
+        quantidades[produto_id] = quantidades.get(produto_id, 0) + quantidade
+        recebimentos[oc_id] = quantidades
+    if not recebimentos:
+        raise ValueError("Informe ao menos uma --oc ou --linha")
+    gerenciador.receber_ordens_compra(recebimentos, args.local)
+    for oc_id in recebimentos:
+        print(f"OC #{oc_id}: {gerenciador.ordens_compra[oc_id].status}.")
+    return 0
+
+
+def _cmd_transferir(gerenciador: GerenciadorEstoque, args) -> int:
+    gerenciador.transferir_estoque(args.produto, args.origem, args.destino, args.quantidade)
+    print(f"Transferência de {args.quantidade} unidade(s) do produto #{args.produto} realizada.")
+    return 0
+
+
+def _cmd_transferencia(gerenciador: GerenciadorEstoque, args) -> int:
+    documento = gerenciador.criar_transferencia(args.origem, args.destino, args.item, em_transito=args.em_transito)
+    print(documento)
+    return 0
+
+
+def _cmd_montar(gerenciador: GerenciadorEstoque, args) -> int:
+    if args.desmontar:
+        ordem = gerenciador.desmontar_kits(args.kit, args.local, args.quantidade)
+    else:
+        ordem = gerenciador.montar_kits(args.kit, args.local, args.quantidade)
+    print(ordem)
+    return 0
+
+
+def _cmd_atualizar_lote(gerenciador: GerenciadorEstoque, args) -> int:
+    alterados = gerenciador.atualizar_em_lote(args.campo, args.modo, args.valor, fornecedor_id=args.fornecedor,
+                                              categoria=args.categoria, produto_ids=args.produto)
+    print(f"{len(alterados)} produto(s) atualizado(s).")
+    return 0
+
+
+def _cmd_receber_transferencia(gerenciador: GerenciadorEstoque, args) -> int:
+    for transferencia_id in args.transferencia:
+        if args.cancelar:
+            gerenciador.cancelar_transferencia(transferencia_id)
+            print(f"Transferência #{transferencia_id} cancelada.")
+        else:
+            gerenciador.receber_transferencia(transferencia_id)
+            print(f"Transferência #{transferencia_id} recebida.")
+    return 0
+
+
+def _cmd_relatorio(gerenciador: GerenciadorEstoque, args) -> int:
+    _emitir(RELATORIOS[args.tipo](gerenciador, args), args.saida)
+    return 0
+
+
+def _cmd_exportar(gerenciador: GerenciadorEstoque, args) -> int:
+    if args.alvo == 'oc':
+        _exigir(args, 'oc')
+        _emitir(gerenciador.gerar_recibo_ordem_compra(args.oc), args.saida or f"Ordem_de_Compra_{args.oc}.txt")
+        return 0
+
+    # 'estoque': matriz produto x localização em CSV
+    saida = open(args.saida, 'w', encoding='utf-8', newline='') if args.saida else sys.stdout
+    try:
+        escritor = csv.writer(saida)
+        escritor.writerow(['produto_id', 'codigo_barras', 'nome', 'localizacao', 'quantidade'])
+        escritor.writerows(gerenciador.matriz_estoque())
+    finally:
+        if saida is not sys.stdout:
+            saida.close()
+    return 0
+
+
+def _cmd_verificar_estoque(gerenciador: GerenciadorEstoque, args) -> int:
+    divergencias = gerenciador.verificar_consistencia_estoque()
+    for produto_id, localizacao_id, qtd_estoque, qtd_historico in divergencias:
+        print(f"produto={produto_id} local={localizacao_id} estoque={qtd_estoque} historico={qtd_historico}")
+    print(f"{len(divergencias)} divergência(s) encontrada(s).")
+    if divergencias and args.reconstruir:
+        celulas = gerenciador.reconstruir_estoque_do_historico(args.processos)
+        print(f"Estoque reconstruído ({celulas} registros gravados).")
+        return 0
+    return 1 if divergencias else 0
+
+
+def _cmd_arquivar(gerenciador: GerenciadorEstoque, args) -> int:
+    if args.dias is None:
+        arquivados = gerenciador.arquivar_movimentos()
+    else:
+        arquivados = gerenciador.arquivar_movimentos(horizonte_dias=args.dias)
+    print(f"{arquivados} movimentação(ões) arquivada(s).")
+    return 0
+
+
+def _cmd_importar(gerenciador: GerenciadorEstoque, args) -> int:
+    if not (args.fornecedores or args.produtos or args.estoque):
+        raise ValueError("Informe ao menos um arquivo: --fornecedores, --produtos ou --estoque")
+    resultado = gerenciador.importar_csv(args.fornecedores, args.produtos, args.estoque,
+                                         tamanho_lote=args.lote, delimitador=args.delimitador)
+    print(resultado)
+    for arquivo, linha, motivo in resultado.rejeitadas:
+        print(f"{arquivo}:{linha}: {motivo}", file=sys.stderr)
+    return 1 if resultado.rejeitadas else 0
+
+
+def _cmd_conciliar(gerenciador: GerenciadorEstoque, args) -> int:
+    conciliacao = gerenciador.conciliar_contagem(args.contagem, delimitador=args.delimitador)
+    _emitir(gerenciador.gerar_relatorio_conciliacao(conciliacao), args.saida)
+    if args.aplicar:
+        # mesmo sem divergência na prévia: o estoque pode ter mudado até aqui, e a contagem é que vale
+        lancados, _ = gerenciador.aplicar_ajustes_inventario(conciliacao)
+        print(f"{lancados} ajuste(s) de inventário lançado(s).")
+    return 1 if conciliacao.rejeitadas else 0
+
+
+def _cmd_ingerir_vendas(gerenciador: GerenciadorEstoque, args) -> int:
+    resultado = gerenciador.ingerir_log_vendas(args.log, vendas_por_lote=args.lote, intervalo_ms=args.intervalo_ms,
+                                               recomecar=args.recomecar)
+    print(resultado)
+    for num_linha, motivo in resultado.rejeitadas:
+        print(f"{args.log}:{num_linha}: {motivo}", file=sys.stderr)
+    return 1 if resultado.rejeitadas else 0
+
+
+def _cmd_backup(gerenciador: GerenciadorEstoque, args) -> int:
+    # no modo em lote não tem ninguém usando o sistema, então não precisa de pausa entre os passos
+    backup = GerenciadorBackup(gerenciador.db)
+    backup.iniciar_backup()
+    resultado = backup.aguardar()
+    print(resultado.mensagem)
+    for arquivo in resultado.arquivos:
+        print(f"   - {arquivo}")
+    return 0 if resultado.sucesso else 1
+
+
+def _cmd_eventos(gerenciador: GerenciadorEstoque, args) -> int:
+    if args.compactar:
+        print(f"{gerenciador.compactar_eventos()} evento(s) compactado(s).")
+        return 0
+    if args.consumidor is None:
+        for nome, cursor, pendentes in gerenciador.listar_consumidores_eventos():
+            print(f"{nome}: cursor {cursor}, {pendentes} evento(s) pendente(s)")
+        return 0
+    # um evento JSON por linha; com --confirmar o cursor anda até o último impresso
+    eventos = gerenciador.ler_eventos(args.consumidor, args.limite)
+    if eventos:
+        _emitir("\n".join(json.dumps(e.como_dict(), ensure_ascii=False) for e in eventos), args.saida)
+        if args.confirmar:
+            gerenciador.confirmar_eventos(args.consumidor, eventos[-1].id)
+    return 0
+
+
+def _cmd_servidor(gerenciador: GerenciadorEstoque, args) -> int:
+    import asyncio
+    from servidor import ServidorEstoque
+    servidor = ServidorEstoque(gerenciador, host=args.host, porta=args.porta)
+    try:
+        asyncio.run(servidor.servir_para_sempre())
+    except KeyboardInterrupt:
+        print("\nServidor encerrado.")
+    return 0
+
+
+def criar_parser() -> argparse.ArgumentParser:
+    """Monta o parser de argumentos com todos os subcomandos."""
+    parser = argparse.ArgumentParser(prog="main.py", description="Sistema de Gerenciamento de Estoque - modo em lote.")
+    parser.add_argument('--db', default=DB_FILE, help=f"arquivo do banco de dados (padrão: {DB_FILE})")
+    parser.add_argument('--arquivo', default=ARQUIVO_DB_FILE, help=f"banco de arquivo do histórico (padrão: {ARQUIVO_DB_FILE})")
+    parser.add_argument('--escrita-adiada', action='store_true', default=ESCRITA_ADIADA,
+                        help="grava as movimentações de estoque em segundo plano, em lotes (write-behind)")
+    parser.add_argument('--em-memoria', action='store_true', default=DB_EM_MEMORIA,
+                        help="roda o banco na memória (carregado do --db e salvo de volta nele; --db :memory: não salva nada)")
+    parser.add_argument('--salvar-a-cada', type=float, default=DB_EM_MEMORIA_SALVAR_A_CADA_SEGUNDOS, metavar='SEGUNDOS',
+                        help=f"com --em-memoria, de quanto em quanto tempo salvar no disco (padrão: {DB_EM_MEMORIA_SALVAR_A_CADA_SEGUNDOS}; 0 = só no fim)")
+    parser.add_argument('--catalogo-maximo', type=int, default=CATALOGO_MAXIMO_EM_MEMORIA, metavar='N',
+                        help="mantém só os N produtos usados por último em memória e lê o resto do banco quando pedido")
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p = sub.add_parser('venda', help="registra uma venda")
+    p.add_argument('--local', type=int, required=True, help="ID da localização da venda")
+    p.add_argument('--cliente', required=True, help="nome do cliente")
+    p.add_argument('--item', type=_item_quantidade, action='append', required=True, help="ID:QTD (pode repetir)")
+    p.set_defaults(funcao=_cmd_venda)
+
+    p = sub.add_parser('receber-oc', help="recebe ordens de compra (inteiras ou em parte) e dá entrada no estoque")
+    p.add_argument('--oc', type=int, action='append', help="ID da OC a receber por inteiro (pode repetir)")
+    p.add_argument('--linha', type=_linha_oc, action='append', help="OC:PRODUTO:QTD recebido em parte (pode repetir)")
+    p.add_argument('--local', type=int, required=True, help="ID da localização de entrada")
+    p.set_defaults(funcao=_cmd_receber_oc)
+
+    p = sub.add_parser('transferir', help="transfere estoque entre localizações")
+    p.add_argument('--produto', type=int, required=True)
+    p.add_argument('--origem', type=int, required=True)
+    p.add_argument('--destino', type=int, required=True)
+    p.add_argument('--quantidade', type=int, required=True)
+    p.set_defaults(funcao=_cmd_transferir)
+
+    p = sub.add_parser('transferencia', help="cria um documento de transferência com vários itens")
+    p.add_argument('--origem', type=int, required=True)
+    p.add_argument('--destino', type=int, required=True)
+    p.add_argument('--item', type=_item_quantidade, action='append', required=True, help="ID:QTD (pode repetir)")
+    p.add_argument('--em-transito', action='store_true', help="a entrada no destino só acontece no recebimento")
+    p.set_defaults(funcao=_cmd_transferencia)
+
+    p = sub.add_parser('receber-transferencia', help="recebe (ou cancela) transferências em trânsito")
+    p.add_argument('--transferencia', type=int, action='append', required=True, help="ID da transferência (pode repetir)")
+    p.add_argument('--cancelar', action='store_true', help="cancela e devolve a mercadoria para a origem")
+    p.set_defaults(funcao=_cmd_receber_transferencia)
+
+    p = sub.add_parser('montar', help="monta kits prontos a partir dos componentes (ou desmonta)")
+    p.add_argument('--kit', type=int, required=True, help="ID do kit")
+    p.add_argument('--local', type=int, required=True, help="ID da localização")
+    p.add_argument('--quantidade', type=int, required=True)
+    p.add_argument('--desmontar', action='store_true', help="desmonta kits prontos, devolvendo os componentes ao estoque")
+    p.set_defaults(funcao=_cmd_montar)
+
+    p = sub.add_parser('atualizar-lote', help="reajusta preço ou ponto de ressuprimento de vários produtos de uma vez")
+    p.add_argument('campo', choices=GerenciadorEstoque.CAMPOS_EM_LOTE)
+    p.add_argument('modo', choices=GerenciadorEstoque.MODOS_EM_LOTE)
+    p.add_argument('valor', type=float, help="valor novo, percentual (ex: 10 ou -5) ou quanto somar")
+    p.add_argument('--fornecedor', type=int, help="ID do fornecedor")
+    p.add_argument('--categoria')
+    p.add_argument('--produto', type=int, action='append', help="ID do produto (pode repetir)")
+    p.set_defaults(funcao=_cmd_atualizar_lote)
+
+    p = sub.add_parser('relatorio', help="gera um relatório")
+    p.add_argument('tipo', choices=sorted(RELATORIOS))
+    p.add_argument('--inicio', type=_data, help="DD/MM/AAAA (vendas-periodo)")
+    p.add_argument('--fim', type=_data, help="DD/MM/AAAA (vendas-periodo)")
+    p.add_argument('--data', type=_data, help="DD/MM/AAAA (valor-em-data)")
+    p.add_argument('--produto', type=int, help="ID do produto (movimentacao-produto)")
+    p.add_argument('--fornecedor', type=int, help="ID do fornecedor (movimentacao-fornecedor)")
+    p.add_argument('--local', type=int, help="ID da localização (movimentacao-local)")
+    p.add_argument('--saida', help="grava o relatório neste arquivo em vez de imprimir")
+    p.set_defaults(funcao=_cmd_relatorio)
+
+    p = sub.add_parser('exportar', help="exporta dados para arquivo")
+    p.add_argument('alvo', choices=['estoque', 'oc'], help="'estoque' (CSV produto x local) ou 'oc' (recibo TXT)")
+    p.add_argument('--oc', type=int, help="ID da OC (alvo 'oc')")
+    p.add_argument('--saida', help="arquivo de saída")
+    p.set_defaults(funcao=_cmd_exportar)
+
+    p = sub.add_parser('verificar-estoque', help="compara o estoque com o histórico de movimentos")
+    p.add_argument('--reconstruir', action='store_true', help="reconstrói o estoque se houver divergência")
+    p.add_argument('--processos', type=int, help="processos usados na reconstrução (padrão: nº de CPUs)")
+    p.set_defaults(funcao=_cmd_verificar_estoque)
+
+    p = sub.add_parser('arquivar', help="arquiva o histórico de movimentações antigo")
+    p.add_argument('--dias', type=int, help="horizonte em dias (padrão do config.py)")
+    p.set_defaults(funcao=_cmd_arquivar)
+
+    p = sub.add_parser('importar', help="importa fornecedores, produtos e estoque inicial de arquivos CSV")
+    p.add_argument('--fornecedores', help="CSV com nome,empresa,telefone,email,morada")
+    p.add_argument('--produtos', help="CSV com nome,descricao,categoria,codigo_barras,preco_compra,preco_venda,"
+                                      "ponto_ressuprimento,fornecedor,tipo,componentes")
+    p.add_argument('--estoque', help="CSV com codigo_barras,localizacao,quantidade")
+    p.add_argument('--lote', type=int, default=1000, help="linhas por lote (padrão: 1000)")
+    p.add_argument('--delimitador', default=',', help="separador de campos (padrão: ',')")
+    p.set_defaults(funcao=_cmd_importar)
+
+    p = sub.add_parser('conciliar', help="compara uma contagem física com o estoque e (opcionalmente) lança os ajustes")
+    p.add_argument('contagem', help="CSV com codigo_barras (ou produto_id), localizacao, quantidade")
+    p.add_argument('--aplicar', action='store_true', help="lança os ajustes (sem isso, só mostra a prévia)")
+    p.add_argument('--delimitador', default=',', help="separador de campos (padrão: ',')")
+    p.add_argument('--saida', help="grava a prévia neste arquivo em vez de imprimir")
+    p.set_defaults(funcao=_cmd_conciliar)
+
+    p = sub.add_parser('ingerir-vendas', help="ingere o log de vendas do PDV (JSONL), retomando de onde parou")
+    p.add_argument('log', help="arquivo JSONL com uma venda por linha")
+    p.add_argument('--lote', type=int, default=INGESTAO_VENDAS_POR_LOTE, help=f"vendas por commit (padrão: {INGESTAO_VENDAS_POR_LOTE})")
+    p.add_argument('--intervalo-ms', type=int, default=INGESTAO_INTERVALO_MS,
+                   help=f"tempo máximo de um lote antes do commit (padrão: {INGESTAO_INTERVALO_MS})")
+    p.add_argument('--recomecar', action='store_true', help="ignora a posição salva e lê o arquivo desde o início")
+    p.set_defaults(funcao=_cmd_ingerir_vendas)
+
+    p = sub.add_parser('backup', help="faz um backup verificado do banco")
+    p.set_defaults(funcao=_cmd_backup)
+
+    p = sub.add_parser('eventos', help="lê o feed de eventos (o que mudou) a partir do cursor de um consumidor")
+    p.add_argument('--consumidor', help="nome da integração (sem isso, lista os consumidores e seus cursores)")
+    p.add_argument('--limite', type=int, default=500, help="eventos por leitura (padrão: 500)")
+    p.add_argument('--confirmar', action='store_true', help="avança o cursor até o último evento lido")
+    p.add_argument('--compactar', action='store_true', help="apaga os eventos que todos os consumidores já confirmaram")
+    p.add_argument('--saida', help="grava os eventos (JSONL) neste arquivo em vez de imprimir")
+    p.set_defaults(funcao=_cmd_eventos)
+
+    p = sub.add_parser('servidor', help="sobe o servidor HTTP/JSON para os caixas (vendas, consultas, transferências)")
+    p.add_argument('--host', default=SERVIDOR_HOST, help=f"endereço de escuta (padrão: {SERVIDOR_HOST})")
+    p.add_argument('--porta', type=int, default=SERVIDOR_PORTA, help=f"porta (padrão: {SERVIDOR_PORTA})")
+    p.set_defaults(funcao=_cmd_servidor)
+
+    return parser
+
+
+def executar_comando(argv: list[str]) -> int:
+    """Executa um subcomando e retorna o código de saída (0 = sucesso). Nunca popula dados de exemplo."""
+    parser = criar_parser()
+    args = parser.parse_args(argv)
+    if args.catalogo_maximo and args.escrita_adiada:
+        parser.error("--catalogo-maximo não funciona junto com --escrita-adiada")
+
+    db = DatabaseManager(args.db, arquivo_file=args.arquivo, em_memoria=args.em_memoria,
+                         salvar_a_cada_segundos=args.salvar_a_cada or None)
+    try:
+        db.connect()
+        db.create_tables()
+    except (sqlite3.Error, OSError) as e:
+        print(f"Erro ao abrir o banco '{args.db}': {e}", file=sys.stderr)
+        db.close()
+        return 1
+    gerenciador = GerenciadorEstoque(db, escrita_adiada=args.escrita_adiada, maximo_produtos_em_memoria=args.catalogo_maximo)
+    try:
+        gerenciador.carregar_dados_do_banco(verboso=False)
+        return args.funcao(gerenciador, args)
+    except (ValueError, KeyError) as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    except OSError as e:
+        # arquivo de entrada/saída que não existe ou não dá pra ler/gravar (CSV, JSONL, --saida...)
+        print(f"Erro de arquivo: {e}", file=sys.stderr)
+        return 1
+    except sqlite3.Error as e:
+        print(f"Erro no banco de dados: {e}", file=sys.stderr)
+        return 1
+    finally:
+        gerenciador.encerrar()
+        db.close()
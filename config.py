@@ -6,6 +6,62 @@ import sys
 # --- Constantes de Configuração ---
 
 DB_FILE = "estoque_database.db"
+# modo em memória (lojas temporárias, testes, benchmarks sem custo de disco): o banco é carregado do DB_FILE
+# pra RAM na abertura e salvo de volta a cada N segundos e ao fechar. O que mudou depois do último salvamento
+# se perde numa queda. None no intervalo = só salva ao fechar
+DB_EM_MEMORIA = False
+DB_EM_MEMORIA_SALVAR_A_CADA_SEGUNDOS = 60
+# quanto tempo (em segundos) uma thread espera a trava de escrita do banco enquanto outra está gravando
+DB_TIMEOUT_SEGUNDOS = 10
+
+# se True, o estoque é derivado do histórico de movimentos: cada movimentação é um único INSERT
+# em 'historico_movimentos' e um trigger do banco aplica o delta na tabela 'estoque'
+ESTOQUE_VIA_LEDGER = True
+
+# um checkpoint (fotografia da matriz produto x localização) é gravado a cada N movimentações
+# ou quando o último checkpoint ficar mais velho que o intervalo abaixo
+CHECKPOINT_A_CADA_MOVIMENTOS = 500
+CHECKPOINT_INTERVALO_HORAS = 24
+# quantos checkpoints guardar (os mais velhos são apagados; consultas antes deles somam o histórico desde o início)
+CHECKPOINT_RETENCAO = 30
+
+# banco separado (anexado com ATTACH) para onde vão os movimentos antigos, compactados por mês
+ARQUIVO_DB_FILE = "estoque_arquivo.db"
+# movimentos de meses inteiros mais antigos que esse horizonte podem ser arquivados
+HORIZONTE_ARQUIVAMENTO_DIAS = 365
+
+# backups online (feitos em segundo plano, com o sistema rodando)
+BACKUP_DIR = "backups"
+BACKUP_RETENCAO = 7                 # quantos backups manter no diretório
+
+# ingestão do log de vendas do PDV (JSONL): o commit é feito a cada N vendas ou a cada T milissegundos,
+# o que vier primeiro (junto com o offset do arquivo, pra poder retomar depois de uma queda)
+INGESTAO_VENDAS_POR_LOTE = 500
+INGESTAO_INTERVALO_MS = 250
+
+# escrita adiada (write-behind) das movimentações de estoque: a memória é atualizada na hora e o banco
+# é gravado em segundo plano, em lotes, por uma thread só (com um diário em disco pra não perder nada numa queda)
+ESCRITA_ADIADA = False
+ESCRITA_ADIADA_FILA_MAXIMA = 10000   # movimentos esperando gravação; com a fila cheia, quem movimenta espera
+ESCRITA_ADIADA_LOTE = 500            # movimentos por commit, no máximo
+ESCRITA_ADIADA_INTERVALO_MS = 20     # quanto a thread espera juntando movimentos antes do commit
+
+# catálogo sob demanda, para catálogos grandes demais pra ficar inteiros em memória: None = carrega todos os
+# produtos (padrão); um número = só os N usados por último ficam em memória e o resto é lido do banco quando pedido
+# (não funciona junto com a escrita adiada)
+CATALOGO_MAXIMO_EM_MEMORIA = None
+
+# reservas de estoque (carrinho em andamento, transferência combinada): somem sozinhas depois desse tempo
+RESERVA_TTL_SEGUNDOS = 900
+
+# listagens da CLI: quantos itens por página (com navegação próxima/anterior)
+PAGINA_TAMANHO = 20
+# seleção de produto na CLI (digitar parte do nome e escolher): quantos resultados mostrar
+BUSCA_RESULTADOS = 10
+
+# servidor HTTP/JSON (python main.py servidor) usado pelos caixas/terminais da rede
+SERVIDOR_HOST = "127.0.0.1"
+SERVIDOR_PORTA = 8080
 
 # --- Verificação de Dependências Opcionais ---
 
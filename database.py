@@ -1,51 +1,227 @@
 # database.py
 # Contém a classe DatabaseManager para gerenciar todas as interações com o banco de dados SQLite.
 
+import atexit
+import os
 import sqlite3
 import sys
+import threading
+from contextlib import contextmanager
+
+from config import ESTOQUE_VIA_LEDGER, DB_TIMEOUT_SEGUNDOS, DB_EM_MEMORIA, DB_EM_MEMORIA_SALVAR_A_CADA_SEGUNDOS
 
 # --- Classe de Gerenciamento do Banco de Dados ---
 
 class DatabaseManager:
     """aqui a gente vai gerenciar nossa conexão com o diabo do banco de dados"""
-    def __init__(self, db_file):
+    def __init__(self, db_file, arquivo_file=None, em_memoria: bool = DB_EM_MEMORIA,
+                 salvar_a_cada_segundos: float | None = DB_EM_MEMORIA_SALVAR_A_CADA_SEGUNDOS):
         self.db_file = db_file
-        self.conn = None
-        self.cursor = None
+        # banco de arquivo morto do histórico (opcional), anexado como 'arquivo'
+        self.arquivo_file = arquivo_file
+        # modo em memória: o banco roda todo na RAM, carregado do db_file na conexão e salvo de volta nele
+        # de tempos em tempos e no fechamento. Com db_file ':memory:' não tem arquivo nenhum (some ao fechar).
+        # O banco é do VFS 'memdb' do sqlite, com nome próprio: as conexões de todas as threads enxergam o mesmo
+        # banco e a trava de escrita funciona igual à de um arquivo (quem chega depois espera o timeout)
+        self.em_memoria = em_memoria or db_file == ':memory:'
+        self.salvar_a_cada_segundos = salvar_a_cada_segundos
+        self._uri_memoria = f"file:/estoque_{os.getpid()}_{id(self)}?vfs=memdb"
+        self._trava_salvamento = threading.Lock()
+        self._parar_salvamento = threading.Event()
+        self._thread_salvamento: threading.Thread | None = None
+        # cada thread usa a sua própria conexão (o sqlite3 não deixa compartilhar cursor entre threads);
+        # a conexão, o cursor e o nível de transação ficam guardados por thread aqui
+        self._local = threading.local()
+        self._conexoes: list[sqlite3.Connection] = []
+        self._trava_conexoes = threading.Lock()
+        self._conectado = False
+        # se o sqlite tem FTS5 e o índice de texto das descrições foi criado (ver _configurar_busca_texto)
+        self.fts5_disponivel = False
+
+    @property
+    def conn(self) -> sqlite3.Connection | None:
+        """conexão da thread atual (aberta na primeira vez que a thread usa o banco)"""
+        if getattr(self._local, 'conn', None) is None and self._conectado:
+            self._abrir_conexao()
+        return getattr(self._local, 'conn', None)
+
+    @property
+    def cursor(self) -> sqlite3.Cursor | None:
+        return self._local.cursor if self.conn else None
+
+    @property
+    def _nivel_transacao(self) -> int:
+        """profundidade de transações abertas com transacao() nesta thread (0 = cada query faz seu próprio commit)"""
+        return getattr(self._local, 'nivel_transacao', 0)
+
+    @_nivel_transacao.setter
+    def _nivel_transacao(self, valor: int):
+        self._local.nivel_transacao = valor
+
+    def _abrir_conexao(self):
+        # isolation_level=None deixa o controle de transação explícito (ver transacao());
+        # timeout é quanto uma thread espera enquanto outra está gravando antes de desistir
+        conn = self.nova_conexao(isolation_level=None, timeout=DB_TIMEOUT_SEGUNDOS, check_same_thread=False)
+        conn.execute("PRAGMA foreign_keys = ON;") # pra garantir que as chaves estrangeiras funcionem
+        if self.arquivo_file:
+            conn.execute("ATTACH DATABASE ? AS arquivo", (self.arquivo_file,))
+        self._local.conn, self._local.cursor = conn, conn.cursor()
+        with self._trava_conexoes:
+            self._conexoes.append(conn)
+
+    @property
+    def _persistente(self) -> bool:
+        """se o banco em memória tem um arquivo onde ser salvo"""
+        return self.em_memoria and self.db_file != ':memory:'
+
+    def nova_conexao(self, **kwargs) -> sqlite3.Connection:
+        """Abre uma conexão avulsa com o banco (no modo em memória, com o banco da RAM, não com o arquivo)."""
+        if self.em_memoria:
+            return sqlite3.connect(self._uri_memoria, uri=True, **kwargs)
+        return sqlite3.connect(self.db_file, **kwargs)
 
     def connect(self):
-        """Estabelece a conexão com o banco de dados SQLite"""
+        """Estabelece a conexão com o banco de dados SQLite (as outras threads conectam sozinhas quando precisarem)"""
         try:
-            self.conn = sqlite3.connect(self.db_file)
-            self.conn.execute("PRAGMA foreign_keys = ON;") # pra garantir que as chaves estrangeiras funcionem
-            self.cursor = self.conn.cursor()
+            self._conectado = True
+            self._abrir_conexao()
+            if self._persistente and os.path.exists(self.db_file):
+                # carrega o arquivo inteiro pra memória pela API de backup (cópia consistente, página por página)
+                disco = sqlite3.connect(self.db_file)
+                try:
+                    disco.backup(self._local.conn)
+                finally:
+                    disco.close()
         except sqlite3.Error as e:
             print(f"Erro ao conectar ao banco de dados: {e}")
             sys.exit(1)
+        if self._persistente:
+            # se o programa sair sem chamar close(), o banco ainda é salvo
+            atexit.register(self._salvar_ao_sair)
+            if self.salvar_a_cada_segundos:
+                self._parar_salvamento.clear()
+                self._thread_salvamento = threading.Thread(target=self._salvar_periodicamente, name="salvamento-memoria", daemon=True)
+                self._thread_salvamento.start()
+
+    def salvar_em_disco(self) -> bool:
+        """
+        Modo em memória: grava uma cópia consistente do banco no db_file. A cópia vai primeiro para um
+        arquivo temporário e só então substitui o antigo, então uma queda no meio não estraga o último salvo.
+        Retorna False se não há o que salvar (banco em arquivo, ':memory:' puro ou desconectado).
+        """
+        if not self._persistente or not self._conectado:
+            return False
+        temporario = f"{self.db_file}.tmp"
+        with self._trava_salvamento:
+            origem = self.nova_conexao(timeout=DB_TIMEOUT_SEGUNDOS)
+            destino = sqlite3.connect(temporario)
+            try:
+                # um passo só: a cópia é uma fotografia do banco num instante (quem grava espera ela terminar)
+                origem.backup(destino)
+            except BaseException:
+                destino.close()
+                os.remove(temporario)
+                raise
+            finally:
+                origem.close()
+            destino.close()
+            os.replace(temporario, self.db_file)
+        return True
+
+    def _salvar_periodicamente(self):
+        """Corpo da thread de salvamento do modo em memória."""
+        while not self._parar_salvamento.wait(self.salvar_a_cada_segundos):
+            try:
+                self.salvar_em_disco()
+            except (sqlite3.Error, OSError) as e:
+                # tenta de novo na próxima rodada; o arquivo antigo continua inteiro
+                print(f"Erro ao salvar o banco em memória no disco: {e}")
+
+    def _salvar_ao_sair(self):
+        try:
+            self.salvar_em_disco()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Erro ao salvar o banco em memória no disco: {e}")
 
     def close(self):
-        """fecha o satanas da conexão com o banco de dados, isso se estiver aberta ainda"""
-        if self.conn:
-            self.conn.close()
+        """fecha o satanas das conexões com o banco de dados (de todas as threads), isso se estiverem abertas ainda"""
+        if self._persistente and self._conectado:
+            self._parar_salvamento.set()
+            if self._thread_salvamento:
+                self._thread_salvamento.join()
+                self._thread_salvamento = None
+            atexit.unregister(self._salvar_ao_sair)
+            # última gravação antes de soltar o banco da memória (ele some quando a última conexão fecha)
+            self._salvar_ao_sair()
+        self._conectado = False
+        with self._trava_conexoes:
+            conexoes, self._conexoes = self._conexoes, []
+        for conn in conexoes:
+            conn.close()
+        self._local = threading.local()
+
+    @contextmanager
+    def transacao(self):
+        """
+        Agrupa todas as queries executadas dentro do bloco em uma única transação.
+        Pode ser aninhada: os níveis internos viram SAVEPOINTs, e só o nível mais externo faz o commit.
+        Se der erro, tudo o que foi feito no nível é desfeito e a exceção é propagada.
+        O BEGIN IMMEDIATE já pega a trava de escrita do banco no início: com várias threads gravando,
+        quem chega depois espera (até DB_TIMEOUT_SEGUNDOS) em vez de dar erro no meio da transação.
+        """
+        nivel = self._nivel_transacao
+        savepoint = f"sp_{nivel}"
+        cursor = self.cursor
+        cursor.execute("BEGIN IMMEDIATE" if nivel == 0 else f"SAVEPOINT {savepoint}")
+        self._nivel_transacao = nivel + 1
+        try:
+            yield self
+        except BaseException:
+            self._nivel_transacao = nivel
+            if nivel == 0:
+                self.conn.rollback()
+            else:
+                cursor.execute(f"ROLLBACK TO {savepoint}")
+                cursor.execute(f"RELEASE {savepoint}")
+            raise
+        self._nivel_transacao = nivel
+        cursor.execute("COMMIT" if nivel == 0 else f"RELEASE {savepoint}")
 
     def execute_query(self, query, params=(), fetch=None):
         """se for preciso, executa uma query no banco de dados e retorna o resultado"""
+        cursor = self.cursor
         try:
-            self.cursor.execute(query, params)
+            cursor.execute(query, params)
             if fetch == 'one':
-                return self.cursor.fetchone()
+                return cursor.fetchone()
             if fetch == 'all':
-                return self.cursor.fetchall()
-            # se não for uma query de busca , faz o commit das alterações
-            self.conn.commit()
+                return cursor.fetchall()
+            # fora de uma transação explícita cada query já é gravada sozinha (autocommit);
+            # dentro de uma, o commit fica por conta do transacao()
             # retorna o ID da última linha inserida, o que pode ser útil para obter o ID de novos registros
-            return self.cursor.lastrowid
+            return cursor.lastrowid
         except sqlite3.Error as e:
+            # dentro de uma transação o erro tem que subir, senão o rollback nunca acontece
+            if self._nivel_transacao:
+                raise
             print(f"Erro ao executar query: {e}")
             print(f"Query: {query}")
             # retonra None em caso de erro para que a lógica da aplicação possa tratar
             return None
 
+    def execute_many(self, query, seq_params):
+        """executa a mesma query para uma sequência de parâmetros (bem mais rápido que um execute_query por linha)"""
+        cursor = self.cursor
+        try:
+            cursor.executemany(query, seq_params)
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            if self._nivel_transacao:
+                raise
+            print(f"Erro ao executar query em lote: {e}")
+            print(f"Query: {query}")
+            return None
+
 
     def create_tables(self):
         """cria todas as tabelas necessárias no banco de dados, isso se elasainda não existirem"""
@@ -97,7 +273,7 @@ class DatabaseManager:
             CREATE TABLE IF NOT EXISTS estoque (
                 produto_id INTEGER NOT NULL,
                 localizacao_id INTEGER NOT NULL,
-                quantidade INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL CHECK (quantidade >= 0),
                 PRIMARY KEY (produto_id, localizacao_id),
                 FOREIGN KEY (produto_id) REFERENCES produtos (id) ON DELETE CASCADE,
                 FOREIGN KEY (localizacao_id) REFERENCES localizacoes (id) ON DELETE CASCADE
@@ -135,6 +311,41 @@ class DatabaseManager:
                 FOREIGN KEY (produto_id) REFERENCES produtos(id) ON DELETE CASCADE
             );
             """,
+            # --- DOCUMENTOS DE TRANSFERÊNCIA ENTRE LOCALIZAÇÕES ---
+            """
+            CREATE TABLE IF NOT EXISTS transferencias (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                origem_id INTEGER NOT NULL,
+                destino_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                data_criacao TEXT NOT NULL,
+                data_recebimento TEXT,
+                FOREIGN KEY (origem_id) REFERENCES localizacoes(id) ON DELETE CASCADE,
+                FOREIGN KEY (destino_id) REFERENCES localizacoes(id) ON DELETE CASCADE
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS itens_transferencia (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                transferencia_id INTEGER NOT NULL,
+                produto_id INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL,
+                FOREIGN KEY (transferencia_id) REFERENCES transferencias(id) ON DELETE CASCADE,
+                FOREIGN KEY (produto_id) REFERENCES produtos(id) ON DELETE CASCADE
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS ordens_montagem (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kit_id INTEGER NOT NULL,
+                localizacao_id INTEGER NOT NULL,
+                tipo TEXT NOT NULL CHECK(tipo IN ('montagem', 'desmontagem')),
+                quantidade INTEGER NOT NULL CHECK(quantidade > 0),
+                data TEXT NOT NULL,
+                FOREIGN KEY (kit_id) REFERENCES produtos(id) ON DELETE CASCADE,
+                FOREIGN KEY (localizacao_id) REFERENCES localizacoes(id) ON DELETE CASCADE
+            );
+            """,
             """
             CREATE TABLE IF NOT EXISTS vendas (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -186,9 +397,198 @@ class DatabaseManager:
                 data TEXT NOT NULL,
                 FOREIGN KEY (devolucao_id) REFERENCES devolucoes(id) ON DELETE CASCADE
             );
+            """,
+            # --- CHECKPOINTS DO ESTOQUE (FOTOGRAFIAS PERIÓDICAS PARA CONSULTAS EM UMA DATA) ---
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints_estoque (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data TEXT NOT NULL,
+                ultimo_movimento_id INTEGER NOT NULL
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS itens_checkpoint_estoque (
+                checkpoint_id INTEGER NOT NULL,
+                produto_id INTEGER NOT NULL,
+                localizacao_id INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL,
+                PRIMARY KEY (checkpoint_id, produto_id, localizacao_id),
+                FOREIGN KEY (checkpoint_id) REFERENCES checkpoints_estoque(id) ON DELETE CASCADE,
+                FOREIGN KEY (produto_id) REFERENCES produtos(id) ON DELETE CASCADE,
+                FOREIGN KEY (localizacao_id) REFERENCES localizacoes(id) ON DELETE CASCADE
+            );
+            """,
+            # --- POSIÇÃO DA INGESTÃO DOS LOGS DE VENDA DO PDV (PRA RETOMAR DE ONDE PAROU) ---
+            """
+            CREATE TABLE IF NOT EXISTS ingestao_vendas (
+                arquivo TEXT PRIMARY KEY,
+                offset_bytes INTEGER NOT NULL,
+                linhas INTEGER NOT NULL,
+                atualizado_em TEXT NOT NULL
+            );
+            """,
+            # --- FEED DE EVENTOS (OUTBOX): O QUE MUDOU, PARA AS INTEGRAÇÕES LEREM SÓ O DELTA ---
+            # AUTOINCREMENT pra um id nunca ser reaproveitado depois da compactação (os cursores dependem disso)
+            """
+            CREATE TABLE IF NOT EXISTS eventos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tipo TEXT NOT NULL,
+                entidade_id INTEGER,
+                dados TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            """,
+            # até onde cada integração já leu e confirmou
+            """
+            CREATE TABLE IF NOT EXISTS consumidores_eventos (
+                nome TEXT PRIMARY KEY,
+                cursor INTEGER NOT NULL DEFAULT 0,
+                atualizado_em TEXT NOT NULL
+            );
+            """,
+            # --- ÚLTIMO MOVIMENTO DO DIÁRIO DA ESCRITA ADIADA QUE JÁ FOI GRAVADO NO BANCO ---
+            """
+            CREATE TABLE IF NOT EXISTS escrita_adiada (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                ultimo_seq INTEGER NOT NULL
+            );
+            """,
+            # resumo mensal por produto/local do que já foi arquivado (mantém as somas do histórico corretas)
+            """
+            CREATE TABLE IF NOT EXISTS resumo_movimentos_mensal (
+                mes TEXT NOT NULL,
+                produto_id INTEGER NOT NULL,
+                localizacao_id INTEGER NOT NULL,
+                quantidade INTEGER NOT NULL,
+                quantidade_movimentos INTEGER NOT NULL,
+                PRIMARY KEY (mes, produto_id, localizacao_id),
+                FOREIGN KEY (produto_id) REFERENCES produtos(id) ON DELETE CASCADE,
+                FOREIGN KEY (localizacao_id) REFERENCES localizacoes(id) ON DELETE CASCADE
+            );
             """
         ]
+        if self.arquivo_file:
+            # cada linha guarda os movimentos de um mês, em JSON compactado com zlib
+            queries.append("""
+            CREATE TABLE IF NOT EXISTS arquivo.lotes_movimentos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                mes TEXT NOT NULL,
+                quantidade_movimentos INTEGER NOT NULL,
+                primeiro_movimento_id INTEGER NOT NULL,
+                ultimo_movimento_id INTEGER NOT NULL,
+                dados BLOB NOT NULL
+            );
+            """)
         # exeutando cada uma das queries de criação de tabela
         # Zzzzz
         for query in queries:
-            self.execute_query(query)
\ No newline at end of file
+            self.execute_query(query)
+        # bancos criados antes do recebimento parcial de OCs não têm a coluna; as OCs que já estavam
+        # recebidas contam como recebidas por inteiro
+        if self._adicionar_coluna_se_faltar('itens_ordem_compra', 'quantidade_recebida', "INTEGER NOT NULL DEFAULT 0"):
+            self.execute_query("""UPDATE itens_ordem_compra SET quantidade_recebida = quantidade
+                                  WHERE ordem_id IN (SELECT id FROM ordens_compra WHERE status = 'Recebida')""")
+        # índice para somar o histórico por (produto, local) sem varrer a tabela inteira
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_historico_produto_local ON historico_movimentos (produto_id, localizacao_id)")
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_checkpoints_data ON checkpoints_estoque (data)")
+        # busca por código de barras direto no banco (catálogo sob demanda) e atualização em lote por fornecedor/categoria
+        # (o de tipo é o da lista de kits e das contagens por tipo, sem varrer o catálogo)
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_produtos_codigo_barras ON produtos (codigo_barras)")
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_produtos_fornecedor ON produtos (fornecedor_id)")
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_produtos_categoria ON produtos (categoria)")
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_produtos_tipo ON produtos (tipo_produto)")
+        # listagem paginada de produtos por nome (o id entra no fim do índice sozinho, como desempate)
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_produtos_nome ON produtos (nome)")
+        # no catálogo sob demanda cada documento é lido do banco com os seus itens, e os relatórios
+        # filtram o histórico por localização, as transferências em trânsito e as vendas por período lá mesmo
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_itens_ordem_compra_ordem ON itens_ordem_compra (ordem_id)")
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_itens_transferencia_documento ON itens_transferencia (transferencia_id)")
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_itens_venda_venda ON itens_venda (venda_id)")
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_itens_devolucao_devolucao ON itens_devolucao (devolucao_id)")
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_transacoes_devolucao ON transacoes (devolucao_id)")
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_historico_localizacao ON historico_movimentos (localizacao_id)")
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_transferencias_status ON transferencias (status)")
+        self.execute_query("CREATE INDEX IF NOT EXISTS idx_vendas_data ON vendas (data)")
+        self._configurar_triggers_ledger()
+        self._configurar_busca_texto()
+
+    def _adicionar_coluna_se_faltar(self, tabela: str, coluna: str, definicao: str) -> bool:
+        """Acrescenta uma coluna numa tabela que já existia (migração simples). Retorna True se precisou criar."""
+        colunas = [row[1] for row in self.execute_query(f"PRAGMA table_info({tabela})", fetch='all') or []]
+        if coluna in colunas:
+            return False
+        self.execute_query(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}")
+        return True
+
+    def _configurar_busca_texto(self):
+        """
+        Índice de texto completo (FTS5) das descrições, usado pela busca de produtos. É uma tabela de conteúdo
+        externo: o texto fica só em 'produtos' e os triggers mantêm o índice em dia. Se o sqlite não tiver
+        o FTS5, as descrições entram no índice de busca em memória junto com o nome (ver busca.py).
+        """
+        existia = self.execute_query("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'produtos_fts'", fetch='one')
+        try:
+            # direto no cursor: o execute_query só imprimiria o erro, e aqui ele é esperado
+            self.cursor.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts USING fts5(
+                                       descricao, content='produtos', content_rowid='id',
+                                       tokenize='unicode61 remove_diacritics 2')""")
+        except sqlite3.OperationalError:
+            # sem o módulo, os triggers de um banco criado em outra máquina fariam todo INSERT em produtos falhar
+            for trigger in ('trg_produtos_fts_insere', 'trg_produtos_fts_remove', 'trg_produtos_fts_atualiza'):
+                self.execute_query(f"DROP TRIGGER IF EXISTS {trigger}")
+            self.fts5_disponivel = False
+            return
+        self.execute_query("""
+            CREATE TRIGGER IF NOT EXISTS trg_produtos_fts_insere AFTER INSERT ON produtos BEGIN
+                INSERT INTO produtos_fts (rowid, descricao) VALUES (NEW.id, NEW.descricao);
+            END;
+        """)
+        self.execute_query("""
+            CREATE TRIGGER IF NOT EXISTS trg_produtos_fts_remove AFTER DELETE ON produtos BEGIN
+                INSERT INTO produtos_fts (produtos_fts, rowid, descricao) VALUES ('delete', OLD.id, OLD.descricao);
+            END;
+        """)
+        self.execute_query("""
+            CREATE TRIGGER IF NOT EXISTS trg_produtos_fts_atualiza AFTER UPDATE OF descricao ON produtos BEGIN
+                INSERT INTO produtos_fts (produtos_fts, rowid, descricao) VALUES ('delete', OLD.id, OLD.descricao);
+                INSERT INTO produtos_fts (rowid, descricao) VALUES (NEW.id, NEW.descricao);
+            END;
+        """)
+        if not existia:
+            # banco que já tinha produtos antes do índice existir
+            self.execute_query("INSERT INTO produtos_fts (produtos_fts) VALUES ('rebuild')")
+        self.fts5_disponivel = True
+
+    def _configurar_triggers_ledger(self):
+        """
+        No modo ledger, o histórico de movimentos é a fonte da verdade: basta inserir o movimento
+        e os triggers aplicam o delta na tabela 'estoque' (na mesma transação do INSERT).
+        Fora desse modo os triggers são removidos, senão o estoque seria atualizado em dobro.
+        """
+        if not ESTOQUE_VIA_LEDGER:
+            self.execute_query("DROP TRIGGER IF EXISTS trg_ledger_valida_saida")
+            self.execute_query("DROP TRIGGER IF EXISTS trg_ledger_aplica_movimento")
+            return
+
+        # bancos antigos foram criados sem o CHECK na tabela estoque, então a saída também é barrada aqui
+        self.execute_query("""
+            CREATE TRIGGER IF NOT EXISTS trg_ledger_valida_saida
+            BEFORE INSERT ON historico_movimentos
+            WHEN NEW.quantidade < 0 AND COALESCE((SELECT quantidade FROM estoque
+                                                  WHERE produto_id = NEW.produto_id
+                                                    AND localizacao_id = NEW.localizacao_id), 0) + NEW.quantidade < 0
+            BEGIN
+                SELECT RAISE(ABORT, 'estoque insuficiente');
+            END;
+        """)
+        self.execute_query("""
+            CREATE TRIGGER IF NOT EXISTS trg_ledger_aplica_movimento
+            AFTER INSERT ON historico_movimentos
+            BEGIN
+                -- (um UPSERT direto não serve: o CHECK barraria a linha "candidata" com quantidade negativa)
+                INSERT OR IGNORE INTO estoque (produto_id, localizacao_id, quantidade)
+                VALUES (NEW.produto_id, NEW.localizacao_id, 0);
+                UPDATE estoque SET quantidade = quantidade + NEW.quantidade
+                WHERE produto_id = NEW.produto_id AND localizacao_id = NEW.localizacao_id;
+            END;
+        """)
\ No newline at end of file
@@ -0,0 +1,152 @@
+# escrita_adiada.py
+# Contém a FilaEscrita, usada no modo de escrita adiada (write-behind) das movimentações de estoque:
+# quem movimenta o estoque atualiza a memória, anota o movimento num diário (arquivo JSONL) e segue em frente;
+# uma thread em segundo plano grava os movimentos no banco em lotes (vários movimentos por commit).
+# Se o programa cair antes do commit, o diário é reaplicado na próxima vez que o sistema abrir.
+
+import json
+import os
+import queue
+import threading
+from time import monotonic
+
+from config import ESCRITA_ADIADA_FILA_MAXIMA, ESCRITA_ADIADA_LOTE, ESCRITA_ADIADA_INTERVALO_MS
+
+
+def ler_diario(arquivo: str) -> list[list]:
+    """
+    Lê o diário e retorna os registros [seq, produto_id, localizacao_id, quantidade, tipo, data].
+    Uma última linha cortada no meio (queda durante a escrita) é ignorada.
+    """
+    if not os.path.exists(arquivo):
+        return []
+    registros = []
+    with open(arquivo, 'r', encoding='utf-8') as f:
+        for linha in f:
+            try:
+                registros.append(json.loads(linha))
+            except ValueError:
+                break
+    return registros
+
+
+class FilaEscrita:
+    """fila limitada de movimentos esperando pra ir pro banco, com a thread que grava em lotes"""
+    def __init__(self, gravar_lote, arquivo_diario: str, ultimo_seq: int = 0,
+                 tamanho_maximo: int = ESCRITA_ADIADA_FILA_MAXIMA, lote: int = ESCRITA_ADIADA_LOTE,
+                 intervalo_ms: int = ESCRITA_ADIADA_INTERVALO_MS, depois_de_gravar=None):
+        # gravar_lote(registros, ultimo_seq) grava os registros numa transação só (junto com o último seq gravado)
+        self.gravar_lote = gravar_lote
+        # depois_de_gravar(quantidade), se informado, roda depois de cada commit; um erro nele é só aviso
+        # (o lote já está no banco e a fila não pode parar por causa disso)
+        self.depois_de_gravar = depois_de_gravar
+        self.arquivo_diario = arquivo_diario
+        self.lote = lote
+        self.intervalo = intervalo_ms / 1000
+        # a fila cheia faz quem enfileira esperar (contrapressão): a memória não dispara na frente do banco
+        self._fila: queue.Queue = queue.Queue(maxsize=tamanho_maximo)
+        self._trava_diario = threading.Lock()
+        self._condicao = threading.Condition()
+        self._seq_enfileirado = ultimo_seq
+        self._seq_gravado = ultimo_seq
+        self.erro: Exception | None = None
+        self._diario = open(arquivo_diario, 'a', encoding='utf-8')
+        # daemon: se alguém esquecer de parar a fila, o programa fecha mesmo assim e o diário é reaplicado depois
+        self._thread = threading.Thread(target=self._executar, name="escrita-adiada", daemon=True)
+        self._thread.start()
+
+    @property
+    def pendentes(self) -> int:
+        """quantos movimentos já foram aceitos mas ainda não foram confirmados no banco"""
+        return self._seq_enfileirado - self._seq_gravado
+
+    def enfileirar(self, registro: tuple) -> int:
+        """
+        Anota o registro (produto_id, localizacao_id, quantidade, tipo, data) no diário e coloca na fila.
+        Retorna o número de sequência dele. Espera se a fila estiver cheia.
+        O diário vai pro disco (fsync) antes de retornar: o movimento aceito sobrevive até a uma queda de energia.
+        """
+        if self.erro:
+            raise self.erro
+        with self._trava_diario:
+            self._seq_enfileirado += 1
+            seq = self._seq_enfileirado
+            self._diario.write(json.dumps([seq, *registro], ensure_ascii=False) + "\n")
+            self._diario.flush()
+            os.fsync(self._diario.fileno())
+            self._fila.put((seq, registro))
+        return seq
+
+    def aguardar(self, seq: int | None = None, timeout: float | None = None) -> bool:
+        """
+        Barreira: espera até o movimento 'seq' (por padrão, tudo o que já foi enfileirado) estar confirmado no banco.
+        Retorna False se o tempo acabar. Se a gravação falhou, levanta o erro.
+        """
+        if threading.current_thread() is self._thread:
+            return True
+        alvo = self._seq_enfileirado if seq is None else seq
+        with self._condicao:
+            ok = self._condicao.wait_for(lambda: self._seq_gravado >= alvo or self.erro is not None, timeout)
+        if self.erro:
+            raise self.erro
+        return ok
+
+    def parar(self):
+        """Grava o que ainda estiver na fila e encerra a thread."""
+        if self._thread.is_alive():
+            self._fila.put(None)
+            self._thread.join()
+        self._diario.close()
+        if self.erro:
+            raise self.erro
+
+    def _executar(self):
+        """Corpo da thread: junta o que chegou na fila num lote e grava com um commit só."""
+        while True:
+            item = self._fila.get()
+            if item is None:
+                return
+            lote = [item]
+            # espera um pouquinho pra juntar mais movimentos no mesmo commit
+            prazo = monotonic() + self.intervalo
+            parar = False
+            while len(lote) < self.lote:
+                try:
+                    item = self._fila.get(timeout=max(prazo - monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    parar = True
+                    break
+                lote.append(item)
+
+            try:
+                self.gravar_lote([registro for _, registro in lote], lote[-1][0])
+            except Exception as e:
+                # o lote continua no diário; quem estiver esperando (ou enfileirar depois) recebe o erro
+                with self._condicao:
+                    self.erro = e
+                    self._condicao.notify_all()
+                return
+
+            with self._condicao:
+                self._seq_gravado = lote[-1][0]
+                self._condicao.notify_all()
+            if self.depois_de_gravar:
+                try:
+                    self.depois_de_gravar(len(lote))
+                except Exception as e:
+                    print(f"Aviso: erro depois de gravar um lote da escrita adiada (o lote foi gravado): {e}")
+            self._limpar_diario_se_em_dia()
+            if parar:
+                return
+
+    def _limpar_diario_se_em_dia(self):
+        # com tudo gravado, o diário pode ser zerado; se alguém estiver enfileirando agora, fica pra próxima
+        if self._trava_diario.acquire(blocking=False):
+            try:
+                if self._seq_gravado == self._seq_enfileirado:
+                    self._diario.flush()
+                    os.ftruncate(self._diario.fileno(), 0)
+            finally:
+                self._trava_diario.release()
@@ -0,0 +1,124 @@
+# estresse.py
+# Teste de estresse das travas do GerenciadorEstoque: várias threads vendendo (e transferindo) os MESMOS
+# produtos ao mesmo tempo, num banco temporário. No final confere que nada foi vendido além do estoque
+# (sem saldo negativo), que a memória bate com o banco e que o saldo do banco bate com o histórico.
+# Sai com código 1 se alguma conferência falhar. Exemplo:
+#   python estresse.py --threads 32 --operacoes 200
+#   python estresse.py --escrita-adiada
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+from collections import Counter
+from time import perf_counter
+
+from database import DatabaseManager
+from manager import GerenciadorEstoque
+
+
+def _preparar(gerenciador: GerenciadorEstoque, produtos: int, estoque_inicial: int):
+    fornecedor = gerenciador.adicionar_fornecedor(nome="Estresse", empresa="Estresse Ltda", telefone="", email="", morada="")
+    loja = gerenciador.adicionar_localizacao(nome="Loja", endereco="")
+    deposito = gerenciador.adicionar_localizacao(nome="Depósito", endereco="")
+    ids = []
+    for i in range(produtos):
+        produto = gerenciador.adicionar_produto(nome=f"Produto {i}", descricao="", categoria="Estresse",
+                                                fornecedor_id=fornecedor.id, codigo_barras=f"EST{i:04d}",
+                                                preco_compra=1, preco_venda=2, ponto_ressuprimento=0,
+                                                tipoProduto='individual')
+        gerenciador.movimentar_estoque(produto.id, loja.id, estoque_inicial, "Carga Inicial")
+        ids.append(produto.id)
+    return ids, loja.id, deposito.id
+
+
+def _rodar_caixa(gerenciador: GerenciadorEstoque, ids: list[int], loja_id: int, deposito_id: int, operacoes: int,
+                 rng: random.Random, vendido: Counter, recusas: Counter, erros: list, trava: threading.Lock):
+    for _ in range(operacoes):
+        # vários itens por venda, em ordem aleatória: é o que faria duas vendas se travarem sem a ordem fixa
+        itens = [{'produto_id': p_id, 'quantidade': rng.randint(1, 3)} for p_id in rng.sample(ids, rng.randint(1, len(ids)))]
+        try:
+            if rng.random() < 0.15:
+                item = itens[0]
+                origem, destino = (loja_id, deposito_id) if rng.random() < 0.5 else (deposito_id, loja_id)
+                gerenciador.transferir_estoque(item['produto_id'], origem, destino, item['quantidade'])
+            else:
+                gerenciador.registrar_venda(itens, "Estresse", loja_id)
+                with trava:
+                    vendido.update({item['produto_id']: item['quantidade'] for item in itens})
+        except ValueError:
+            # falta de estoque é esperado: é justamente o que não pode deixar passar
+            with trava:
+                recusas['operacoes'] += 1
+        except Exception as e:
+            with trava:
+                erros.append(repr(e))
+
+
+def executar_estresse(threads: int = 16, operacoes: int = 100, produtos: int = 3, estoque_inicial: int = 500,
+                      escrita_adiada: bool = False, semente: int = 42) -> tuple[bool, str]:
+    """Roda o teste num banco temporário e devolve (passou?, relatório)."""
+    with tempfile.TemporaryDirectory() as diretorio:
+        db = DatabaseManager(os.path.join(diretorio, "estresse.db"), arquivo_file=os.path.join(diretorio, "estresse_arquivo.db"))
+        db.connect()
+        db.create_tables()
+        gerenciador = GerenciadorEstoque(db, escrita_adiada=escrita_adiada)
+        try:
+            gerenciador.carregar_dados_do_banco(verboso=False)
+            ids, loja_id, deposito_id = _preparar(gerenciador, produtos, estoque_inicial)
+
+            vendido, recusas, erros, trava = Counter(), Counter(), [], threading.Lock()
+            rng = random.Random(semente)
+            caixas = [threading.Thread(target=_rodar_caixa, args=(gerenciador, ids, loja_id, deposito_id, operacoes,
+                                                                  random.Random(rng.random()), vendido, recusas, erros, trava))
+                      for _ in range(threads)]
+            inicio = perf_counter()
+            for caixa in caixas:
+                caixa.start()
+            for caixa in caixas:
+                caixa.join()
+            duracao = perf_counter() - inicio
+            gerenciador.sincronizar_escrita()
+
+            falhas = [f"erro inesperado numa thread: {e}" for e in erros[:5]]
+            no_banco = {(p_id, l_id): qtd for p_id, l_id, qtd in
+                        db.execute_query("SELECT produto_id, localizacao_id, quantidade FROM estoque", fetch='all') or []}
+            for p_id in ids:
+                produto = gerenciador.produtos[p_id]
+                total_banco = sum(qtd for (produto_id, _), qtd in no_banco.items() if produto_id == p_id)
+                if vendido[p_id] > estoque_inicial:
+                    falhas.append(f"produto #{p_id}: vendeu {vendido[p_id]} com só {estoque_inicial} em estoque")
+                if total_banco != estoque_inicial - vendido[p_id]:
+                    falhas.append(f"produto #{p_id}: saldo {total_banco} no banco, esperado {estoque_inicial - vendido[p_id]}")
+                for l_id, localizacao in gerenciador.localizacoes.items():
+                    em_memoria = produto.estoque_por_local.get(localizacao.nome, 0)
+                    if em_memoria < 0 or em_memoria != no_banco.get((p_id, l_id), 0):
+                        falhas.append(f"produto #{p_id} em '{localizacao.nome}': {em_memoria} na memória, "
+                                      f"{no_banco.get((p_id, l_id), 0)} no banco")
+            for p_id, l_id, qtd_estoque, qtd_historico in gerenciador.verificar_consistencia_estoque():
+                falhas.append(f"produto #{p_id} na localização #{l_id}: estoque {qtd_estoque}, histórico {qtd_historico}")
+        finally:
+            gerenciador.encerrar()
+            db.close()
+
+    linhas = [f"--- Teste de estresse: {threads} threads x {operacoes} operações em {duracao:.2f}s "
+              f"({threads * operacoes / duracao:,.0f} op/s){' com escrita adiada' if escrita_adiada else ''} ---",
+              f"Vendido: {sum(vendido.values())} de {estoque_inicial * produtos} unidades | "
+              f"Operações recusadas por falta de estoque: {recusas['operacoes']}"]
+    linhas += [f"FALHOU: {falha}" for falha in falhas] or ["OK: nenhuma venda além do estoque, memória, banco e histórico batem."]
+    return not falhas, "\n".join(linhas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teste de estresse das travas de estoque (várias threads vendendo os mesmos produtos).")
+    parser.add_argument('--threads', type=int, default=16, help="threads vendendo ao mesmo tempo (padrão: 16)")
+    parser.add_argument('--operacoes', type=int, default=100, help="operações por thread (padrão: 100)")
+    parser.add_argument('--produtos', type=int, default=3, help="quantos produtos disputados (padrão: 3)")
+    parser.add_argument('--estoque', type=int, default=500, help="estoque inicial de cada produto (padrão: 500)")
+    parser.add_argument('--escrita-adiada', action='store_true', help="roda com a escrita adiada (write-behind) ligada")
+    args = parser.parse_args()
+    passou, relatorio = executar_estresse(args.threads, args.operacoes, args.produtos, args.estoque, args.escrita_adiada)
+    print(relatorio)
+    sys.exit(0 if passou else 1)
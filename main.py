@@ -1,7 +1,9 @@
 # main.py
 
+import sys
+
 # Importa as classes principais de cada módulo do sistema.
-from config import DB_FILE
+from config import DB_FILE, ARQUIVO_DB_FILE
 from database import DatabaseManager
 from manager import GerenciadorEstoque
 from cli import CliApp
@@ -12,8 +14,14 @@ from cli import CliApp
 # quando este arquivo for rodado diretamente
 # (e não quando for importado por outro arquivo)
 if __name__ == "__main__":
+    # 0. se vier algum argumento (ex: "python main.py venda ..."), roda o modo em lote e sai,
+    # sem menus, sem limpar a tela e sem popular dados de exemplo
+    if len(sys.argv) > 1:
+        from comandos import executar_comando
+        sys.exit(executar_comando(sys.argv[1:]))
+
     # 1. vai inicializar o gerenciador do banco de dados
-    db = DatabaseManager(DB_FILE)
+    db = DatabaseManager(DB_FILE, arquivo_file=ARQUIVO_DB_FILE)
     # 2. conectar ao arquivo do banco de dados
     db.connect()
     # 3. garantir que todas as tabelas necessárias existam
@@ -90,4 +98,6 @@ if __name__ == "__main__":
         # esse diabo desse bloco SEMPRE vai ser executado no final, seja por saída normal ou por erro
         # gaarante que a conexão com o banco de dados seja fechada ao sair
         print("Fechando conexão com o banco de dados...")
+        # grava o que ainda estiver na fila da escrita adiada (se estiver ligada)
+        gerenciador.encerrar()
         db.close()
\ No newline at end of file
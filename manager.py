@@ -2,31 +2,154 @@
 # Contém a classe GerenciadorEstoque, que lida com toda a lógica de negócios
 # e gerenciamento de dados da aplicação.
 
+import csv
+import heapq
+import json
+import os
 import sqlite3
+import threading
+import uuid
+import zlib
 from collections import Counter
-from datetime import datetime, time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, ExitStack
+from datetime import datetime, time, timedelta
+from time import perf_counter, monotonic
 
 # Importa as classes de modelo e o gerenciador de banco de dados
 from models import (Fornecedor, Localizacao, Produto, HistoricoMovimento,
-                    ItemOrdemCompra, OrdemCompra, ItemVenda, Venda,
-                    Devolucao, ItemDevolucao, Transacao, ComponenteKit)
+                    ItemOrdemCompra, OrdemCompra, ItemVenda, Venda, Carrinho, Reserva, OrdemMontagem, ItemTransferencia, DocumentoTransferencia,
+                    Devolucao, ItemDevolucao, Transacao, ComponenteKit, ResultadoImportacao,
+                    DivergenciaContagem, ConciliacaoInventario, ResultadoIngestao, Evento, Pagina)
 from database import DatabaseManager
+from escrita_adiada import FilaEscrita, ler_diario
+from catalogo import CatalogoProdutos, CatalogoDocumentos, ReferenciaProduto
+from busca import IndiceBusca, normalizar
+from config import (ESTOQUE_VIA_LEDGER, ESCRITA_ADIADA, CHECKPOINT_A_CADA_MOVIMENTOS, CHECKPOINT_INTERVALO_HORAS,
+                    HORIZONTE_ARQUIVAMENTO_DIAS, INGESTAO_VENDAS_POR_LOTE, INGESTAO_INTERVALO_MS, RESERVA_TTL_SEGUNDOS,
+                    CATALOGO_MAXIMO_EM_MEMORIA, CHECKPOINT_RETENCAO)
+
+
+# saldo por (produto, localização) de uma faixa de produtos; o que já foi arquivado entra pelo resumo mensal
+_QUERY_SOMA_FAIXA = """SELECT produto_id, localizacao_id, SUM(quantidade) FROM (
+                           SELECT produto_id, localizacao_id, quantidade FROM historico_movimentos WHERE produto_id BETWEEN ? AND ?
+                           UNION ALL
+                           SELECT produto_id, localizacao_id, quantidade FROM resumo_movimentos_mensal WHERE produto_id BETWEEN ? AND ?
+                       ) GROUP BY produto_id, localizacao_id"""
+
+
+# soma o histórico de uma faixa de produtos; fica fora da classe para poder rodar em outro processo
+def _somar_movimentos_faixa(db_file: str, id_inicial: int, id_final: int) -> list[tuple[int, int, int]]:
+    """Retorna (produto_id, localizacao_id, saldo) somando o histórico dos produtos entre id_inicial e id_final."""
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        return conn.execute(_QUERY_SOMA_FAIXA, (id_inicial, id_final, id_inicial, id_final)).fetchall()
+    finally:
+        conn.close()
 
 
 #  classe principal de lógica de negócios
 
 class GerenciadorEstoque:
     """cheguemos na classe principal agora"""
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: DatabaseManager, escrita_adiada: bool = ESCRITA_ADIADA,
+                 maximo_produtos_em_memoria: int | None = CATALOGO_MAXIMO_EM_MEMORIA):
         self.db = db_manager
         # dicionários para armazenar os objetos em memória para acesso rápido
-        self.produtos: dict[int, Produto] = {}
+        self.produtos: dict[int, Produto] | CatalogoProdutos = {}
+        if maximo_produtos_em_memoria:
+            if escrita_adiada:
+                # com a escrita adiada a memória fica na frente do banco, e um produto relido de lá viria defasado
+                raise ValueError("O catálogo sob demanda não funciona junto com a escrita adiada.")
+            # catálogo sob demanda: só os produtos usados por último ficam em memória, o resto vem do banco
+            self.produtos = CatalogoProdutos(self._carregar_produto, *self._consultas_da_tabela("produtos"), maximo_produtos_em_memoria)
         self.fornecedores: dict[int, Fornecedor] = {}
         self.localizacoes: dict[int, Localizacao] = {}
+        # no catálogo sob demanda o histórico fica só no banco (relatórios e listagens consultam lá)
         self.historico: list[HistoricoMovimento] = []
-        self.ordens_compra: dict[int, OrdemCompra] = {}
-        self.vendas: dict[int, Venda] = {}
-        self.devolucoes: dict[int, Devolucao] = {} # dicionário para devoluções
+        self.ordens_compra: dict[int, OrdemCompra] | CatalogoDocumentos = {}
+        self.vendas: dict[int, Venda] | CatalogoDocumentos = {}
+        self.devolucoes: dict[int, Devolucao] | CatalogoDocumentos = {} # dicionário para devoluções
+        self.transferencias: dict[int, DocumentoTransferencia] | CatalogoDocumentos = {}
+        self.ordens_montagem: dict[int, OrdemMontagem] | CatalogoDocumentos = {}
+        if self._catalogo_sob_demanda:
+            # os documentos também: cada um é lido do banco (com os itens) quando pedido, senão a memória
+            # cresceria com o volume de vendas, OCs... mesmo com o catálogo de produtos limitado
+            for atributo, tabela, ler in (('ordens_compra', 'ordens_compra', self._ler_ordens_compra),
+                                          ('transferencias', 'transferencias', self._ler_transferencias),
+                                          ('ordens_montagem', 'ordens_montagem', self._ler_ordens_montagem),
+                                          ('vendas', 'vendas', self._ler_vendas),
+                                          ('devolucoes', 'devolucoes', self._ler_devolucoes)):
+                carregar = lambda documento_id, ler=ler: ler("WHERE id = ?", (documento_id,)).get(documento_id)
+                setattr(self, atributo, CatalogoDocumentos(carregar, *self._consultas_da_tabela(tabela), maximo_produtos_em_memoria))
+        # índice código de barras -> id do produto (busca por leitor e importação por chave natural)
+        self._indice_codigo_barras: dict[str, int] = {}
+        # índice da busca de produtos por digitação (nome, categoria, código de barras); None = montar na primeira busca
+        self._indice_busca: IndiceBusca | None = None
+        self._trava_indice_busca = threading.Lock()
+        # controle de quando gravar o próximo checkpoint do estoque
+        self._movimentos_desde_checkpoint = 0
+        self._data_ultimo_checkpoint: datetime | None = None
+        # travas por célula de estoque (produto, localização), pra vários caixas venderem ao mesmo tempo
+        self._travas_estoque: dict[tuple[int, int], threading.RLock] = {}
+        self._trava_registro_travas = threading.Lock()
+        # só protege o contador e a data acima; vem sempre depois da transação do banco (ver _travar_estoque)
+        self._trava_checkpoint = threading.Lock()
+        # o checkpoint é gravado por uma thread própria, fora do caminho das vendas: quem movimenta só conta
+        # e avisa quando passou do limite (a thread é criada no primeiro aviso)
+        self._pedido_checkpoint = threading.Event()
+        self._parar_checkpoints = False
+        self._thread_checkpoint: threading.Thread | None = None
+        # escrita adiada: a fila só é criada depois que os dados são carregados (e o diário reaplicado)
+        self._usar_escrita_adiada = escrita_adiada
+        self._fila_escrita: FilaEscrita | None = None
+        # último movimento enfileirado de cada célula, pra saber o que esperar antes de gravar nela direto
+        self._seq_escrita_por_celula: dict[tuple[int, int], int] = {}
+        # quantos de cada kit dá pra montar em cada localização: {localizacao_id: {kit_id: quantidade}},
+        # calculado sob demanda e descartado quando algum componente do kit mexe naquela localização
+        self._kits_por_local: dict[int, dict[int, int]] = {}
+        # índice reverso produto individual -> kits que o consomem em qualquer nível, e a ordem topológica
+        # dos kits (os de dentro antes dos de fora), os dois só com ids; None = refazer na próxima consulta
+        self._indice_kits_por_componente: dict[int, list[int]] | None = None
+        self._ordem_kits: list[int] | None = None
+        self._trava_kits = threading.Lock()
+        # protege os dicionários estoque_por_local dos produtos: quem muda segura, e quem lê de outra thread
+        # (o servidor) copia segurando, pra não pegar um dicionário mudando de tamanho no meio
+        self._trava_estoque_memoria = threading.Lock()
+        # reservas de estoque (só em memória: são curtas e expiram sozinhas). O total reservado por célula
+        # fica pronto num Counter, e as expiradas saem aos poucos por um heap ordenado pela expiração
+        self._reservas: dict[str, Reserva] = {}
+        self._reservado_por_celula: Counter[tuple[int, int]] = Counter()
+        self._expiracao_reservas: list[tuple[float, str]] = []
+        self._trava_reservas = threading.Lock()
+        # consumidores do feed de eventos que já se sabe estarem registrados no banco (pra ler sem gravar nada)
+        self._consumidores_eventos: set[str] = set()
+
+    @contextmanager
+    def _travar_estoque(self, celulas, sincronizar: bool = True):
+        """
+        Trava as células (produto_id, localizacao_id) informadas enquanto o bloco roda. As travas são pegas
+        sempre na mesma ordem (ordenadas), então duas operações nunca ficam esperando uma pela outra, e sempre
+        ANTES de abrir a transação no banco. São reentrantes: quem já travou pode chamar métodos que travam de novo.
+        Com a escrita adiada ligada, espera os movimentos dessas células que ainda estão na fila chegarem ao banco
+        (quem grava direto no banco lê os saldos de lá).
+
+        Ordem das travas, a mesma em todo o gerenciador (é o que impede duas threads de ficarem esperando uma pela outra):
+          1. travas das células (estas aqui), ordenadas;
+          2. a transação do banco (o BEGIN IMMEDIATE pega a trava de escrita do arquivo);
+          3. as travas internas da memória (_trava_checkpoint, _trava_estoque_memoria, _trava_kits, _trava_reservas,
+             _trava_indice_busca...); _trava_estoque_memoria vem antes da _trava_kits quando as duas são pegas juntas.
+        As do item 3 são as últimas da fila: quem está com uma delas não abre transação nem trava célula.
+        """
+        celulas = sorted(set(celulas))
+        with self._trava_registro_travas:
+            travas = [self._travas_estoque.setdefault(celula, threading.RLock()) for celula in celulas]
+        with ExitStack() as pilha:
+            for trava in travas:
+                pilha.enter_context(trava)
+            if sincronizar and self._fila_escrita:
+                self._fila_escrita.aguardar(max((self._seq_escrita_por_celula.get(c, 0) for c in celulas), default=0))
+            yield
 
     def get_todas_categorias(self) -> list[str]:
         """Busca no banco de dados e retorna uma lista de todas as categorias de produtos distintas."""
@@ -34,9 +157,15 @@ class GerenciadorEstoque:
         rows = self.db.execute_query(query, fetch='all')
         return [row[0] for row in rows] if rows else []
 
-    def carregar_dados_do_banco(self):
+    def carregar_dados_do_banco(self, verboso: bool = True):
         """Carrega todos os dados do banco de dados para a memória (dicionários)."""
-        print("Carregando dados do banco...")
+        if verboso:
+            print("Carregando dados do banco...")
+        if self._fila_escrita:
+            # o que está na fila tem que estar no banco antes de recarregar a memória de lá
+            self.sincronizar_escrita()
+        else:
+            self._reaplicar_diario_escrita(verboso)
         # Limpa os dicionários em memória antes de recarregar
         self.produtos.clear()
         self.fornecedores.clear()
@@ -45,6 +174,12 @@ class GerenciadorEstoque:
         self.ordens_compra.clear()
         self.vendas.clear()
         self.devolucoes.clear()
+        self.transferencias.clear()
+        self.ordens_montagem.clear()
+        self._consumidores_eventos.clear()
+        self._indice_codigo_barras.clear()
+        self._indice_busca = None
+        self._invalidar_kits()
 
         # carrega fornecedores
         fornecedores_data = self.db.execute_query("SELECT * FROM fornecedores", fetch='all')
@@ -58,8 +193,8 @@ class GerenciadorEstoque:
             for row in localizacoes_data:
                 self.localizacoes[row[0]] = Localizacao(*row)
 
-        # carrega produtos e associa o fornecedor correspondente
-        produtos_data = self.db.execute_query("SELECT * FROM produtos", fetch='all')
+        # carrega produtos e associa o fornecedor correspondente (no catálogo sob demanda, cada um vem quando for pedido)
+        produtos_data = None if self._catalogo_sob_demanda else self.db.execute_query("SELECT * FROM produtos", fetch='all')
         if produtos_data:
             for row in produtos_data:
                 prod_id, nome, desc, cat, cod, p_compra, p_venda, p_ress, forn_id, tipo_prod = row
@@ -71,97 +206,228 @@ class GerenciadorEstoque:
                         preco_compra=p_compra, preco_venda=p_venda, 
                         ponto_ressuprimento=p_ress, tipoProduto=tipo_prod
                     )
+                    self._indexar_codigo_barras(self.produtos[prod_id])
 
         # carrega o estoque de cada produto em cada localização
-        query_estoque = "SELECT p.id, l.nome, e.quantidade FROM estoque e JOIN produtos p ON e.produto_id = p.id JOIN localizacoes l ON e.localizacao_id = l.id"
-        estoque_data = self.db.execute_query(query_estoque, fetch='all')
-        if estoque_data:
-            for prod_id, local_nome, qtd in estoque_data:
-                if prod_id in self.produtos:
-                    self.produtos[prod_id].estoque_por_local[local_nome] = qtd
-        
+        self._recarregar_estoque_em_memoria()
+
         # Carrega os componentes dos kits
-        componentes_data = self.db.execute_query("SELECT kit_produto_id, componente_produto_id, quantidade FROM componentes_kit", fetch='all')
+        componentes_data = None if self._catalogo_sob_demanda else self.db.execute_query(
+            "SELECT kit_produto_id, componente_produto_id, quantidade FROM componentes_kit", fetch='all')
         if componentes_data:
             for kit_id, comp_id, qtd in componentes_data:
                 if (kit := self.produtos.get(kit_id)) and (componente_prod := self.produtos.get(comp_id)):
                     kit.componentes.append(ComponenteKit(produto=componente_prod, quantidade=qtd))
-            # Recalcula o preço de compra dos kits com base nos componentes carregados
-            for produto in self.produtos.values():
-                if produto.tipoProduto == 'kit':
-                    produto.recalcular_preco_compra()
-
-
-        # carrega o histórico de movimentações
-        query_hist = "SELECT produto_id, localizacao_id, tipo, quantidade, data FROM historico_movimentos"
-        hist_data = self.db.execute_query(query_hist, fetch='all')
-        if hist_data:
-            for p_id, l_id, tipo, qtd, data_str in hist_data:
-                if (produto := self.produtos.get(p_id)) and (localizacao := self.localizacoes.get(l_id)):
-                    self.historico.append(HistoricoMovimento(produto, tipo, qtd, localizacao, datetime.fromisoformat(data_str)))
-
-        # carrega as Ordens de Compra (cabeçalho)
-        ocs_data = self.db.execute_query("SELECT * FROM ordens_compra", fetch='all')
-        if ocs_data:
-            for row in ocs_data:
-                oc_id, forn_id, status, data_str = row
-                if fornecedor := self.fornecedores.get(forn_id):
-                    self.ordens_compra[oc_id] = OrdemCompra(oc_id, fornecedor, [], status, datetime.fromisoformat(data_str))
-
-        # carrega os itens de cada Ordem de Compra
-        query_itens_oc = "SELECT ordem_id, produto_id, quantidade, preco_unitario FROM itens_ordem_compra"
-        itens_oc_data = self.db.execute_query(query_itens_oc, fetch='all')
-        if itens_oc_data:
-            for oc_id, p_id, qtd, preco in itens_oc_data:
-                if (oc := self.ordens_compra.get(oc_id)) and (produto := self.produtos.get(p_id)):
-                    item = ItemOrdemCompra(produto, qtd, preco)
-                    oc.itens.append(item)
-
-        # carrega o histórico de Vendas (cabeçalho)
-        vendas_data = self.db.execute_query("SELECT id, cliente_nome, data FROM vendas", fetch='all')
-        if vendas_data:
-            for row in vendas_data:
-                venda_id, cliente, data_str = row
-                self.vendas[venda_id] = Venda(venda_id, cliente, [], datetime.fromisoformat(data_str))
-
-        # carrega os itens de cada venda
-        query_itens_venda = "SELECT venda_id, produto_id, quantidade, preco_venda_unitario FROM itens_venda"
-        itens_venda_data = self.db.execute_query(query_itens_venda, fetch='all')
-        if itens_venda_data:
-            for v_id, p_id, qtd, preco in itens_venda_data:
-                if (venda := self.vendas.get(v_id)) and (produto := self.produtos.get(p_id)):
-                    item = ItemVenda(produto, qtd, preco)
-                    venda.itens.append(item)
-
-        # Carrega as devoluções (cabeçalho)
-        devolucoes_data = self.db.execute_query("SELECT id, venda_original_id, cliente_nome, status, data, observacoes FROM devolucoes", fetch='all')
-        if devolucoes_data:
-            for row in devolucoes_data:
-                dev_id, venda_id, cliente, status, data_str, obs = row
-                if venda_original := self.vendas.get(venda_id):
-                    self.devolucoes[dev_id] = Devolucao(
-                        id=dev_id, venda_original=venda_original, cliente_nome=cliente, itens=[],
-                        status=status, data=datetime.fromisoformat(data_str), observacoes=obs
-                    )
-
-        # Carrega os itens de cada devolução
-        itens_dev_data = self.db.execute_query("SELECT devolucao_id, produto_id, quantidade, motivo_devolucao, condicao_produto FROM itens_devolucao", fetch='all')
-        if itens_dev_data:
-            for dev_id, p_id, qtd, motivo, condicao in itens_dev_data:
-                if (devolucao := self.devolucoes.get(dev_id)) and (produto := self.produtos.get(p_id)):
-                    devolucao.itens.append(ItemDevolucao(produto, qtd, motivo, condicao))
-
-        # Carrega as transações de cada devolução
-        transacoes_data = self.db.execute_query("SELECT id, devolucao_id, tipo, valor, data FROM transacoes", fetch='all')
-        if transacoes_data:
-            for t_id, dev_id, tipo, valor, data_str in transacoes_data:
-                if devolucao := self.devolucoes.get(dev_id):
-                    devolucao.transacao = Transacao(t_id, dev_id, tipo, valor, datetime.fromisoformat(data_str))
-
-        print("Dados carregados com sucesso.")
+            # Recalcula o preço de compra dos kits com base nos componentes carregados (os de dentro primeiro)
+            for kit in self.ordem_topologica_kits():
+                kit.recalcular_preco_compra()
+
+
+        if not self._catalogo_sob_demanda:
+            # carrega o histórico de movimentações
+            query_hist = "SELECT produto_id, localizacao_id, tipo, quantidade, data FROM historico_movimentos"
+            hist_data = self.db.execute_query(query_hist, fetch='all')
+            if hist_data:
+                for p_id, l_id, tipo, qtd, data_str in hist_data:
+                    if (produto := self.produtos.get(p_id)) and (localizacao := self.localizacoes.get(l_id)):
+                        self.historico.append(HistoricoMovimento(produto, tipo, qtd, localizacao, datetime.fromisoformat(data_str)))
+
+            # carrega os documentos: Ordens de Compra, transferências, ordens de montagem, vendas e devoluções
+            # (as devoluções depois das vendas, que elas apontam pra venda original)
+            self.ordens_compra.update(self._ler_ordens_compra())
+            self.transferencias.update(self._ler_transferencias())
+            self.ordens_montagem.update(self._ler_ordens_montagem())
+            self.vendas.update(self._ler_vendas())
+            self.devolucoes.update(self._ler_devolucoes())
+
+        # situação do último checkpoint do estoque
+        ultimo_checkpoint = self.db.execute_query("SELECT data, ultimo_movimento_id FROM checkpoints_estoque ORDER BY id DESC LIMIT 1", fetch='one')
+        ultimo_movimento_id = 0
+        self._data_ultimo_checkpoint = None
+        if ultimo_checkpoint:
+            self._data_ultimo_checkpoint = datetime.fromisoformat(ultimo_checkpoint[0])
+            ultimo_movimento_id = ultimo_checkpoint[1]
+        row = self.db.execute_query("SELECT COUNT(*) FROM historico_movimentos WHERE id > ?", (ultimo_movimento_id,), fetch='one')
+        self._movimentos_desde_checkpoint = row[0] if row else 0
+
+        if self._usar_escrita_adiada and not self._fila_escrita:
+            self._iniciar_escrita_adiada()
+        if verboso:
+            print("Dados carregados com sucesso.")
+
+    def _recarregar_estoque_em_memoria(self):
+        """Relê a tabela 'estoque' inteira e substitui o estoque por local de todos os produtos em memória."""
+        self._invalidar_kits()
+        produtos = {p.id: p for p in self._produtos_em_memoria()}
+        query_estoque = "SELECT p.id, l.nome, e.quantidade FROM estoque e JOIN produtos p ON e.produto_id = p.id JOIN localizacoes l ON e.localizacao_id = l.id"
+        linhas = self.db.execute_query(query_estoque, fetch='all') or []
+        with self._trava_estoque_memoria:
+            for produto in produtos.values():
+                produto.estoque_por_local.clear()
+            for prod_id, local_nome, qtd in linhas:
+                if produto := produtos.get(prod_id):
+                    produto.estoque_por_local[local_nome] = qtd
+
+    #region Catálogo sob demanda (produtos carregados quando pedidos)
+    @property
+    def _catalogo_sob_demanda(self) -> bool:
+        return isinstance(self.produtos, CatalogoProdutos)
+
+    def _produtos_em_memoria(self) -> list[Produto]:
+        """os produtos que estão em memória agora (no catálogo sob demanda, só os já carregados)"""
+        return self.produtos.residentes() if self._catalogo_sob_demanda else list(self.produtos.values())
+
+    def _todos_os_kits(self) -> list[Produto]:
+        """Todos os kits cadastrados (no catálogo sob demanda, a lista vem do banco e os kits são carregados)."""
+        if not self._catalogo_sob_demanda:
+            return [p for p in list(self.produtos.values()) if p.tipoProduto == 'kit']
+        ids = self.db.execute_query("SELECT id FROM produtos WHERE tipo_produto = 'kit' ORDER BY id", fetch='all') or []
+        return [kit for (kit_id,) in ids if (kit := self.produtos.get(kit_id))]
+
+    def _composicao_kits(self) -> dict[int, list[int]]:
+        """kit_id -> ids dos componentes diretos (no catálogo sob demanda vem do banco, sem carregar kit nenhum)"""
+        if not self._catalogo_sob_demanda:
+            return {kit.id: [c.produto.id for c in kit.componentes] for kit in self._todos_os_kits()}
+        ids = self.db.execute_query("SELECT id FROM produtos WHERE tipo_produto = 'kit' ORDER BY id", fetch='all') or []
+        composicao = {kit_id: [] for (kit_id,) in ids}
+        for kit_id, comp_id in self.db.execute_query("SELECT kit_produto_id, componente_produto_id FROM componentes_kit", fetch='all') or []:
+            if kit_id in composicao:
+                composicao[kit_id].append(comp_id)
+        return composicao
+
+    def _carregar_produto(self, produto_id: int) -> Produto | None:
+        """Lê um produto do banco com o estoque por local e, se for kit, os componentes (usado pelo catálogo sob demanda)."""
+        row = self.db.execute_query("SELECT * FROM produtos WHERE id = ?", (produto_id,), fetch='one')
+        if not row or not (fornecedor := self.fornecedores.get(row[8])):
+            return None
+        prod_id, nome, desc, cat, cod, p_compra, p_venda, p_ress, _, tipo_prod = row
+        produto = Produto(id=prod_id, nome=nome, descricao=desc, categoria=cat, fornecedor=fornecedor, codigo_barras=cod,
+                          preco_compra=p_compra, preco_venda=p_venda, ponto_ressuprimento=p_ress, tipoProduto=tipo_prod)
+        query_estoque = "SELECT l.nome, e.quantidade FROM estoque e JOIN localizacoes l ON e.localizacao_id = l.id WHERE e.produto_id = ?"
+        for local_nome, qtd in self.db.execute_query(query_estoque, (prod_id,), fetch='all') or []:
+            produto.estoque_por_local[local_nome] = qtd
+        if tipo_prod == 'kit':
+            componentes = self.db.execute_query("SELECT componente_produto_id, quantidade FROM componentes_kit WHERE kit_produto_id = ?",
+                                                (prod_id,), fetch='all') or []
+            # os componentes vêm pelo próprio catálogo (o kit segura a referência, então eles ficam vivos junto)
+            for comp_id, qtd in componentes:
+                if componente := self.produtos.get(comp_id):
+                    produto.componentes.append(ComponenteKit(produto=componente, quantidade=qtd))
+            produto.recalcular_preco_compra()
+        return produto
 
-    def registrar_venda(self, itens_info: list[dict], nome_cliente: str, localizacao_id: int) -> tuple[Venda, list[Produto]]:
-        """Registra uma nova venda, atualiza o estoque e retorna a venda e produtos que atingiram o ponto de ressuprimento."""
+    def _produto_do_documento(self, produto_id: int) -> Produto | ReferenciaProduto | None:
+        """
+        O que um documento (venda, OC, transferência, devolução, montagem, histórico) guarda do produto: o próprio
+        objeto ou, no catálogo sob demanda, só a referência pelo id (o produto nem é lido do banco agora).
+        """
+        if self._catalogo_sob_demanda:
+            existe = self.db.execute_query("SELECT 1 FROM produtos WHERE id = ?", (produto_id,), fetch='one')
+            return ReferenciaProduto(produto_id, self.produtos) if existe else None
+        return self.produtos.get(produto_id)
+
+    def _consultas_da_tabela(self, tabela: str):
+        """listar_ids() e contar() de um catálogo sob demanda, direto da tabela"""
+        return (lambda: [row[0] for row in self.db.execute_query(f"SELECT id FROM {tabela} ORDER BY id", fetch='all') or []],
+                lambda: self.db.execute_query(f"SELECT COUNT(*) FROM {tabela}", fetch='one')[0])
+
+    def _id_por_codigo_barras(self, codigo: str) -> int | None:
+        """No catálogo sob demanda o índice de códigos de barras é o do banco (o primeiro cadastrado fica valendo)."""
+        if not codigo or codigo == "N/A":
+            return None
+        row = self.db.execute_query("SELECT id FROM produtos WHERE codigo_barras = ? ORDER BY id LIMIT 1", (codigo,), fetch='one')
+        return row[0] if row else None
+
+    def estatisticas_catalogo(self) -> dict | None:
+        """Acertos/faltas do cache de produtos e quantos estão em memória (None se o catálogo estiver todo carregado)."""
+        if not self._catalogo_sob_demanda:
+            return None
+        return {'maximo': self.produtos.maximo, 'em_memoria': len(self.produtos.residentes()),
+                'acertos': self.produtos.acertos, 'faltas': self.produtos.faltas}
+    #endregion
+
+    #region Leitura dos documentos do banco
+    # Cada _ler_* lê os documentos de uma tabela com os itens: todos (carga completa) ou só os do filtro
+    # ("WHERE id = ?", usado pelo catálogo sob demanda pra ler um documento quando ele é pedido).
+    def _ler_ordens_compra(self, filtro: str = "", params: tuple = ()) -> dict[int, OrdemCompra]:
+        ordens = {}
+        for oc_id, forn_id, status, data_str in self.db.execute_query(
+                f"SELECT id, fornecedor_id, status, data_criacao FROM ordens_compra {filtro}", params, fetch='all') or []:
+            if fornecedor := self.fornecedores.get(forn_id):
+                ordens[oc_id] = OrdemCompra(oc_id, fornecedor, [], status, datetime.fromisoformat(data_str))
+        dos_documentos = f"WHERE ordem_id IN (SELECT id FROM ordens_compra {filtro})" if filtro else ""
+        for item_id, oc_id, p_id, qtd, preco, qtd_recebida in self.db.execute_query(
+                f"""SELECT id, ordem_id, produto_id, quantidade, preco_unitario, quantidade_recebida
+                    FROM itens_ordem_compra {dos_documentos} ORDER BY id""", params, fetch='all') or []:
+            if (oc := ordens.get(oc_id)) and (produto := self._produto_do_documento(p_id)):
+                oc.itens.append(ItemOrdemCompra(produto, qtd, preco, qtd_recebida, item_id))
+        return ordens
+
+    def _ler_transferencias(self, filtro: str = "", params: tuple = ()) -> dict[int, DocumentoTransferencia]:
+        transferencias = {}
+        for t_id, origem_id, destino_id, status, data_str, recebimento_str in self.db.execute_query(
+                f"SELECT id, origem_id, destino_id, status, data_criacao, data_recebimento FROM transferencias {filtro}", params, fetch='all') or []:
+            if (origem := self.localizacoes.get(origem_id)) and (destino := self.localizacoes.get(destino_id)):
+                transferencias[t_id] = DocumentoTransferencia(
+                    t_id, origem, destino, [], status, datetime.fromisoformat(data_str),
+                    datetime.fromisoformat(recebimento_str) if recebimento_str else None)
+        dos_documentos = f"WHERE transferencia_id IN (SELECT id FROM transferencias {filtro})" if filtro else ""
+        for t_id, p_id, qtd in self.db.execute_query(
+                f"SELECT transferencia_id, produto_id, quantidade FROM itens_transferencia {dos_documentos}", params, fetch='all') or []:
+            if (documento := transferencias.get(t_id)) and (produto := self._produto_do_documento(p_id)):
+                documento.itens.append(ItemTransferencia(produto, qtd))
+        return transferencias
+
+    def _ler_ordens_montagem(self, filtro: str = "", params: tuple = ()) -> dict[int, OrdemMontagem]:
+        ordens = {}
+        for o_id, kit_id, l_id, tipo, qtd, data_str in self.db.execute_query(
+                f"SELECT id, kit_id, localizacao_id, tipo, quantidade, data FROM ordens_montagem {filtro}", params, fetch='all') or []:
+            if (kit := self._produto_do_documento(kit_id)) and (localizacao := self.localizacoes.get(l_id)):
+                ordens[o_id] = OrdemMontagem(o_id, kit, localizacao, tipo, qtd, datetime.fromisoformat(data_str))
+        return ordens
+
+    def _ler_vendas(self, filtro: str = "", params: tuple = ()) -> dict[int, Venda]:
+        vendas = {}
+        for venda_id, cliente, data_str in self.db.execute_query(f"SELECT id, cliente_nome, data FROM vendas {filtro}", params, fetch='all') or []:
+            vendas[venda_id] = Venda(venda_id, cliente, [], datetime.fromisoformat(data_str))
+        dos_documentos = f"WHERE venda_id IN (SELECT id FROM vendas {filtro})" if filtro else ""
+        for v_id, p_id, qtd, preco in self.db.execute_query(
+                f"SELECT venda_id, produto_id, quantidade, preco_venda_unitario FROM itens_venda {dos_documentos}", params, fetch='all') or []:
+            if (venda := vendas.get(v_id)) and (produto := self._produto_do_documento(p_id)):
+                venda.itens.append(ItemVenda(produto, qtd, preco))
+        return vendas
+
+    def _ler_devolucoes(self, filtro: str = "", params: tuple = ()) -> dict[int, Devolucao]:
+        # a venda original vem de self.vendas: na carga completa, as vendas têm que ser lidas antes
+        devolucoes = {}
+        for dev_id, venda_id, cliente, status, data_str, obs in self.db.execute_query(
+                f"SELECT id, venda_original_id, cliente_nome, status, data, observacoes FROM devolucoes {filtro}", params, fetch='all') or []:
+            if venda_original := self.vendas.get(venda_id):
+                devolucoes[dev_id] = Devolucao(
+                    id=dev_id, venda_original=venda_original, cliente_nome=cliente, itens=[],
+                    status=status, data=datetime.fromisoformat(data_str), observacoes=obs
+                )
+        dos_documentos = f"WHERE devolucao_id IN (SELECT id FROM devolucoes {filtro})" if filtro else ""
+        for dev_id, p_id, qtd, motivo, condicao in self.db.execute_query(
+                f"SELECT devolucao_id, produto_id, quantidade, motivo_devolucao, condicao_produto FROM itens_devolucao {dos_documentos}",
+                params, fetch='all') or []:
+            if (devolucao := devolucoes.get(dev_id)) and (produto := self._produto_do_documento(p_id)):
+                devolucao.itens.append(ItemDevolucao(produto, qtd, motivo, condicao))
+        for t_id, dev_id, tipo, valor, data_str in self.db.execute_query(
+                f"SELECT id, devolucao_id, tipo, valor, data FROM transacoes {dos_documentos}", params, fetch='all') or []:
+            if devolucao := devolucoes.get(dev_id):
+                devolucao.transacao = Transacao(t_id, dev_id, tipo, valor, datetime.fromisoformat(data_str))
+        return devolucoes
+    #endregion
+
+    def registrar_venda(self, itens_info: list[dict], nome_cliente: str, localizacao_id: int,
+                        data: datetime | None = None, reservas: list[str] | None = None) -> tuple[Venda, list[Produto]]:
+        """
+        Registra uma nova venda, atualiza o estoque e retorna a venda e produtos que atingiram o ponto de ressuprimento.
+        Tudo (venda, itens e baixas de estoque) vai numa transação só; 'data' permite registrar vendas de outro
+        momento (ex: importadas do PDV). O estoque reservado por outros não pode ser vendido; as 'reservas'
+        informadas (tokens do reservar) são da própria venda e são consumidas por ela.
+        """
         if not itens_info:
             raise ValueError("A venda deve ter pelo menos um item.")
         if not nome_cliente:
@@ -169,62 +435,114 @@ class GerenciadorEstoque:
         if not (localizacao := self.localizacoes.get(localizacao_id)):
             raise ValueError("Localização de saída do estoque inválida.")
 
-        # Validação de estoque antes de qualquer alteração no banco
-        for item_info in itens_info:
-            produto = self.produtos[item_info['produto_id']]
-            quantidade_vendida = item_info['quantidade']
-            
-            if produto.tipoProduto == 'kit':
-                estoque_montavel = produto.get_estoque_total()
-                if estoque_montavel < quantidade_vendida:
-                    raise ValueError(f"Estoque de componentes insuficiente para montar {quantidade_vendida} unidade(s) do kit '{produto.nome}'. Apenas {estoque_montavel} possível(is).")
-            else: # Produto individual
-                estoque_local = produto.estoque_por_local.get(localizacao.nome, 0)
-                if estoque_local < quantidade_vendida:
-                    raise ValueError(f"Estoque insuficiente para '{produto.nome}' na localização '{localizacao.nome}'.")
+        # as células de estoque que a venda vai debitar ficam travadas da validação até a gravação,
+        # assim o "confere e debita" é atômico mesmo com vários caixas vendendo o mesmo produto
+        with self._travar_estoque(self._celulas_da_venda(itens_info, localizacao_id)):
+            return self._registrar_venda_travada(itens_info, nome_cliente, localizacao, data, reservas or [])
 
-        agora = datetime.now()
-        query_venda = "INSERT INTO vendas (cliente_nome, data) VALUES (?, ?)"
-        nova_venda_id = self.db.execute_query(query_venda, (nome_cliente, agora.isoformat()))
+    def novo_carrinho(self, localizacao_id: int) -> Carrinho:
+        """Começa um carrinho vazio numa localização (ver Carrinho); finalize com registrar_venda_carrinho."""
+        if not (localizacao := self.localizacoes.get(localizacao_id)):
+            raise ValueError("Localização de saída do estoque inválida.")
+        return Carrinho(localizacao, reservas_de_todos=self._reservado_por_celula)
 
-        produtos_para_alertar = []
-        itens_venda_obj = []
-        
+    def adicionar_ao_carrinho(self, carrinho: Carrinho, produto_id: int, quantidade: int,
+                              ttl: float = RESERVA_TTL_SEGUNDOS):
+        """Coloca o item no carrinho e reserva o estoque dele, pra outro caixa não vender a mesma unidade."""
+        if not (produto := self.produtos.get(produto_id)):
+            raise ValueError(f"Produto com ID {produto_id} não encontrado.")
+        carrinho.adicionar(produto, quantidade)
+        try:
+            token = self.reservar(produto_id, carrinho.localizacao.id, quantidade, ttl)
+        except ValueError:
+            carrinho.remover(produto_id, quantidade)
+            raise
+        carrinho.reservas.append(token)
+        if reserva := self._reservas.get(token):
+            for p_id, qtd in reserva.debitos:
+                carrinho.reservado_proprio[p_id] += qtd
+
+    def cancelar_carrinho(self, carrinho: Carrinho):
+        """Desiste do carrinho, liberando as reservas dele."""
+        for token in carrinho.reservas:
+            self.liberar_reserva(token)
+        carrinho.reservas.clear()
+        carrinho.reservado_proprio.clear()
+
+    def registrar_venda_carrinho(self, carrinho: Carrinho, nome_cliente: str,
+                                 data: datetime | None = None) -> tuple[Venda, list[Produto]]:
+        """
+        Registra o carrinho como venda. O carrinho é conferido antes contra o estoque atual (pode ter mudado desde
+        que os itens entraram) e o estoque é conferido de novo, já com as células travadas, na gravação.
+        """
+        if not carrinho.itens:
+            raise ValueError("A venda deve ter pelo menos um item.")
+        carrinho.validar()
+        resultado = self.registrar_venda(carrinho.itens_venda(), nome_cliente, carrinho.localizacao.id, data, carrinho.reservas)
+        carrinho.reservas.clear()
+        carrinho.reservado_proprio.clear()
+        return resultado
+
+    def _debitos_da_venda(self, itens_info: list[dict]) -> list[tuple[int, int]]:
+        """
+        (produto_id, quantidade) que uma venda pode debitar, no máximo: o próprio produto, ou o kit pronto e os
+        individuais dele (em qualquer nível). Quanto sai de cada um só é decidido na validação (ver Carrinho).
+        """
+        debitos = []
+        for item_info in itens_info:
+            if not (produto := self.produtos.get(item_info['produto_id'])):
+                continue
+            if produto.tipoProduto == 'kit':
+                debitos.append((produto.id, item_info['quantidade']))
+            debitos.extend((folha.id, qtd * item_info['quantidade']) for folha, qtd in produto.componentes_folha())
+        return debitos
+
+    def _celulas_da_venda(self, itens_info: list[dict], localizacao_id: int) -> list[tuple[int, int]]:
+        """As células (produto_id, localizacao_id) de estoque que uma venda debita."""
+        return [(p_id, localizacao_id) for p_id, _ in self._debitos_da_venda(itens_info)]
+
+    def _registrar_venda_travada(self, itens_info: list[dict], nome_cliente: str, localizacao: Localizacao,
+                                 data: datetime | None, reservas: list[str]) -> tuple[Venda, list[Produto]]:
+        localizacao_id = localizacao.id
+        # Validação de estoque antes de qualquer alteração no banco: as linhas entram num carrinho, que confere
+        # cada uma contra o que as anteriores já comprometeram (mesmo produto repetido, kits que dividem componentes)
+        # e contra o que está reservado pra outros
+        proprias = self._reservas_validas(reservas, localizacao_id)
+        carrinho = Carrinho(localizacao, reservas_de_todos=self._reservado_por_celula,
+                            reservado_proprio=self._unidades_reservadas(proprias))
         for item_info in itens_info:
-            produto_id = item_info['produto_id']
-            quantidade = item_info['quantidade']
-            produto_vendido = self.produtos[produto_id]
-            preco_unitario_venda = produto_vendido.preco_venda
+            carrinho.adicionar(self.produtos[item_info['produto_id']], item_info['quantidade'])
 
-            query_item = "INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_venda_unitario) VALUES (?, ?, ?, ?)"
-            self.db.execute_query(query_item, (nova_venda_id, produto_id, quantidade, preco_unitario_venda))
-            
-            # Se for um kit, debita o estoque dos componentes. Se for individual, debita do produto.
-            if produto_vendido.tipoProduto == 'kit':
-                for comp in produto_vendido.componentes:
-                    qtd_a_debitar = comp.quantidade * quantidade
-                    _, produto_alertado = self.movimentar_estoque(
-                        produto_id=comp.produto.id,
-                        localizacao_id=localizacao_id,
-                        quantidade=-qtd_a_debitar,
-                        tipo_movimento=f"Componente Venda Kit #{nova_venda_id}"
-                    )
-                    if produto_alertado and produto_alertado not in produtos_para_alertar:
-                        produtos_para_alertar.append(produto_alertado)
-            else: # Produto Individual
-                _, produto_alertado = self.movimentar_estoque(
-                    produto_id=produto_id,
-                    localizacao_id=localizacao_id,
-                    quantidade=-quantidade,
-                    tipo_movimento=f"Venda #{nova_venda_id}"
-                )
-                if produto_alertado and produto_alertado not in produtos_para_alertar:
-                    produtos_para_alertar.append(produto_alertado)
+        agora = data or datetime.now()
+        itens_venda_obj = list(carrinho.itens.values())
+        try:
+            with self.db.transacao():
+                query_venda = "INSERT INTO vendas (cliente_nome, data) VALUES (?, ?)"
+                nova_venda_id = self.db.execute_query(query_venda, (nome_cliente, agora.isoformat()))
+                self.db.execute_many("INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_venda_unitario) VALUES (?, ?, ?, ?)",
+                                     [(nova_venda_id, i.produto.id, i.quantidade, i.preco_venda_unitario) for i in itens_venda_obj])
+                self._registrar_eventos([('venda', nova_venda_id, {
+                    'cliente': nome_cliente, 'localizacao_id': localizacao_id,
+                    'itens': [{'produto_id': i.produto.id, 'quantidade': i.quantidade, 'preco_venda_unitario': i.preco_venda_unitario}
+                              for i in itens_venda_obj]})], agora)
+
+                # Se for individual, debita do produto. Se for um kit, debita os kits já montados e, do que faltar,
+                # os individuais dele (descendo pelos kits de dentro), tudo num lote só.
+                movimentos = []
+                for item in itens_venda_obj:
+                    for produto, qtd in carrinho.debitos_do_item(item.produto.id):
+                        tipo = f"Venda #{nova_venda_id}" if produto is item.produto else f"Componente Venda Kit #{nova_venda_id}"
+                        movimentos.append((produto.id, localizacao_id, -qtd, tipo))
+                produtos_para_alertar = self._postar_movimentos(movimentos, agora)
+        except sqlite3.IntegrityError:
+            # o banco é a última barreira (o trigger do ledger / CHECK do estoque); nesse caso nada foi gravado
+            raise ValueError(f"Estoque insuficiente na localização '{localizacao.nome}' para atender todos os itens da venda.")
 
-            item_obj = ItemVenda(produto_vendido, quantidade, preco_unitario_venda)
-            itens_venda_obj.append(item_obj)
+        # o estoque que as reservas seguravam acabou de sair na venda
+        self._soltar_reservas(proprias)
 
         # Atualiza o objeto de venda em memória
+        itens_venda_obj = [ItemVenda(self._produto_do_documento(i.produto.id), i.quantidade, i.preco_venda_unitario) for i in itens_venda_obj]
         nova_venda = Venda(nova_venda_id, nome_cliente, itens_venda_obj, agora)
         self.vendas[nova_venda_id] = nova_venda
         return nova_venda, produtos_para_alertar
@@ -259,13 +577,18 @@ class GerenciadorEstoque:
     def remover_fornecedor(self, fornecedor_id: int) -> bool:
         """Remove um fornecedor e todos os produtos associados a ele."""
         if fornecedor_id in self.fornecedores:
+            # no catálogo sob demanda nem todos os produtos do fornecedor estão em memória: os ids vêm do banco
+            ids_removidos = [row[0] for row in self.db.execute_query(
+                "SELECT id FROM produtos WHERE fornecedor_id = ?", (fornecedor_id,), fetch='all') or []]
             # A remoção em cascata (ON DELETE CASCADE) na tabela 'produtos' cuidará dos produtos no DB.
             self.db.execute_query("DELETE FROM fornecedores WHERE id=?", (fornecedor_id,))
             del self.fornecedores[fornecedor_id]
             # Remove os produtos associados da memória.
-            produtos_a_remover = [pid for pid, p in self.produtos.items() if p.fornecedor.id == fornecedor_id]
+            produtos_a_remover = [p.id for p in self._produtos_em_memoria() if p.fornecedor.id == fornecedor_id]
             for pid in produtos_a_remover:
-                del self.produtos[pid]
+                self._desindexar_codigo_barras(self.produtos.pop(pid))
+            self._desindexar_busca(ids_removidos)
+            self._invalidar_kits()
             return True
         return False
 
@@ -297,9 +620,10 @@ class GerenciadorEstoque:
 
         # Se o nome mudou, atualiza a chave nos dicionários de estoque em memória.
         if nome_antigo != novo_nome:
-            for produto in self.produtos.values():
-                if nome_antigo in produto.estoque_por_local:
-                    produto.estoque_por_local[novo_nome] = produto.estoque_por_local.pop(nome_antigo)
+            with self._trava_estoque_memoria:
+                for produto in self._produtos_em_memoria():
+                    if nome_antigo in produto.estoque_por_local:
+                        produto.estoque_por_local[novo_nome] = produto.estoque_por_local.pop(nome_antigo)
         return True
 
     def remover_localizacao(self, localizacao_id: int) -> bool:
@@ -309,18 +633,40 @@ class GerenciadorEstoque:
             query = "SELECT 1 FROM estoque WHERE localizacao_id = ? AND quantidade > 0 LIMIT 1"
             if self.db.execute_query(query, (localizacao_id,), fetch='one'):
                 raise ValueError("Não é possível remover a localização pois ainda existe estoque nela.")
+            if self.db.execute_query("SELECT 1 FROM transferencias WHERE status = 'Em Trânsito' AND ? IN (origem_id, destino_id) LIMIT 1",
+                                     (localizacao_id,), fetch='one'):
+                raise ValueError("Não é possível remover a localização pois há transferências em trânsito envolvendo ela.")
 
             self.db.execute_query("DELETE FROM localizacoes WHERE id=?", (localizacao_id,))
             del self.localizacoes[localizacao_id]
+            self._invalidar_kits()
             return True
         return False
 
     def buscar_produto_por_codigo_barras(self, codigo_barras: str) -> Produto | None:
         """Busca um produto em memória pelo seu código de barras."""
-        for produto in self.produtos.values():
-            if produto.codigo_barras and produto.codigo_barras.strip() == codigo_barras.strip():
-                return produto
-        return None
+        if self._catalogo_sob_demanda:
+            produto_id = self._id_por_codigo_barras(codigo_barras.strip())
+        else:
+            produto_id = self._indice_codigo_barras.get(codigo_barras.strip())
+        return self.produtos.get(produto_id) if produto_id is not None else None
+
+    def _indexar_codigo_barras(self, produto: Produto):
+        """Coloca o produto no índice de códigos de barras (o primeiro cadastrado com o código fica valendo)."""
+        codigo = (produto.codigo_barras or "").strip()
+        if codigo and codigo != "N/A" and not self._catalogo_sob_demanda:
+            self._indice_codigo_barras.setdefault(codigo, produto.id)
+
+    def _desindexar_codigo_barras(self, produto: Produto):
+        """Tira o produto do índice de códigos de barras, passando o código para outro produto que o use, se houver."""
+        codigo = (produto.codigo_barras or "").strip()
+        if self._indice_codigo_barras.get(codigo) != produto.id:
+            return
+        del self._indice_codigo_barras[codigo]
+        for outro in self.produtos.values():
+            if outro.id != produto.id and (outro.codigo_barras or "").strip() == codigo:
+                self._indexar_codigo_barras(outro)
+                break
 
     def adicionar_produto(self, fornecedor_id, **kwargs):
         """Adiciona um novo produto."""
@@ -344,6 +690,8 @@ class GerenciadorEstoque:
         
         novo_produto = Produto(id=novo_id, fornecedor=fornecedor, **kwargs)
         self.produtos[novo_id] = novo_produto
+        self._indexar_codigo_barras(novo_produto)
+        self._indexar_busca(novo_produto)
         return novo_produto
 
 
@@ -359,46 +707,126 @@ class GerenciadorEstoque:
 
         fornecedor_id = int(kwargs.get('fornecedor_id'))
         if not (fornecedor_obj := self.fornecedores.get(fornecedor_id)): return False
+        if produto.tipoProduto == 'kit':
+            # preço de compra de kit é derivado dos componentes, não do que veio no formulário
+            kwargs['preco_compra'] = sum(c.produto.preco_compra * c.quantidade for c in produto.componentes)
 
         params = (
             kwargs['nome'], kwargs['descricao'], kwargs['categoria'], kwargs['codigo_barras'],
             kwargs['preco_compra'], kwargs['preco_venda'], kwargs['ponto_ressuprimento'],
             fornecedor_id, produto_id
         )
-        self.db.execute_query(query, params)
-
-        # Atualiza o objeto em memória
+        with self.db.transacao():
+            self.db.execute_query(query, params)
+            if (kwargs['preco_compra'], kwargs['preco_venda']) != (produto.preco_compra, produto.preco_venda):
+                self._registrar_eventos([('preco_produto', produto_id, {
+                    'preco_compra': kwargs['preco_compra'], 'preco_venda': kwargs['preco_venda'],
+                    'preco_compra_anterior': produto.preco_compra, 'preco_venda_anterior': produto.preco_venda})])
+
+            # recalcula os kits que usam o produto (o preço novo ainda não está no objeto, então vai como já gravado)
+            precos_kits = self._propagar_preco_compra_kits([produto_id], {produto_id: kwargs['preco_compra']})
+
+        # Atualiza o objeto em memória só depois do commit: se algo acima falhar, a memória fica igual ao banco
+        self._desindexar_codigo_barras(produto)
         kwargs['fornecedor'] = fornecedor_obj
         del kwargs['fornecedor_id']
         for key, value in kwargs.items():
             if hasattr(produto, key):
                 setattr(produto, key, value)
-        
-        # Se for um kit, o preço de compra deve ser recalculado
-        if produto.tipoProduto == 'kit':
-            produto.recalcular_preco_compra()
-            
+        self._aplicar_precos_kits(precos_kits)
+        self._indexar_codigo_barras(produto)
+        self._indexar_busca(produto)
         return True
 
+    CAMPOS_EM_LOTE = ('preco_compra', 'preco_venda', 'ponto_ressuprimento')
+    MODOS_EM_LOTE = ('definir', 'percentual', 'delta')
+
+    def atualizar_em_lote(self, campo: str, modo: str, valor: float, fornecedor_id: int | None = None,
+                          categoria: str | None = None, produto_ids: list[int] | None = None) -> list[int]:
+        """
+        Atualiza preço de compra, preço de venda ou ponto de ressuprimento de vários produtos com um UPDATE só.
+        Seleção por fornecedor, categoria e/ou lista de ids: com mais de um filtro, o produto tem que atender a todos.
+        modo: 'definir' (valor novo), 'percentual' (ex: 10 = +10%, -5 = -5%) ou 'delta' (soma o valor);
+        o resultado nunca fica negativo. Preço de compra e ponto de ressuprimento de kit são derivados, então
+        só mudam nos individuais, e os kits que consomem os produtos alterados são recalculados na mesma transação.
+        Retorna os ids dos produtos que mudaram.
+        """
+        if campo not in self.CAMPOS_EM_LOTE:
+            raise ValueError(f"Campo inválido '{campo}'. Use: {', '.join(self.CAMPOS_EM_LOTE)}.")
+        if modo not in self.MODOS_EM_LOTE:
+            raise ValueError(f"Modo inválido '{modo}'. Use: {', '.join(self.MODOS_EM_LOTE)}.")
+        if modo == 'definir' and valor < 0:
+            raise ValueError("O valor não pode ser negativo.")
+        if fornecedor_id is None and not categoria and not produto_ids:
+            raise ValueError("Informe o fornecedor, a categoria ou os IDs dos produtos a atualizar.")
+        if fornecedor_id is not None and fornecedor_id not in self.fornecedores:
+            raise ValueError(f"Fornecedor com ID {fornecedor_id} não encontrado.")
+
+        expressao = {'definir': '?', 'percentual': f"{campo} * (1 + ? / 100.0)", 'delta': f"{campo} + ?"}[modo]
+        if campo == 'ponto_ressuprimento':
+            expressao = f"CAST(ROUND(MAX(0, {expressao})) AS INTEGER)"
+        else:
+            expressao = f"ROUND(MAX(0, {expressao}), 2)"
+        condicoes, params = [], [valor]
+        if fornecedor_id is not None:
+            condicoes.append("fornecedor_id = ?")
+            params.append(fornecedor_id)
+        if categoria:
+            condicoes.append("categoria = ?")
+            params.append(categoria)
+        if produto_ids:
+            condicoes.append(f"id IN ({','.join('?' * len(produto_ids))})")
+            params.extend(produto_ids)
+        if campo != 'preco_venda':
+            condicoes.append("tipo_produto = 'individual'")
+
+        with self.db.transacao():
+            # o RETURNING devolve o valor já calculado pelo banco: a memória fica igual ao que foi gravado
+            linhas = self.db.execute_query(
+                f"UPDATE produtos SET {campo} = {expressao} WHERE {' AND '.join(condicoes)} RETURNING id, {campo}",
+                params, fetch='all')
+            mudancas, eventos = [], []
+            for produto_id, novo in linhas:
+                # preço vem do banco como int quando o valor é redondo (5500 em vez de 5500.0)
+                novo = int(novo) if campo == 'ponto_ressuprimento' else float(novo)
+                produto = self.produtos[produto_id]
+                anterior = getattr(produto, campo)
+                if novo == anterior:
+                    continue
+                mudancas.append((produto, novo))
+                if campo != 'ponto_ressuprimento':
+                    precos = {'preco_compra': produto.preco_compra, 'preco_venda': produto.preco_venda,
+                              'preco_compra_anterior': produto.preco_compra, 'preco_venda_anterior': produto.preco_venda}
+                    precos[campo] = novo
+                    precos[f'{campo}_anterior'] = anterior
+                    eventos.append(('preco_produto', produto_id, precos))
+            if eventos:
+                self._registrar_eventos(eventos)
+            precos_kits = []
+            if campo == 'preco_compra' and mudancas:
+                precos_kits = self._propagar_preco_compra_kits(
+                    [p.id for p, _ in mudancas], {p.id: novo for p, novo in mudancas})
+
+        # memória e índices só mudam depois do commit (igual ao _postar_movimentos com o estoque)
+        for produto, novo in mudancas:
+            setattr(produto, campo, novo)
+        self._aplicar_precos_kits(precos_kits)
+        return [p.id for p, _ in mudancas]
+
     def remover_produto(self, produto_id):
         """Remove um produto."""
         if produto_id in self.produtos:
             # A remoção em cascata cuidará das tabelas 'estoque', 'historico', etc.
             self.db.execute_query("DELETE FROM produtos WHERE id=?", (produto_id,))
-            del self.produtos[produto_id]
+            self._desindexar_codigo_barras(self.produtos.pop(produto_id))
+            self._desindexar_busca([produto_id])
+            self._invalidar_kits()
             return True
         return False
     
     def verificar_se_produto_e_componente(self, produto_id: int) -> list[str]:
         """Verifica se um produto é componente de algum kit e retorna os nomes dos kits."""
-        kits_afetados = []
-        for kit in self.produtos.values():
-            if kit.tipoProduto == 'kit':
-                for componente in kit.componentes:
-                    if componente.produto.id == produto_id:
-                        kits_afetados.append(kit.nome)
-                        break
-        return kits_afetados
+        return [self.produtos[kit_id].nome for kit_id, componentes in self._composicao_kits().items() if produto_id in componentes]
 
 
     def movimentar_estoque(self, produto_id, localizacao_id, quantidade, tipo_movimento):
@@ -411,51 +839,200 @@ class GerenciadorEstoque:
         if produto.tipoProduto == 'kit':
             raise ValueError("Não é possível movimentar o estoque de um kit diretamente. A movimentação ocorre através dos seus componentes.")
 
-        estoque_anterior = produto.get_estoque_total()
-        estoque_local_anterior = produto.estoque_por_local.get(localizacao.nome, 0)
+        if self._fila_escrita:
+            return self._movimentar_estoque_adiado(produto, localizacao, quantidade, tipo_movimento)
 
-        # Valida se há estoque suficiente para uma saída
-        if quantidade < 0 and estoque_local_anterior < abs(quantidade):
+        # Sem o ledger, a validação de saída é feita com o estoque em memória
+        if not ESTOQUE_VIA_LEDGER and quantidade < 0 and produto.estoque_por_local.get(localizacao.nome, 0) < abs(quantidade):
             raise ValueError(f"Estoque insuficiente de '{produto.nome}' em '{localizacao.nome}'.")
 
-        novo_estoque_local = estoque_local_anterior + quantidade
-        query_estoque = """
-        INSERT INTO estoque (produto_id, localizacao_id, quantidade) VALUES (?, ?, ?)
-        ON CONFLICT(produto_id, localizacao_id) DO UPDATE SET quantidade = ?;
-        """
-        self.db.execute_query(query_estoque, (produto_id, localizacao_id, novo_estoque_local, novo_estoque_local))
-
-        # Registra a movimentação no histórico
-        agora = datetime.now()
-        query_hist = "INSERT INTO historico_movimentos (produto_id, localizacao_id, tipo, quantidade, data) VALUES (?, ?, ?, ?, ?)"
-        self.db.execute_query(query_hist, (produto_id, localizacao_id, tipo_movimento, quantidade, agora.isoformat()))
-
-        # Atualiza os dados em memória
-        produto.estoque_por_local[localizacao.nome] = novo_estoque_local
-        self.historico.append(HistoricoMovimento(produto, tipo_movimento, quantidade, localizacao, agora))
+        try:
+            alertas = self._postar_movimentos([(produto_id, localizacao_id, quantidade, tipo_movimento)])
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Estoque insuficiente de '{produto.nome}' em '{localizacao.nome}'.")
 
-        # Verifica se o estoque total do produto caiu abaixo do ponto de ressuprimento.
-        produto_para_alertar = None
-        if estoque_anterior > produto.ponto_ressuprimento and produto.get_estoque_total() <= produto.ponto_ressuprimento:
-            produto_para_alertar = produto
+        # Devolve o produto se o estoque total caiu abaixo do ponto de ressuprimento.
+        return True, (alertas[0] if alertas else None)
 
-        return True, produto_para_alertar
+    def _postar_movimentos(self, movimentos: list[tuple[int, int, int, str]], data: datetime | None = None) -> list[Produto]:
+        """
+        Grava uma lista de movimentações (produto_id, localizacao_id, quantidade, tipo) numa transação só
+        e atualiza a memória. Retorna os produtos que atingiram o ponto de ressuprimento.
+        Levanta sqlite3.IntegrityError (e nada é gravado) se algum saldo ficaria negativo.
+        """
+        agora = data or datetime.now()
+        with self._travar_estoque((p_id, l_id) for p_id, l_id, _, _ in movimentos), self.db.transacao():
+            self._gravar_movimentos(movimentos, agora)
+            return self._aplicar_movimentos_em_memoria(movimentos, agora)
+
+    def _gravar_movimentos(self, movimentos: list[tuple[int, int, int, str]], agora: datetime):
+        """Grava as movimentações no banco com executemany (deve ser chamado dentro de uma transação)."""
+        data_str = agora.isoformat()
+        self._gravar_movimentos_datados([(p_id, l_id, qtd, tipo, data_str) for p_id, l_id, qtd, tipo in movimentos])
+
+    def _gravar_movimentos_datados(self, movimentos: list[tuple[int, int, int, str, str]]):
+        """Igual ao _gravar_movimentos, mas cada movimento (produto_id, localizacao_id, quantidade, tipo, data) traz a sua data."""
+        if not ESTOQUE_VIA_LEDGER:
+            # sem os triggers, o delta também é aplicado aqui na tabela de estoque
+            self.db.execute_many("INSERT OR IGNORE INTO estoque (produto_id, localizacao_id, quantidade) VALUES (?, ?, 0)",
+                                 [(p_id, l_id) for p_id, l_id, _, _, _ in movimentos])
+            self.db.execute_many("UPDATE estoque SET quantidade = quantidade + ? WHERE produto_id = ? AND localizacao_id = ?",
+                                 [(qtd, p_id, l_id) for p_id, l_id, qtd, _, _ in movimentos])
+        self.db.execute_many("INSERT INTO historico_movimentos (produto_id, localizacao_id, tipo, quantidade, data) VALUES (?, ?, ?, ?, ?)",
+                             [(p_id, l_id, tipo, qtd, data_str) for p_id, l_id, qtd, tipo, data_str in movimentos])
+        # todo movimento também vai pro feed de eventos, na mesma transação
+        self.db.execute_many("INSERT INTO eventos (tipo, entidade_id, dados, data) VALUES ('movimento_estoque', ?, ?, ?)",
+                             [(p_id, json.dumps({'localizacao_id': l_id, 'quantidade': qtd, 'tipo_movimento': tipo}, ensure_ascii=False), data_str)
+                              for p_id, l_id, qtd, tipo, data_str in movimentos])
+
+    def _aplicar_movimentos_em_memoria(self, movimentos: list[tuple[int, int, int, str]], agora: datetime) -> list[Produto]:
+        """
+        Atualiza a memória depois de gravar movimentações: os saldos das células afetadas são lidos do banco
+        (assim não dependem do valor em memória estar em dia). Retorna os produtos que atingiram o ponto de ressuprimento.
+        """
+        celulas = list(dict.fromkeys((p_id, l_id) for p_id, l_id, _, _ in movimentos))
+        produtos_afetados = {p_id: self.produtos[p_id] for p_id, _ in celulas if p_id in self.produtos}
+        estoque_anterior = {p_id: p.get_estoque_total() for p_id, p in produtos_afetados.items()}
+
+        # lê os saldos novos em blocos, pra não estourar o limite de parâmetros do sqlite
+        for inicio in range(0, len(celulas), 400):
+            bloco = celulas[inicio:inicio + 400]
+            filtro = " OR ".join(["(produto_id = ? AND localizacao_id = ?)"] * len(bloco))
+            params = tuple(valor for celula in bloco for valor in celula)
+            linhas = self.db.execute_query(f"SELECT produto_id, localizacao_id, quantidade FROM estoque WHERE {filtro}", params, fetch='all') or []
+            with self._trava_estoque_memoria:
+                for p_id, l_id, qtd in linhas:
+                    if (produto := produtos_afetados.get(p_id)) and (localizacao := self.localizacoes.get(l_id)):
+                        produto.estoque_por_local[localizacao.nome] = qtd
+        self._invalidar_kits(celulas)
+
+        # no catálogo sob demanda o histórico fica só no banco
+        if not self._catalogo_sob_demanda:
+            for p_id, l_id, qtd, tipo in movimentos:
+                if (produto := produtos_afetados.get(p_id)) and (localizacao := self.localizacoes.get(l_id)):
+                    self.historico.append(HistoricoMovimento(produto, tipo, qtd, localizacao, agora))
+        self._contabilizar_movimentos(len(movimentos))
+
+        return [p for p_id, p in produtos_afetados.items()
+                if estoque_anterior[p_id] > p.ponto_ressuprimento and p.get_estoque_total() <= p.ponto_ressuprimento]
 
     def transferir_estoque(self, produto_id: int, origem_id: int, destino_id: int, quantidade: int):
-        """Transfere uma quantidade de um produto entre duas localizações."""
+        """Transfere uma quantidade de um produto entre duas localizações (na hora, sem ficar em trânsito)."""
+        self.criar_transferencia(origem_id, destino_id, [{'produto_id': produto_id, 'quantidade': quantidade}], em_transito=False)
+        return True
+
+    def criar_transferencia(self, origem_id: int, destino_id: int, itens_info: list[dict],
+                            em_transito: bool = True, reservas: list[str] | None = None) -> DocumentoTransferencia:
+        """
+        Cria um documento de transferência com várias linhas. Todas as linhas são validadas contra o estoque
+        disponível da origem (o que não está reservado pra outros; as 'reservas' informadas são desta
+        transferência e são consumidas) antes de gravar qualquer coisa, e as saídas (e as entradas, se não
+        for em trânsito) vão num lote só, numa transação só.
+        - em_transito=True: a mercadoria sai da origem agora e só entra no destino em receber_transferencia.
+        - em_transito=False: saída e entrada acontecem juntas (transferência dentro do mesmo prédio, por ex.).
+        Kit transfere só os kits já montados (o estoque próprio dele); os componentes soltos vão como individuais.
+        """
         if origem_id == destino_id:
             raise ValueError("A localização de origem e destino não podem ser as mesmas.")
-        if quantidade <= 0:
-            raise ValueError("A quantidade a transferir deve ser positiva.")
-
         origem, destino = self.localizacoes.get(origem_id), self.localizacoes.get(destino_id)
         if not all([origem, destino]):
             raise ValueError("Localização de origem ou destino inválida.")
+        if not itens_info:
+            raise ValueError("A transferência deve ter pelo menos um item.")
+
+        # origem e destino de todas as linhas ficam travados da validação até a gravação
+        celulas = [(item_info['produto_id'], local_id) for item_info in itens_info for local_id in (origem_id, destino_id)]
+        with self._travar_estoque(celulas):
+            return self._criar_transferencia_travada(origem, destino, itens_info, em_transito, reservas or [])
+
+    def _criar_transferencia_travada(self, origem: Localizacao, destino: Localizacao, itens_info: list[dict],
+                                     em_transito: bool, reservas: list[str]) -> DocumentoTransferencia:
+        origem_id, destino_id = origem.id, destino.id
+        proprias = self._reservas_validas(reservas, origem_id)
+        reservado_proprio = self._unidades_reservadas(proprias)
+        def disponivel(p_id: int) -> int:
+            reservado_por_outros = max(0, self._reservado_por_celula.get((p_id, origem_id), 0) - reservado_proprio[p_id])
+            return self.produtos[p_id].estoque_por_local.get(origem.nome, 0) - reservado_por_outros
+
+        # junta linhas repetidas do mesmo produto e valida tudo antes de mexer no banco
+        quantidades = Counter()
+        for item_info in itens_info:
+            if not (produto := self.produtos.get(item_info['produto_id'])):
+                raise ValueError(f"Produto com ID {item_info['produto_id']} não encontrado.")
+            if item_info['quantidade'] <= 0:
+                raise ValueError(f"A quantidade a transferir de '{produto.nome}' deve ser positiva.")
+            quantidades[produto.id] += item_info['quantidade']
+        faltando = [f"'{self.produtos[p_id].nome}' (pedido {qtd}, disponível {disponivel(p_id)})"
+                    for p_id, qtd in quantidades.items() if disponivel(p_id) < qtd]
+        if faltando:
+            raise ValueError(f"Estoque insuficiente em '{origem.nome}' para: {', '.join(faltando)}.")
 
-        # Realiza duas movimentações: uma de saída e uma de entrada.
-        self.movimentar_estoque(produto_id, origem_id, -quantidade, f"Transferência p/ {destino.nome}")
-        self.movimentar_estoque(produto_id, destino_id, quantidade, f"Transferência de {origem.nome}")
-        return True
+        agora = datetime.now()
+        status = "Em Trânsito" if em_transito else "Recebida"
+        itens = [ItemTransferencia(self._produto_do_documento(p_id), qtd) for p_id, qtd in quantidades.items()]
+        try:
+            with self.db.transacao():
+                documento_id = self.db.execute_query(
+                    "INSERT INTO transferencias (origem_id, destino_id, status, data_criacao, data_recebimento) VALUES (?, ?, ?, ?, ?)",
+                    (origem_id, destino_id, status, agora.isoformat(), None if em_transito else agora.isoformat()))
+                self.db.execute_many("INSERT INTO itens_transferencia (transferencia_id, produto_id, quantidade) VALUES (?, ?, ?)",
+                                     [(documento_id, item.produto.id, item.quantidade) for item in itens])
+                # Realiza as movimentações: as saídas de todas as linhas e, se não for em trânsito, as entradas.
+                movimentos = [(item.produto.id, origem_id, -item.quantidade, f"Transferência #{documento_id} p/ {destino.nome}")
+                              for item in itens]
+                if not em_transito:
+                    movimentos += [(item.produto.id, destino_id, item.quantidade, f"Transferência #{documento_id} de {origem.nome}")
+                                   for item in itens]
+                self._postar_movimentos(movimentos, agora)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Estoque insuficiente em '{origem.nome}' para concluir a transferência.")
+        self._soltar_reservas(proprias)
+
+        documento = DocumentoTransferencia(documento_id, origem, destino, itens, status, agora, None if em_transito else agora)
+        self.transferencias[documento_id] = documento
+        return documento
+
+    def receber_transferencia(self, transferencia_id: int) -> DocumentoTransferencia:
+        """Dá entrada no destino de uma transferência que estava em trânsito."""
+        return self._encerrar_transferencia(transferencia_id, "Recebida")
+
+    def cancelar_transferencia(self, transferencia_id: int) -> DocumentoTransferencia:
+        """Cancela uma transferência em trânsito, devolvendo a mercadoria para a origem."""
+        return self._encerrar_transferencia(transferencia_id, "Cancelada")
+
+    def _encerrar_transferencia(self, transferencia_id: int, novo_status: str) -> DocumentoTransferencia:
+        if not (documento := self.transferencias.get(transferencia_id)):
+            raise ValueError("Transferência não encontrada.")
+        if documento.status != "Em Trânsito":
+            raise ValueError(f"A transferência #{transferencia_id} não está em trânsito (status: {documento.status}).")
+
+        agora = datetime.now()
+        if novo_status == "Recebida":
+            local, tipo = documento.destino, f"Transferência #{documento.id} de {documento.origem.nome}"
+        else:
+            local, tipo = documento.origem, f"Estorno Transferência #{documento.id}"
+        with self._travar_estoque((item.produto.id, local.id) for item in documento.itens), self.db.transacao():
+            self.db.execute_query("UPDATE transferencias SET status = ?, data_recebimento = ? WHERE id = ?",
+                                  (novo_status, agora.isoformat() if novo_status == "Recebida" else None, documento.id))
+            self._postar_movimentos([(item.produto.id, local.id, item.quantidade, tipo) for item in documento.itens], agora)
+
+        documento.status = novo_status
+        if novo_status == "Recebida":
+            documento.data_recebimento = agora
+        return documento
+
+    def estoque_em_transito(self) -> dict[int, int]:
+        """Quantidade de cada produto que saiu de uma localização e ainda não chegou na outra."""
+        if self._catalogo_sob_demanda:
+            return {p_id: qtd for p_id, qtd in self.db.execute_query(
+                """SELECT i.produto_id, SUM(i.quantidade) FROM itens_transferencia i JOIN transferencias t ON t.id = i.transferencia_id
+                   WHERE t.status = 'Em Trânsito' GROUP BY i.produto_id""", fetch='all') or []}
+        em_transito = Counter()
+        for documento in self.transferencias.values():
+            if documento.status == "Em Trânsito":
+                for item in documento.itens:
+                    em_transito[item.produto.id] += item.quantidade
+        return dict(em_transito)
 
     def criar_ordem_compra(self, fornecedor_id: int, itens_info: list[dict]) -> OrdemCompra:
         """Cria uma nova ordem de compra para um fornecedor."""
@@ -464,10 +1041,6 @@ class GerenciadorEstoque:
         if not itens_info:
             raise ValueError("A ordem de compra deve ter pelo menos um item.")
 
-        agora = datetime.now()
-        query_oc = "INSERT INTO ordens_compra (fornecedor_id, status, data_criacao) VALUES (?, ?, ?)"
-        novo_id_oc = self.db.execute_query(query_oc, (fornecedor_id, "Pendente", agora.isoformat()))
-
         itens_oc_obj = []
         for item_info in itens_info:
             produto_id, quantidade = item_info['produto_id'], item_info['quantidade']
@@ -475,48 +1048,171 @@ class GerenciadorEstoque:
                 raise ValueError(f"Produto com ID {produto_id} não encontrado.")
             if produto.fornecedor.id != fornecedor_id:
                 raise ValueError(f"Produto '{produto.nome}' não pertence ao fornecedor '{fornecedor.nome}'.")
+            itens_oc_obj.append(ItemOrdemCompra(self._produto_do_documento(produto_id), quantidade, produto.preco_compra))
 
-            preco_unitario = produto.preco_compra
+        agora = datetime.now()
+        with self.db.transacao():
+            query_oc = "INSERT INTO ordens_compra (fornecedor_id, status, data_criacao) VALUES (?, ?, ?)"
+            novo_id_oc = self.db.execute_query(query_oc, (fornecedor_id, "Pendente", agora.isoformat()))
             query_item = "INSERT INTO itens_ordem_compra (ordem_id, produto_id, quantidade, preco_unitario) VALUES (?, ?, ?, ?)"
-            self.db.execute_query(query_item, (novo_id_oc, produto_id, quantidade, preco_unitario))
-
-            item_obj = ItemOrdemCompra(produto, quantidade, preco_unitario)
-            itens_oc_obj.append(item_obj)
+            for item_obj in itens_oc_obj:
+                item_obj.id = self.db.execute_query(query_item, (novo_id_oc, item_obj.produto.id, item_obj.quantidade, item_obj.preco_unitario))
+            self._registrar_eventos([('status_ordem_compra', novo_id_oc, {
+                'status': "Pendente", 'fornecedor_id': fornecedor_id,
+                'itens': [{'produto_id': i.produto.id, 'quantidade': i.quantidade, 'preco_unitario': i.preco_unitario} for i in itens_oc_obj]})], agora)
 
         nova_ordem = OrdemCompra(novo_id_oc, fornecedor, itens_oc_obj, "Pendente", agora)
         self.ordens_compra[novo_id_oc] = nova_ordem
         return nova_ordem
 
     def atualizar_status_ordem(self, ordem_id: int, novo_status: str, localizacao_id: int | None = None):
-        """Atualiza o status de uma ordem de compra. Se o status for 'Recebida', movimenta o estoque."""
+        """
+        Atualiza o status de uma ordem de compra. Se o status for 'Recebida', dá entrada em tudo o que
+        ainda estava pendente (para receber só uma parte, use receber_ordens_compra). Como antes, isso vale
+        para qualquer status que não seja 'Recebida' (uma OC cancelada que acabou chegando, por ex.).
+        """
         if not (ordem := self.ordens_compra.get(ordem_id)):
             raise ValueError("Ordem de Compra não encontrada.")
 
         if novo_status == "Recebida":
             if ordem.status == "Recebida":
                 raise ValueError("Esta ordem já foi recebida.")
-            if not localizacao_id or not (localizacao := self.localizacoes.get(localizacao_id)):
-                raise ValueError("A localização é obrigatória e válida para receber uma ordem.")
+            if any(item.quantidade_pendente for item in ordem.itens):
+                self._receber_ordens_compra({ordem_id: None}, localizacao_id, qualquer_status=True)
+                return True
+            # nada pendente (foi tudo recebido antes de mudarem o status à mão): só volta o status
+
+        with self.db.transacao():
+            self.db.execute_query("UPDATE ordens_compra SET status = ? WHERE id = ?", (novo_status, ordem_id))
+            self._registrar_eventos([('status_ordem_compra', ordem_id, {'status': novo_status})])
+        ordem.status = novo_status # Atualiza o objeto em memória
+        return True
 
-            # Para cada item na ordem, registra a entrada no estoque.
+    def receber_ordens_compra(self, recebimentos: dict[int, dict[int, int] | None], localizacao_id: int | None) -> list[Produto]:
+        """
+        Recebe várias OCs de uma vez. 'recebimentos' mapeia o ID da OC para {produto_id: quantidade recebida}
+        (ou None para receber tudo o que ainda está pendente nela). O que não chegou fica pendente (backorder)
+        e o status de cada OC passa a ser derivado do recebido x pedido (Pendente/Parcialmente Recebida/Recebida).
+        Tudo é validado antes; as entradas de estoque de todas as OCs vão num lote só, numa transação só.
+        Retorna os produtos que atingiram o ponto de ressuprimento (normalmente nenhum, já que é entrada).
+        """
+        return self._receber_ordens_compra(recebimentos, localizacao_id)
+
+    def _receber_ordens_compra(self, recebimentos: dict[int, dict[int, int] | None], localizacao_id: int | None,
+                               qualquer_status: bool = False) -> list[Produto]:
+        """receber_ordens_compra; com qualquer_status=True aceita OC fora de Pendente/Parcialmente Recebida (usado pelo atualizar_status_ordem)"""
+        if not localizacao_id or not (localizacao := self.localizacoes.get(localizacao_id)):
+            raise ValueError("A localização é obrigatória e válida para receber uma ordem.")
+
+        # (item, quantidade que está chegando agora), calculado e validado antes de gravar qualquer coisa
+        entradas: list[tuple[OrdemCompra, ItemOrdemCompra, int]] = []
+        for ordem_id, quantidades in recebimentos.items():
+            if not (ordem := self.ordens_compra.get(ordem_id)):
+                raise ValueError(f"Ordem de Compra #{ordem_id} não encontrada.")
+            if not qualquer_status and ordem.status not in ("Pendente", "Parcialmente Recebida"):
+                raise ValueError(f"A OC #{ordem_id} não está aguardando recebimento (status: {ordem.status}).")
+            if quantidades is None:
+                entradas.extend((ordem, item, item.quantidade_pendente) for item in ordem.itens if item.quantidade_pendente)
+                continue
+            for produto_id, quantidade in quantidades.items():
+                linhas = [item for item in ordem.itens if item.produto.id == produto_id]
+                if not linhas:
+                    raise ValueError(f"O produto #{produto_id} não faz parte da OC #{ordem_id}.")
+                if quantidade < 0:
+                    raise ValueError(f"Quantidade recebida inválida para o produto #{produto_id} na OC #{ordem_id}.")
+                if quantidade > sum(item.quantidade_pendente for item in linhas):
+                    raise ValueError(f"Recebendo mais '{linhas[0].produto.nome}' do que o pendente na OC #{ordem_id}.")
+                # se o produto aparece em mais de uma linha, vai preenchendo na ordem
+                for item in linhas:
+                    parte = min(quantidade, item.quantidade_pendente)
+                    if parte:
+                        entradas.append((ordem, item, parte))
+                    quantidade -= parte
+        if not entradas:
+            raise ValueError("Nenhuma quantidade a receber.")
+
+        ordens = {ordem.id: ordem for ordem, _, _ in entradas}
+        with self._travar_estoque((item.produto.id, localizacao_id) for _, item, _ in entradas), self.db.transacao():
+            self.db.execute_many("UPDATE itens_ordem_compra SET quantidade_recebida = quantidade_recebida + ? WHERE id = ?",
+                                 [(quantidade, item.id) for _, item, quantidade in entradas])
+            for _, item, quantidade in entradas:
+                item.quantidade_recebida += quantidade
+            try:
+                self.db.execute_many("UPDATE ordens_compra SET status = ? WHERE id = ?",
+                                     [(ordem.status_pelo_recebimento(), ordem.id) for ordem in ordens.values()])
+                recebido_por_ordem: dict[int, Counter] = {ordem_id: Counter() for ordem_id in ordens}
+                for ordem, item, quantidade in entradas:
+                    recebido_por_ordem[ordem.id][item.produto.id] += quantidade
+                self._registrar_eventos([('status_ordem_compra', ordem.id, {
+                    'status': ordem.status_pelo_recebimento(), 'localizacao_id': localizacao_id,
+                    'recebido': [{'produto_id': p_id, 'quantidade': qtd} for p_id, qtd in recebido_por_ordem[ordem.id].items()]})
+                    for ordem in ordens.values()])
+                alertas = self._postar_movimentos([(item.produto.id, localizacao_id, quantidade, f"Entrada OC #{ordem.id}")
+                                                   for ordem, item, quantidade in entradas])
+            except Exception:
+                # o banco volta atrás sozinho; a memória tem que voltar também
+                for _, item, quantidade in entradas:
+                    item.quantidade_recebida -= quantidade
+                raise
+
+        for ordem in ordens.values():
+            ordem.status = ordem.status_pelo_recebimento()
+        return alertas
+
+    def gerar_recibo_ordem_compra(self, ordem_id: int) -> str:
+        """Formata os dados de uma Ordem de Compra em um texto legível (recibo)."""
+        if not (ordem := self.ordens_compra.get(ordem_id)):
+            raise ValueError("Ordem de Compra não encontrada.")
+        linhas = [
+            "==========================================",
+            "        ORDEM DE COMPRA (RECIBO)          ",
+            "==========================================",
+            f"Número do Pedido: {ordem.id}",
+            f"Data de Emissão: {ordem.data_criacao.strftime('%d/%m/%Y %H:%M:%S')}",
+            f"Status: {ordem.status}",
+            "\n--- DADOS DO FORNECEDOR ---",
+            f"Empresa: {ordem.fornecedor.empresa}",
+            f"Nome do Contato: {ordem.fornecedor.nome}",
+            f"Telefone: {ordem.fornecedor.telefone}",
+            f"Email: {ordem.fornecedor.email}",
+            f"Endereço: {ordem.fornecedor.morada}",
+            "\n--- ITENS DO PEDIDO ---"
+        ]
+
+        header = f'{"ID":<5}{"Produto":<30}{"Qtd":>5} {"Preço Un.":>15} {"Subtotal":>15}'
+        linhas.append(header)
+        linhas.append("-" * len(header))
+
+        for item in ordem.itens:
+            linha_item = (f"{item.produto.id:<5}"
+                          f"{item.produto.nome[:29]:<30}"
+                          f"{item.quantidade:>5} "
+                          f"{f'R$ {item.preco_unitario:,.2f}':>15}"
+                          f"{f'R$ {item.subtotal:,.2f}':>15}")
+            linhas.append(linha_item)
+
+        linhas.append("-" * len(header))
+        linhas.append(f"{'VALOR TOTAL:':>56} {f'R$ {ordem.valor_total:,.2f}':>15}")
+
+        # recebimento parcial: mostra o que ainda está em aberto (backorder)
+        if ordem.status == "Parcialmente Recebida":
+            linhas.append("\n--- PENDENTE DE ENTREGA ---")
             for item in ordem.itens:
-                self.movimentar_estoque(
-                    produto_id=item.produto.id, localizacao_id=localizacao_id,
-                    quantidade=item.quantidade, tipo_movimento=f"Entrada OC #{ordem.id}"
-                )
+                if item.quantidade_pendente:
+                    linhas.append(f"{item.produto.id:<5}{item.produto.nome[:29]:<30}{item.quantidade_pendente:>5} "
+                                  f"(recebido {item.quantidade_recebida} de {item.quantidade})")
 
-        self.db.execute_query("UPDATE ordens_compra SET status = ? WHERE id = ?", (novo_status, ordem_id))
-        ordem.status = novo_status # Atualiza o objeto em memória
-        return True
+        return "\n".join(linhas)
 
     def definir_componentes_kit(self, kit_id: int, componentes_info: list[dict]):
-        """Define ou atualiza a lista de componentes de um kit."""
+        """
+        Define ou atualiza a lista de componentes de um kit. Um componente pode ser outro kit (kit de kits),
+        desde que isso não forme um ciclo (o kit acabaria contendo a si mesmo).
+        """
         if not (kit := self.produtos.get(kit_id)) or kit.tipoProduto != 'kit':
             raise ValueError("Produto não é um kit válido.")
 
-        # Limpa componentes antigos do banco de dados
-        self.db.execute_query("DELETE FROM componentes_kit WHERE kit_produto_id = ?", (kit_id,))
-
+        # valida tudo antes de mexer no banco
         novos_componentes_obj = []
         for comp_info in componentes_info:
             comp_id = comp_info['produto_id']
@@ -524,29 +1220,1487 @@ class GerenciadorEstoque:
 
             if not (componente_prod := self.produtos.get(comp_id)):
                 raise ValueError(f"Componente com ID {comp_id} não encontrado.")
+            if quantidade <= 0:
+                raise ValueError(f"A quantidade de '{componente_prod.nome}' no kit deve ser positiva.")
             if componente_prod.tipoProduto == 'kit':
-                raise ValueError("Não é possível adicionar um kit como componente de outro kit.")
-
-            # Insere novo componente no banco
-            query = "INSERT INTO componentes_kit (kit_produto_id, componente_produto_id, quantidade) VALUES (?, ?, ?)"
-            self.db.execute_query(query, (kit_id, comp_id, quantidade))
+                if not componente_prod.componentes:
+                    raise ValueError(f"O kit '{componente_prod.nome}' ainda não tem componentes.")
+                if comp_id == kit_id:
+                    raise ValueError("Um kit não pode ser componente de si mesmo.")
+                if self._kit_contem(componente_prod, kit_id):
+                    raise ValueError(f"'{componente_prod.nome}' já contém '{kit.nome}': usar como componente criaria um ciclo.")
             novos_componentes_obj.append(ComponenteKit(componente_prod, quantidade))
 
-        # Atualiza o objeto em memória
-        kit.componentes = novos_componentes_obj
-        kit.recalcular_preco_compra()
-        # Atualiza o preço de compra no banco também
-        self.db.execute_query("UPDATE produtos SET preco_compra = ? WHERE id = ?", (kit.preco_compra, kit_id))
+        with self.db.transacao():
+            # Troca os componentes antigos pelos novos no banco de dados
+            self.db.execute_query("DELETE FROM componentes_kit WHERE kit_produto_id = ?", (kit_id,))
+            self.db.execute_many("INSERT INTO componentes_kit (kit_produto_id, componente_produto_id, quantidade) VALUES (?, ?, ?)",
+                                 [(kit_id, c.produto.id, c.quantidade) for c in novos_componentes_obj])
+
+            # Atualiza o objeto em memória
+            kit.componentes = novos_componentes_obj
+            self._invalidar_kits()
+            # o preço de compra deste kit mudou, e o dos kits que o contêm também (gravados no banco junto)
+            self._aplicar_precos_kits(self._recalcular_precos_kits(self.ordem_topologica_kits()))
+
+    #region Importação em lote (CSV)
+    def _proximo_id(self, tabela: str) -> int:
+        """Próximo id livre de uma tabela AUTOINCREMENT (para inserir em lote já com os ids definidos)."""
+        row = self.db.execute_query(
+            f"SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0), COALESCE((SELECT MAX(id) FROM {tabela}), 0))",
+            (tabela,), fetch='one')
+        return row[0] + 1
+
+    @staticmethod
+    def _ler_csv_em_lotes(caminho: str, tamanho_lote: int, delimitador: str):
+        """Lê um CSV (com cabeçalho) aos poucos, gerando listas de (número da linha, dicionário da linha)."""
+        with open(caminho, newline='', encoding='utf-8-sig') as f:
+            leitor = csv.DictReader(f, delimiter=delimitador)
+            lote = []
+            for linha in leitor:
+                lote.append((leitor.line_num, {(k or '').strip().lower(): (v or '').strip() for k, v in linha.items()}))
+                if len(lote) >= tamanho_lote:
+                    yield lote
+                    lote = []
+            if lote:
+                yield lote
+
+    def importar_csv(self, fornecedores_csv: str | None = None, produtos_csv: str | None = None,
+                     estoque_csv: str | None = None, tamanho_lote: int = 1000, delimitador: str = ',') -> ResultadoImportacao:
+        """
+        Importa fornecedores, produtos (com a composição dos kits) e o estoque inicial de arquivos CSV.
+        - fornecedores: nome, empresa, telefone, email, morada (a empresa é a chave; as já cadastradas são ignoradas)
+        - produtos: nome, descricao, categoria, codigo_barras, preco_compra, preco_venda, ponto_ressuprimento,
+          fornecedor (empresa), tipo (individual/kit), componentes ("codigo:qtd|codigo:qtd", só para kits)
+        - estoque: codigo_barras, localizacao (nome), quantidade (de um kit, são os kits já montados)
+        Os arquivos são lidos em lotes e gravados com executemany numa transação só; a memória é atualizada
+        uma vez no final. Linhas inválidas são rejeitadas (e listadas no resultado) sem abortar o resto.
+        """
+        resultado = ResultadoImportacao()
+        fornecedores_por_empresa = {f.empresa.strip().lower(): f for f in self.fornecedores.values()}
+        localizacoes_por_nome = {l.nome.strip().lower(): l for l in self.localizacoes.values()}
+        # produtos desta importação ainda não estão em self.produtos, então têm um índice próprio
+        novos_por_codigo: dict[str, Produto] = {}
+        novos_fornecedores: list[Fornecedor] = []
+        novos_produtos: list[Produto] = []
+        movimentos: list[tuple[int, int, int, str]] = []
+
+        def buscar_por_codigo(codigo: str) -> Produto | None:
+            return novos_por_codigo.get(codigo) or self.buscar_produto_por_codigo_barras(codigo)
+
+        with self.db.transacao():
+            if fornecedores_csv:
+                proximo_id = self._proximo_id('fornecedores')
+                for lote in self._ler_csv_em_lotes(fornecedores_csv, tamanho_lote, delimitador):
+                    validos = []
+                    for num_linha, linha in lote:
+                        if not linha.get('nome') or not linha.get('empresa'):
+                            resultado.rejeitadas.append((fornecedores_csv, num_linha, "nome e empresa são obrigatórios"))
+                            continue
+                        if linha['empresa'].lower() in fornecedores_por_empresa:
+                            continue  # já cadastrado: a chave natural resolve para o existente
+                        fornecedor = Fornecedor(proximo_id, linha['nome'], linha['empresa'], linha.get('telefone', ''),
+                                                linha.get('email', ''), linha.get('morada', ''))
+                        proximo_id += 1
+                        fornecedores_por_empresa[fornecedor.empresa.lower()] = fornecedor
+                        validos.append(fornecedor)
+                    self.db.execute_many("INSERT INTO fornecedores (id, nome, empresa, telefone, email, morada) VALUES (?, ?, ?, ?, ?, ?)",
+                                         [(f.id, f.nome, f.empresa, f.telefone, f.email, f.morada) for f in validos])
+                    novos_fornecedores.extend(validos)
+
+            if produtos_csv:
+                proximo_id = self._proximo_id('produtos')
+                kits_pendentes = []  # (num_linha, kit, texto dos componentes): resolvidos depois de todos os produtos
+                for lote in self._ler_csv_em_lotes(produtos_csv, tamanho_lote, delimitador):
+                    validos = []
+                    for num_linha, linha in lote:
+                        try:
+                            produto = self._produto_de_linha_csv(linha, proximo_id, fornecedores_por_empresa, buscar_por_codigo)
+                        except ValueError as e:
+                            resultado.rejeitadas.append((produtos_csv, num_linha, str(e)))
+                            continue
+                        proximo_id += 1
+                        if produto.codigo_barras:
+                            novos_por_codigo[produto.codigo_barras] = produto
+                        if produto.tipoProduto == 'kit':
+                            kits_pendentes.append((num_linha, produto, linha.get('componentes', '')))
+                        else:
+                            validos.append(produto)
+                    self._inserir_produtos_em_lote(validos)
+                    novos_produtos.extend(validos)
+
+                kits_validos = []
+                for num_linha, kit, texto_componentes in kits_pendentes:
+                    try:
+                        kit.componentes = self._componentes_de_texto_csv(texto_componentes, buscar_por_codigo)
+                    except ValueError as e:
+                        resultado.rejeitadas.append((produtos_csv, num_linha, str(e)))
+                        novos_por_codigo.pop(kit.codigo_barras, None)
+                        continue
+                    kit.recalcular_preco_compra()
+                    kits_validos.append(kit)
+                self._inserir_produtos_em_lote(kits_validos)
+                self.db.execute_many("INSERT INTO componentes_kit (kit_produto_id, componente_produto_id, quantidade) VALUES (?, ?, ?)",
+                                     [(kit.id, c.produto.id, c.quantidade) for kit in kits_validos for c in kit.componentes])
+                novos_produtos.extend(kits_validos)
+                resultado.kits = len(kits_validos)
+
+            if estoque_csv:
+                for lote in self._ler_csv_em_lotes(estoque_csv, tamanho_lote, delimitador):
+                    movimentos_lote = []
+                    for num_linha, linha in lote:
+                        produto = buscar_por_codigo(linha.get('codigo_barras', ''))
+                        localizacao = localizacoes_por_nome.get(linha.get('localizacao', '').lower())
+                        try:
+                            quantidade = int(linha.get('quantidade', ''))
+                        except ValueError:
+                            quantidade = -1
+                        if not produto:
+                            motivo = "produto não encontrado"
+                        elif not localizacao:
+                            motivo = f"localização '{linha.get('localizacao', '')}' não cadastrada"
+                        elif quantidade < 0:
+                            motivo = "quantidade deve ser um inteiro maior ou igual a zero"
+                        else:
+                            movimentos_lote.append((produto.id, localizacao.id, quantidade, "Carga Inicial"))
+                            continue
+                        resultado.rejeitadas.append((estoque_csv, num_linha, motivo))
+                    self._gravar_movimentos(movimentos_lote, datetime.now())
+                    movimentos.extend(movimentos_lote)
+
+        # só depois do commit a memória é atualizada, de uma vez
+        for fornecedor in novos_fornecedores:
+            self.fornecedores[fornecedor.id] = fornecedor
+        for produto in novos_produtos:
+            self.produtos[produto.id] = produto
+            self._indexar_codigo_barras(produto)
+            self._indexar_busca(produto)
+        if resultado.kits:
+            self._invalidar_kits()
+        if movimentos:
+            # as células do arquivo só são conhecidas depois de lido, já dentro da transação (e célula não se trava
+            # com a transação aberta): a memória é atualizada depois do commit, com as células travadas e numa
+            # transação, como num movimento qualquer, pra não sobrescrever o saldo de uma venda que entrou no meio
+            with self._travar_estoque((p_id, l_id) for p_id, l_id, _, _ in movimentos), self.db.transacao():
+                self._aplicar_movimentos_em_memoria(movimentos, datetime.now())
+
+        resultado.fornecedores = len(novos_fornecedores)
+        resultado.produtos = len(novos_produtos)
+        resultado.movimentos_estoque = len(movimentos)
+        return resultado
+
+    def _produto_de_linha_csv(self, linha: dict, produto_id: int, fornecedores_por_empresa: dict, buscar_por_codigo) -> Produto:
+        """Valida uma linha do CSV de produtos e monta o objeto (ainda sem gravar)."""
+        if not linha.get('nome'):
+            raise ValueError("nome é obrigatório")
+        if not (fornecedor := fornecedores_por_empresa.get(linha.get('fornecedor', '').lower())):
+            raise ValueError(f"fornecedor '{linha.get('fornecedor', '')}' não encontrado")
+        tipo = (linha.get('tipo') or 'individual').lower()
+        if tipo not in ('individual', 'kit'):
+            raise ValueError(f"tipo '{tipo}' inválido (use 'individual' ou 'kit')")
+        codigo = linha.get('codigo_barras', '')
+        if codigo and buscar_por_codigo(codigo):
+            raise ValueError(f"código de barras '{codigo}' já cadastrado")
+        try:
+            preco_venda = float(linha.get('preco_venda', '').replace(',', '.'))
+            preco_compra = 0.0 if tipo == 'kit' else float(linha.get('preco_compra', '').replace(',', '.'))
+            ponto_ressuprimento = int(linha.get('ponto_ressuprimento') or 0)
+        except ValueError:
+            raise ValueError("preços e ponto de ressuprimento devem ser numéricos")
+        if preco_venda < 0 or preco_compra < 0 or ponto_ressuprimento < 0:
+            raise ValueError("preços e ponto de ressuprimento não podem ser negativos")
+        return Produto(id=produto_id, nome=linha['nome'], descricao=linha.get('descricao', ''),
+                       categoria=linha.get('categoria', ''), fornecedor=fornecedor, codigo_barras=codigo,
+                       preco_compra=preco_compra, preco_venda=preco_venda,
+                       ponto_ressuprimento=ponto_ressuprimento, tipoProduto=tipo)
+
+    @staticmethod
+    def _componentes_de_texto_csv(texto: str, buscar_por_codigo) -> list[ComponenteKit]:
+        """Converte 'codigo:qtd|codigo:qtd' na lista de componentes de um kit."""
+        componentes = []
+        for parte in filter(None, (p.strip() for p in texto.split('|'))):
+            codigo, _, qtd = parte.rpartition(':')
+            componente = buscar_por_codigo(codigo.strip())
+            if not componente or componente.tipoProduto != 'individual':
+                raise ValueError(f"componente '{codigo}' não encontrado (ou é um kit)")
+            if not qtd.strip().isdigit() or int(qtd) <= 0:
+                raise ValueError(f"quantidade inválida para o componente '{codigo}'")
+            componentes.append(ComponenteKit(componente, int(qtd)))
+        if not componentes:
+            raise ValueError("kit sem componentes")
+        return componentes
+
+    def _inserir_produtos_em_lote(self, produtos: list[Produto]):
+        """Grava vários produtos (já com id) com um executemany só."""
+        self.db.execute_many(
+            """INSERT INTO produtos (id, nome, descricao, categoria, codigo_barras, preco_compra, preco_venda, ponto_ressuprimento, fornecedor_id, tipo_produto)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            [(p.id, p.nome, p.descricao, p.categoria, p.codigo_barras, p.preco_compra, p.preco_venda,
+              p.ponto_ressuprimento, p.fornecedor.id, p.tipoProduto) for p in produtos])
+    #endregion
+
+    #region Conciliação de inventário (contagem física)
+    def conciliar_contagem(self, arquivo: str, delimitador: str = ',') -> ConciliacaoInventario:
+        """
+        Lê um arquivo de contagem (colunas: codigo_barras ou produto_id, localizacao (nome ou ID), quantidade)
+        e compara o arquivo inteiro de uma vez com o estoque atual. Não grava nada: serve de prévia para
+        aplicar_ajustes_inventario. Linhas repetidas da mesma célula (duas equipes contando) são somadas.
+        Células que não aparecem no arquivo não são mexidas (dá pra fazer contagem parcial/cíclica).
+        Kit também pode ser contado: a contagem é dos kits já montados naquele local.
+        """
+        conciliacao = ConciliacaoInventario(arquivo)
+        localizacoes_por_nome = {l.nome.strip().lower(): l for l in self.localizacoes.values()}
+        contagem: Counter[tuple[int, int]] = Counter()
+
+        for lote in self._ler_csv_em_lotes(arquivo, 1000, delimitador):
+            for num_linha, linha in lote:
+                if linha.get('produto_id'):
+                    produto = self.produtos.get(int(linha['produto_id'])) if linha['produto_id'].isdigit() else None
+                else:
+                    produto = self.buscar_produto_por_codigo_barras(linha.get('codigo_barras', ''))
+                texto_local = linha.get('localizacao', '')
+                localizacao = (self.localizacoes.get(int(texto_local)) if texto_local.isdigit()
+                               else localizacoes_por_nome.get(texto_local.lower()))
+                quantidade = int(linha['quantidade']) if linha.get('quantidade', '').isdigit() else None
+
+                if not produto:
+                    conciliacao.rejeitadas.append((num_linha, "produto não encontrado"))
+                elif not localizacao:
+                    conciliacao.rejeitadas.append((num_linha, f"localização '{texto_local}' não cadastrada"))
+                elif quantidade is None:
+                    conciliacao.rejeitadas.append((num_linha, "quantidade contada deve ser um inteiro maior ou igual a zero"))
+                else:
+                    contagem[(produto.id, localizacao.id)] += quantidade
+
+        # compara tudo numa passada só contra o saldo em memória
+        conciliacao.contagem = dict(contagem)
+        conciliacao.celulas_contadas = len(contagem)
+        for (p_id, l_id), contado in sorted(contagem.items()):
+            produto, localizacao = self.produtos[p_id], self.localizacoes[l_id]
+            no_sistema = produto.estoque_por_local.get(localizacao.nome, 0)
+            if no_sistema != contado:
+                conciliacao.divergencias.append(DivergenciaContagem(produto, localizacao, no_sistema, contado))
+        return conciliacao
+
+    def aplicar_ajustes_inventario(self, conciliacao: ConciliacaoInventario) -> tuple[int, list[Produto]]:
+        """
+        Lança os ajustes da contagem como movimentações "Ajuste de Inventário" (positivas ou negativas) numa
+        transação só. A diferença (contado - saldo) é recalculada com as células travadas para TODAS as células
+        contadas, não só as que divergiam na prévia: uma venda entre a prévia e a confirmação numa célula que
+        batia também gera ajuste, e toda célula contada termina com a quantidade contada.
+        Retorna quantos ajustes foram lançados de fato (pode ser diferente das divergências da prévia)
+        e os produtos que atingiram o ponto de ressuprimento.
+        """
+        try:
+            with self._travar_estoque(conciliacao.contagem):
+                movimentos = []
+                for (p_id, l_id), contado in sorted(conciliacao.contagem.items()):
+                    diferenca = contado - self.produtos[p_id].estoque_por_local.get(self.localizacoes[l_id].nome, 0)
+                    if diferenca:
+                        movimentos.append((p_id, l_id, diferenca, "Ajuste de Inventário"))
+                # as travas são reentrantes: o _postar_movimentos pega as mesmas células de novo
+                return len(movimentos), self._postar_movimentos(movimentos) if movimentos else []
+        except sqlite3.IntegrityError:
+            raise ValueError("O estoque mudou durante a conciliação e algum ajuste deixaria saldo negativo. Refaça a contagem.")
+
+    def gerar_relatorio_conciliacao(self, conciliacao: ConciliacaoInventario) -> str:
+        """Prévia da conciliação: as diferenças por produto/local e quanto elas valem a preço de compra."""
+        report = f"""RELATÓRIO DE CONCILIAÇÃO DE INVENTÁRIO
+Arquivo de contagem: {conciliacao.arquivo}
+Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
+{'='*60}
+Células contadas: {conciliacao.celulas_contadas} | Com divergência: {len(conciliacao.divergencias)} | Linhas rejeitadas: {len(conciliacao.rejeitadas)}\n
+"""
+        for d in conciliacao.divergencias:
+            report += (f"ID: {d.produto.id} - {d.produto.nome} @ {d.localizacao.nome}\n"
+                       f"     Sistema: {d.quantidade_sistema} | Contado: {d.quantidade_contada} | "
+                       f"Diferença: {d.diferenca:+d} | Valor: R$ {d.valor:,.2f}\n")
+        sobras = sum(d.valor for d in conciliacao.divergencias if d.valor > 0)
+        perdas = sum(d.valor for d in conciliacao.divergencias if d.valor < 0)
+        report += f"\n{'='*60}\nSobras: R$ {sobras:,.2f} | Perdas: R$ {perdas:,.2f} | Variação líquida: R$ {conciliacao.valor_total:,.2f}\n"
+        for num_linha, motivo in conciliacao.rejeitadas:
+            report += f"Linha {num_linha} rejeitada: {motivo}\n"
+        return report
+    #endregion
+
+    #region Ingestão do log de vendas do PDV (JSONL)
+    @staticmethod
+    def _ler_log_vendas(arquivo: str, offset: int, linha_inicial: int):
+        """
+        Lê o log a partir de um offset (em bytes), gerando (número da linha, offset depois da linha, texto).
+        Uma última linha sem quebra de linha que não seja um JSON completo é considerada ainda sendo
+        escrita pelo PDV e fica para a próxima ingestão.
+        """
+        with open(arquivo, 'rb') as f:
+            f.seek(offset)
+            num_linha = linha_inicial
+            for linha in f:
+                if not linha.endswith(b'\n'):
+                    try:
+                        json.loads(linha)
+                    except ValueError:
+                        return
+                offset += len(linha)
+                num_linha += 1
+                yield num_linha, offset, linha
+
+    def _venda_de_registro_pdv(self, linha: bytes, localizacoes_por_nome: dict) -> tuple[list[dict], str, int, datetime | None]:
+        """Converte uma linha do log do PDV nos argumentos do registrar_venda (ValueError se estiver inválida)."""
+        try:
+            registro = json.loads(linha)
+        except ValueError:
+            raise ValueError("linha não é um JSON válido")
+        if not isinstance(registro, dict):
+            raise ValueError("registro de venda deve ser um objeto JSON")
+
+        local = registro.get('localizacao_id', registro.get('localizacao'))
+        localizacao = (self.localizacoes.get(local) if isinstance(local, int)
+                       else localizacoes_por_nome.get(str(local).strip().lower()))
+        if not localizacao:
+            raise ValueError(f"localização '{local}' não cadastrada")
+
+        itens = []
+        for item in registro.get('itens') or []:
+            if 'produto_id' in item:
+                produto = self.produtos.get(item['produto_id'])
+            else:
+                produto = self.buscar_produto_por_codigo_barras(str(item.get('codigo_barras', '')))
+            if not produto:
+                raise ValueError(f"produto não encontrado: {item}")
+            quantidade = item.get('quantidade', 1)
+            if not isinstance(quantidade, int) or quantidade <= 0:
+                raise ValueError(f"quantidade inválida para '{produto.nome}'")
+            itens.append({'produto_id': produto.id, 'quantidade': quantidade})
+
+        try:
+            data = datetime.fromisoformat(registro['data']) if registro.get('data') else None
+        except (TypeError, ValueError):
+            raise ValueError(f"data inválida '{registro.get('data')}'")
+        return itens, registro.get('cliente') or "Consumidor (PDV)", localizacao.id, data
+
+    def ingerir_log_vendas(self, arquivo: str, vendas_por_lote: int = INGESTAO_VENDAS_POR_LOTE,
+                           intervalo_ms: int = INGESTAO_INTERVALO_MS, recomecar: bool = False) -> ResultadoIngestao:
+        """
+        Ingere o log de vendas do PDV (uma venda JSON por linha), por exemplo:
+            {"data": "2025-10-01T09:15:00", "localizacao": "Loja A - Shopping", "cliente": "João",
+             "itens": [{"codigo_barras": "789123456001", "quantidade": 1}, {"produto_id": 2, "quantidade": 3}]}
+        O arquivo é lido em streaming e cada venda passa pelo registrar_venda (que valida o estoque).
+        As vendas são agrupadas numa transação que é confirmada a cada 'vendas_por_lote' vendas ou
+        'intervalo_ms' milissegundos, junto com o offset do arquivo: se o processo cair, a próxima chamada
+        continua do último lote confirmado, sem duplicar vendas. Vendas inválidas são rejeitadas e puladas.
+        """
+        chave = os.path.abspath(arquivo)
+        posicao = None if recomecar else self.db.execute_query(
+            "SELECT offset_bytes, linhas FROM ingestao_vendas WHERE arquivo = ?", (chave,), fetch='one')
+        offset, num_linha = posicao or (0, 0)
+        resultado = ResultadoIngestao(arquivo, offset_inicial=offset, offset_final=offset)
+        localizacoes_por_nome = {l.nome.strip().lower(): l for l in self.localizacoes.values()}
+
+        inicio = perf_counter()
+        registros = self._ler_log_vendas(arquivo, offset, num_linha)
+        fim_do_arquivo = False
+        pendentes = []  # linhas já lidas que ficaram para o próximo lote (o prazo estourou antes)
+        try:
+            while pendentes or not fim_do_arquivo:
+                # lê e interpreta o lote antes de abrir a transação: assim dá pra travar as células de estoque
+                # de todas as vendas dele de uma vez (as travas sempre vêm antes da transação)
+                lote = pendentes
+                while len(lote) < vendas_por_lote and not fim_do_arquivo:
+                    if (proximo := next(registros, None)) is None:
+                        fim_do_arquivo = True
+                        break
+                    num_linha_lida, offset_lido, linha = proximo
+                    try:
+                        venda = self._venda_de_registro_pdv(linha, localizacoes_por_nome) if linha.strip() else None
+                    except ValueError as e:
+                        venda = e
+                    lote.append((num_linha_lida, offset_lido, venda))
+
+                celulas = [celula for _, _, venda in lote if isinstance(venda, tuple)
+                           for celula in self._celulas_da_venda(venda[0], venda[2])]
+                prazo = perf_counter() + intervalo_ms / 1000
+                processadas = 0
+                with self._travar_estoque(celulas), self.db.transacao():
+                    for num_linha, offset, venda in lote:
+                        processadas += 1
+                        if isinstance(venda, ValueError):
+                            resultado.rejeitadas.append((num_linha, str(venda)))
+                        elif venda:
+                            try:
+                                itens, cliente, localizacao_id, data = venda
+                                self.registrar_venda(itens, cliente, localizacao_id, data=data)
+                                resultado.vendas += 1
+                            except ValueError as e:
+                                resultado.rejeitadas.append((num_linha, str(e)))
+                        if perf_counter() >= prazo:
+                            break
+                    self.db.execute_query(
+                        """INSERT INTO ingestao_vendas (arquivo, offset_bytes, linhas, atualizado_em) VALUES (?, ?, ?, ?)
+                           ON CONFLICT(arquivo) DO UPDATE SET offset_bytes = excluded.offset_bytes,
+                               linhas = excluded.linhas, atualizado_em = excluded.atualizado_em""",
+                        (chave, offset, num_linha, datetime.now().isoformat()))
+                pendentes = lote[processadas:]
+                resultado.lotes += 1
+                resultado.offset_final = offset
+        except Exception:
+            # o lote em andamento foi desfeito no banco, mas a memória já tinha as vendas dele
+            self.carregar_dados_do_banco(verboso=False)
+            raise
+        finally:
+            resultado.segundos = perf_counter() - inicio
+        return resultado
+    #endregion
+
+    #region Disponibilidade de kits por localização
+    def _kits_por_componente(self) -> dict[int, list[int]]:
+        """
+        índice reverso produto individual -> ids dos kits que o consomem, em qualquer nível (kit de kits também)
+        (refeito só quando a composição de algum kit muda)
+        """
+        if self._indice_kits_por_componente is None:
+            composicao = self._composicao_kits()
+            indice: dict[int, list[int]] = {}
+            # os de dentro vêm antes, então as folhas de um kit são as dos seus componentes que já foram vistos
+            folhas: dict[int, set[int]] = {}
+            for kit_id in self._ordem_topologica_ids():
+                folhas[kit_id] = set()
+                for c_id in composicao.get(kit_id, []):
+                    folhas[kit_id] |= folhas.get(c_id, set()) if c_id in composicao else {c_id}
+                for folha_id in folhas[kit_id]:
+                    indice.setdefault(folha_id, []).append(kit_id)
+            self._indice_kits_por_componente = indice
+        return self._indice_kits_por_componente
+
+    @staticmethod
+    def _kit_contem(kit: Produto, produto_id: int) -> bool:
+        """se o produto aparece em algum nível da composição do kit"""
+        pilha, vistos = [kit], set()
+        while pilha:
+            atual = pilha.pop()
+            for c in atual.componentes:
+                if c.produto.id == produto_id:
+                    return True
+                if c.produto.tipoProduto == 'kit' and c.produto.id not in vistos:
+                    vistos.add(c.produto.id)
+                    pilha.append(c.produto)
+        return False
+
+    def ordem_topologica_kits(self) -> list[Produto]:
+        """
+        Todos os kits, cada um depois dos kits que ele contém (pra calcular de baixo pra cima).
+        Levanta ValueError se encontrar um ciclo (não deveria: definir_componentes_kit não deixa criar).
+        """
+        return [kit for kit_id in self._ordem_topologica_ids() if (kit := self.produtos.get(kit_id))]
+
+    def _ordem_topologica_ids(self) -> list[int]:
+        """a ordem de ordem_topologica_kits só com os ids (guardada assim pra não prender os kits na memória)"""
+        if self._ordem_kits is None:
+            composicao = self._composicao_kits()
+            ordem, estado = [], {}  # estado: 1 = visitando, 2 = pronto
+            for kit_id in composicao:
+                if kit_id in estado:
+                    continue
+                # busca em profundidade sem recursão: (kit, já empilhou os filhos?)
+                pilha = [(kit_id, False)]
+                while pilha:
+                    atual, expandido = pilha.pop()
+                    if expandido:
+                        estado[atual] = 2
+                        ordem.append(atual)
+                        continue
+                    if estado.get(atual) == 2:
+                        continue
+                    estado[atual] = 1
+                    pilha.append((atual, True))
+                    for c_id in composicao[atual]:
+                        if c_id not in composicao:
+                            continue
+                        if estado.get(c_id) == 1:
+                            raise ValueError(f"Ciclo na composição dos kits envolvendo '{self.produtos[c_id].nome}'.")
+                        if c_id not in estado:
+                            pilha.append((c_id, False))
+            self._ordem_kits = ordem
+        return self._ordem_kits
+
+    def _recalcular_precos_kits(self, kits: list[Produto], gravados: dict[int, float] | None = None) -> list[tuple[Produto, float]]:
+        """
+        Recalcula o preço de compra dos kits (já em ordem topológica) e grava no banco os que mudaram,
+        com o evento 'preco_produto' de cada um (chamar dentro da transação da mudança que causou o recálculo).
+        gravados: {produto_id: preco_compra} já gravados nessa transação mas ainda não aplicados nos objetos.
+        Não mexe na memória: retorna os (kit, preço novo) pro chamador aplicar com _aplicar_precos_kits depois do commit.
+        """
+        gravados = dict(gravados or {})
+        mudancas, eventos = [], []
+        for kit in kits:
+            anterior = gravados.get(kit.id, kit.preco_compra)
+            novo = sum(gravados.get(c.produto.id, c.produto.preco_compra) * c.quantidade for c in kit.componentes)
+            # kits de kits: quem contém este kit já calcula com o preço novo
+            gravados[kit.id] = novo
+            if novo != anterior:
+                mudancas.append((kit, novo))
+                eventos.append(('preco_produto', kit.id, {
+                    'preco_compra': novo, 'preco_venda': kit.preco_venda,
+                    'preco_compra_anterior': anterior, 'preco_venda_anterior': kit.preco_venda}))
+        if mudancas:
+            self.db.execute_many("UPDATE produtos SET preco_compra = ? WHERE id = ?", [(novo, kit.id) for kit, novo in mudancas])
+            self._registrar_eventos(eventos)
+        return mudancas
+
+    @staticmethod
+    def _aplicar_precos_kits(mudancas: list[tuple[Produto, float]]):
+        """Aplica nos objetos os preços de compra devolvidos por _recalcular_precos_kits."""
+        for kit, preco in mudancas:
+            kit.preco_compra = preco
+
+    def _propagar_preco_compra_kits(self, produto_ids, gravados: dict[int, float] | None = None) -> list[tuple[Produto, float]]:
+        """
+        Depois de mudar o preço de compra de produtos individuais, recalcula só os kits que os consomem.
+        Mesmo contrato do _recalcular_precos_kits: devolve as mudanças pra aplicar depois do commit.
+        """
+        with self._trava_kits:
+            indice = self._kits_por_componente()
+            afetados = {kit_id for p_id in produto_ids for kit_id in indice.get(p_id, [])}
+            kits = [self.produtos[k_id] for k_id in self._ordem_topologica_ids() if k_id in afetados] if afetados else []
+        return self._recalcular_precos_kits(kits, gravados) if kits else []
+
+    def _invalidar_kits(self, celulas=None):
+        """
+        Descarta a disponibilidade calculada dos kits afetados pelas células (produto_id, localizacao_id)
+        que mudaram. Sem células, descarta tudo (recarga, mudança na composição de um kit, remoção...).
+        Chamar depois de atualizar o estoque em memória.
+        """
+        with self._trava_kits:
+            if celulas is None:
+                self._kits_por_local.clear()
+                self._indice_kits_por_componente = None
+                self._ordem_kits = None
+                for produto in self._produtos_em_memoria():
+                    produto.invalidar_componentes_folha()
+                return
+            indice = self._kits_por_componente()
+            for p_id, l_id in celulas:
+                if cache := self._kits_por_local.get(l_id):
+                    cache.pop(p_id, None)  # a célula pode ser a dos kits prontos
+                    for kit_id in indice.get(p_id, []):
+                        cache.pop(kit_id, None)
+
+    @staticmethod
+    def _montaveis_no_local(kit: Produto, nome_local: str) -> int:
+        """
+        os kits prontos no local mais os que dá pra montar: o individual mais escasso naquele local
+        (dividido pelo que o kit consome dele) limita a montagem
+        """
+        montados = kit.estoque_por_local.get(nome_local, 0)
+        if not (folhas := kit.componentes_folha()):
+            return montados
+        return montados + min((folha.estoque_por_local.get(nome_local, 0) // qtd if qtd > 0 else 0) for folha, qtd in folhas)
+
+    def estoque_kit_no_local(self, kit_id: int, localizacao_id: int) -> int:
+        """Quantas unidades do kit dá pra vender naquela localização: as já montadas mais as que dá pra montar lá."""
+        if not (localizacao := self.localizacoes.get(localizacao_id)):
+            raise ValueError("Localização não encontrada.")
+        kit = self.produtos.get(kit_id)
+        if not kit or kit.tipoProduto != 'kit':
+            raise ValueError("Produto não é um kit válido.")
+        with self._trava_kits:
+            cache = self._kits_por_local.setdefault(localizacao_id, {})
+            if (quantidade := cache.get(kit_id)) is None:
+                quantidade = cache[kit_id] = self._montaveis_no_local(kit, localizacao.nome)
+            return quantidade
+
+    def estoque_kits_no_local(self, localizacao_id: int) -> dict[int, int]:
+        """Disponibilidade de todos os kits numa localização ({kit_id: montáveis}); só recalcula os que mudaram."""
+        if not (localizacao := self.localizacoes.get(localizacao_id)):
+            raise ValueError("Localização não encontrada.")
+        with self._trava_kits:
+            cache = self._kits_por_local.setdefault(localizacao_id, {})
+            for kit_id in self._ordem_topologica_ids():
+                if kit_id not in cache:
+                    cache[kit_id] = self._montaveis_no_local(self.produtos[kit_id], localizacao.nome)
+            return dict(cache)
+
+    def estoque_kit_por_local(self, kit_id: int) -> dict[str, int]:
+        """Montáveis do kit em cada localização, no mesmo formato do 'estoque_por_local' dos individuais."""
+        return {l.nome: qtd for l in list(self.localizacoes.values()) if (qtd := self.estoque_kit_no_local(kit_id, l.id)) > 0}
+
+    def fotografia_estoque(self, produto: Produto) -> tuple[int, dict[str, int]]:
+        """
+        (estoque total, estoque por localização) do produto, copiados sem nenhuma movimentação pela metade:
+        é o que usa quem lê de outra thread enquanto a escritora mexe no estoque (ex: o servidor).
+        De kit, em cada local valem os já montados mais os montáveis com os componentes de lá.
+        """
+        with self._trava_estoque_memoria:
+            if produto.tipoProduto == 'kit':
+                return produto.get_estoque_total(), self.estoque_kit_por_local(produto.id)
+            por_local = dict(produto.estoque_por_local)
+        return sum(por_local.values()), por_local
+    #endregion
+
+    #region Montagem de kits (kits prontos em estoque)
+    def montar_kits(self, kit_id: int, localizacao_id: int, quantidade: int) -> OrdemMontagem:
+        """
+        Ordem de montagem: tira do local os individuais de 'quantidade' kits (em qualquer nível da composição)
+        e dá entrada nos kits prontos, no estoque do próprio kit, num lote só. Depois disso a venda do kit
+        debita uma linha só (o kit pronto) em vez de uma por componente.
+        """
+        return self._executar_ordem_montagem(kit_id, localizacao_id, quantidade, 'montagem')
+
+    def desmontar_kits(self, kit_id: int, localizacao_id: int, quantidade: int) -> OrdemMontagem:
+        """Ordem de desmontagem: o contrário da montagem (kits prontos voltam a ser os individuais)."""
+        return self._executar_ordem_montagem(kit_id, localizacao_id, quantidade, 'desmontagem')
+
+    def _executar_ordem_montagem(self, kit_id: int, localizacao_id: int, quantidade: int, tipo: str) -> OrdemMontagem:
+        kit, localizacao = self.produtos.get(kit_id), self.localizacoes.get(localizacao_id)
+        if not kit or kit.tipoProduto != 'kit':
+            raise ValueError("Produto não é um kit válido.")
+        if not localizacao:
+            raise ValueError("Localização não encontrada.")
+        if quantidade <= 0:
+            raise ValueError("A quantidade deve ser maior que zero.")
+        if not (folhas := kit.componentes_folha()):
+            raise ValueError(f"O kit '{kit.nome}' não tem componentes.")
+
+        celulas = [(kit_id, localizacao_id)] + [(folha.id, localizacao_id) for folha, _ in folhas]
+        with self._travar_estoque(celulas):
+            # o que está reservado pra alguém não entra na montagem/desmontagem
+            disponivel = Carrinho(localizacao, reservas_de_todos=self._reservado_por_celula)
+            if tipo == 'montagem':
+                if (possiveis := disponivel.montaveis(kit)) < quantidade:
+                    raise ValueError(f"Componentes insuficientes em '{localizacao.nome}' para montar {quantidade} kit(s) '{kit.nome}'. Apenas {possiveis} possível(is).")
+                sinal = 1
+            else:
+                if (prontos := disponivel.disponivel(kit) - disponivel.montaveis(kit)) < quantidade:
+                    raise ValueError(f"Só há {prontos} kit(s) '{kit.nome}' montado(s) disponível(is) em '{localizacao.nome}'.")
+                sinal = -1
+
+            agora = datetime.now()
+            try:
+                with self.db.transacao():
+                    ordem_id = self.db.execute_query(
+                        "INSERT INTO ordens_montagem (kit_id, localizacao_id, tipo, quantidade, data) VALUES (?, ?, ?, ?, ?)",
+                        (kit_id, localizacao_id, tipo, quantidade, agora.isoformat()))
+                    rotulo = f"{tipo.capitalize()} #{ordem_id}"
+                    movimentos = [(kit_id, localizacao_id, sinal * quantidade, rotulo)]
+                    movimentos += [(folha.id, localizacao_id, -sinal * qtd * quantidade, rotulo) for folha, qtd in folhas]
+                    self._postar_movimentos(movimentos, agora)
+            except sqlite3.IntegrityError:
+                raise ValueError(f"Estoque insuficiente em '{localizacao.nome}' para a {tipo} de '{kit.nome}'.")
+
+        ordem = OrdemMontagem(ordem_id, self._produto_do_documento(kit_id), localizacao, tipo, quantidade, agora)
+        self.ordens_montagem[ordem_id] = ordem
+        return ordem
+    #endregion
+
+    #region Reservas de estoque
+    def _expirar_reservas(self):
+        """Tira as reservas vencidas do topo do heap (chamar com a _trava_reservas pega)."""
+        agora = monotonic()
+        while self._expiracao_reservas and self._expiracao_reservas[0][0] <= agora:
+            _, token = heapq.heappop(self._expiracao_reservas)
+            # a reserva pode já ter sido confirmada ou liberada; aí a entrada do heap só é descartada
+            if reserva := self._reservas.pop(token, None):
+                self._descontar_reserva(reserva)
+
+    def _descontar_reserva(self, reserva: Reserva):
+        for p_id, qtd in reserva.debitos:
+            celula = (p_id, reserva.localizacao.id)
+            if self._reservado_por_celula[celula] > qtd:
+                self._reservado_por_celula[celula] -= qtd
+            else:
+                del self._reservado_por_celula[celula]
+
+    def _reservas_validas(self, tokens: list[str], localizacao_id: int) -> list[Reserva]:
+        """As reservas (ainda vivas) dos tokens que são daquela localização."""
+        with self._trava_reservas:
+            self._expirar_reservas()
+            return [r for t in dict.fromkeys(tokens) if (r := self._reservas.get(t)) and r.localizacao.id == localizacao_id]
+
+    @staticmethod
+    def _unidades_reservadas(reservas: list[Reserva]) -> Counter[int]:
+        unidades = Counter()
+        for reserva in reservas:
+            for p_id, qtd in reserva.debitos:
+                unidades[p_id] += qtd
+        return unidades
+
+    def _soltar_reservas(self, reservas: list[Reserva]):
+        with self._trava_reservas:
+            for reserva in reservas:
+                if self._reservas.pop(reserva.token, None):
+                    self._descontar_reserva(reserva)
+
+    def disponivel(self, produto_id: int, localizacao_id: int) -> int:
+        """Estoque que ainda pode ser vendido/transferido no local: o que tem menos o que está reservado."""
+        produto, localizacao = self.produtos.get(produto_id), self.localizacoes.get(localizacao_id)
+        if not all([produto, localizacao]):
+            raise ValueError("Produto ou Localização inválido.")
+        with self._trava_reservas:
+            self._expirar_reservas()
+        return Carrinho(localizacao, reservas_de_todos=self._reservado_por_celula).disponivel(produto)
+
+    def reservado(self, produto_id: int, localizacao_id: int) -> int:
+        """Unidades do produto individual reservadas no local."""
+        with self._trava_reservas:
+            self._expirar_reservas()
+            return self._reservado_por_celula.get((produto_id, localizacao_id), 0)
+
+    def reservar(self, produto_id: int, localizacao_id: int, quantidade: int, ttl: float = RESERVA_TTL_SEGUNDOS) -> str:
+        """
+        Separa 'quantidade' do produto (ou kit, separando os componentes) no local por 'ttl' segundos e devolve
+        o token da reserva. O estoque em si não muda, só o disponível; a reserva termina confirmada
+        (confirmar_reserva, ou passando o token pra venda/transferência), liberada ou expirada.
+        """
+        produto, localizacao = self.produtos.get(produto_id), self.localizacoes.get(localizacao_id)
+        if not all([produto, localizacao]):
+            raise ValueError("Produto ou Localização inválido.")
+        if ttl <= 0:
+            raise ValueError("O prazo da reserva deve ser positivo.")
+        celulas = [(p_id, localizacao_id) for p_id, _ in self._debitos_da_venda([{'produto_id': produto_id, 'quantidade': quantidade}])]
+        # as travas das células seguram quem vende ou reserva nelas enquanto o disponível é conferido
+        with self._travar_estoque(celulas), self._trava_reservas:
+            self._expirar_reservas()
+            # o carrinho de uma linha só faz a conta do disponível (e dá a mensagem certa pra kit ou individual)
+            # e decide o que sai de kits prontos e o que sai dos individuais
+            carrinho = Carrinho(localizacao, reservas_de_todos=self._reservado_por_celula)
+            carrinho.adicionar(produto, quantidade)
+            debitos = [(p.id, qtd) for p, qtd in carrinho.debitos_do_item(produto_id)]
+            reserva = Reserva(uuid.uuid4().hex, produto, localizacao, quantidade, debitos, monotonic() + ttl)
+            self._reservas[reserva.token] = reserva
+            for p_id, qtd in debitos:
+                self._reservado_por_celula[(p_id, localizacao_id)] += qtd
+            heapq.heappush(self._expiracao_reservas, (reserva.expira_em, reserva.token))
+        return reserva.token
+
+    def liberar_reserva(self, token: str) -> bool:
+        """Desfaz a reserva (False se ela não existe mais: já confirmada, liberada ou expirada)."""
+        with self._trava_reservas:
+            self._expirar_reservas()
+            if not (reserva := self._reservas.pop(token, None)):
+                return False
+            self._descontar_reserva(reserva)
+            return True
+
+    def confirmar_reserva(self, token: str, tipo_movimento: str = "Saída (Reserva)") -> list[Produto]:
+        """Transforma a reserva numa saída de estoque. Retorna os produtos que atingiram o ponto de ressuprimento."""
+        with self._trava_reservas:
+            self._expirar_reservas()
+            reserva = self._reservas.get(token)
+        if not reserva:
+            raise ValueError("Reserva não encontrada (já confirmada, liberada ou expirada).")
+        l_id = reserva.localizacao.id
+        with self._travar_estoque((p_id, l_id) for p_id, _ in reserva.debitos):
+            if not self._reservas_validas([token], l_id):
+                raise ValueError("Reserva não encontrada (já confirmada, liberada ou expirada).")
+            try:
+                alertas = self._postar_movimentos([(p_id, l_id, -qtd, tipo_movimento) for p_id, qtd in reserva.debitos])
+            except sqlite3.IntegrityError:
+                raise ValueError(f"Estoque insuficiente em '{reserva.localizacao.nome}' para confirmar a reserva.")
+            self._soltar_reservas([reserva])
+        return alertas
+
+    def listar_reservas(self) -> list[Reserva]:
+        """As reservas ainda vivas, das que expiram primeiro para as últimas."""
+        with self._trava_reservas:
+            self._expirar_reservas()
+            return sorted(self._reservas.values(), key=lambda r: r.expira_em)
+    #endregion
+
+    #region Busca de produtos por digitação (type-ahead)
+    def _textos_busca(self, nome: str, categoria: str, codigo_barras: str, descricao: str) -> tuple:
+        """o que entra no índice de busca de um produto (a descrição só quando o banco não tem o FTS5)"""
+        textos = (nome, categoria, codigo_barras if codigo_barras != "N/A" else None)
+        return textos if self.db.fts5_disponivel else textos + (descricao,)
+
+    def _indice_de_busca(self) -> IndiceBusca:
+        """O índice de busca, montado direto das linhas do banco na primeira vez (não precisa do catálogo em memória)."""
+        with self._trava_indice_busca:
+            if self._indice_busca is None:
+                indice = IndiceBusca()
+                linhas = self.db.execute_query("SELECT id, nome, categoria, codigo_barras, descricao FROM produtos", fetch='all') or []
+                indice.carregar((produto_id, *self._textos_busca(*campos)) for produto_id, *campos in linhas)
+                self._indice_busca = indice
+            return self._indice_busca
+
+    def _indexar_busca(self, produto: Produto):
+        # enquanto ninguém buscou, o índice não existe e não tem o que manter
+        if self._indice_busca is not None:
+            self._indice_busca.adicionar(produto.id, *self._textos_busca(
+                produto.nome, produto.categoria, produto.codigo_barras, produto.descricao))
+
+    def _desindexar_busca(self, produto_ids):
+        if self._indice_busca is not None:
+            for produto_id in produto_ids:
+                self._indice_busca.remover(produto_id)
+
+    def buscar_produtos(self, texto: str, limite: int = 10, filtro=None) -> list[Produto]:
+        """
+        Busca incremental de produtos: casa o começo (ou um pedaço) das palavras do nome, da categoria e do
+        código de barras, e tolera erro de digitação quando não acha nada melhor. Se ainda faltarem resultados,
+        completa com as descrições (FTS5). filtro(produto) restringe os candidatos (ex: só os que têm estoque).
+        """
+        def aceitar(produto_id: int) -> bool:
+            produto = self.produtos.get(produto_id)
+            return produto is not None and (filtro is None or filtro(produto))
+
+        ids = self._indice_de_busca().buscar(texto, limite, aceitar)
+        termos = normalizar(texto)
+        if len(ids) < limite and termos and self.db.fts5_disponivel:
+            # cada termo como prefixo entre aspas (os termos normalizados não têm a sintaxe do FTS5)
+            consulta = ' '.join(f'"{termo}"*' for termo in termos)
+            # com filtro nem todo resultado serve, então vêm alguns a mais
+            linhas = self.db.execute_query("SELECT rowid FROM produtos_fts WHERE produtos_fts MATCH ? ORDER BY rank LIMIT ?",
+                                           (consulta, limite * (10 if filtro else 1) + len(ids)), fetch='all') or []
+            vistos = set(ids)
+            for (produto_id,) in linhas:
+                if produto_id not in vistos and aceitar(produto_id):
+                    ids.append(produto_id)
+                    if len(ids) >= limite:
+                        break
+        return [self.produtos[produto_id] for produto_id in ids]
+
+    def contar_produtos(self, tipo: str | None = None, fornecedor_id: int | None = None, com_estoque: bool = False,
+                        localizacao_id: int | None = None, com_componentes: bool = False) -> int:
+        """
+        Quantos produtos atendem aos filtros (combinados com AND), contado no banco pelos índices, sem passar
+        pelo catálogo: serve pra saber se há o que oferecer antes de abrir a busca. com_estoque olha o estoque
+        físico (de kit, os já montados), só na localização se ela for informada.
+        """
+        self.sincronizar_escrita()
+        condicoes, params = [], []
+        if tipo:
+            condicoes.append("p.tipo_produto = ?")
+            params.append(tipo)
+        if fornecedor_id is not None:
+            condicoes.append("p.fornecedor_id = ?")
+            params.append(fornecedor_id)
+        if com_estoque:
+            no_local = " AND e.localizacao_id = ?" if localizacao_id is not None else ""
+            condicoes.append(f"EXISTS (SELECT 1 FROM estoque e WHERE e.produto_id = p.id AND e.quantidade > 0{no_local})")
+            params += [localizacao_id] if localizacao_id is not None else []
+        if com_componentes:
+            condicoes.append("EXISTS (SELECT 1 FROM componentes_kit c WHERE c.kit_produto_id = p.id)")
+        where = f" WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        row = self.db.execute_query(f"SELECT COUNT(*) FROM produtos p{where}", tuple(params), fetch='one')
+        return row[0] if row else 0
+    #endregion
+
+    #region Listagens paginadas (por cursor)
+    def _paginar(self, tabela: str, montar, limite: int, depois_de: int | None = None, antes_de: int | None = None,
+                 ordenacao: str = 'id', decrescente: bool = False, condicoes: list[str] | None = None,
+                 params: list | None = None, colunas: str = "id") -> Pagina:
+        """
+        Paginação por cursor (keyset): em vez de OFFSET, a página continua a partir do último id visto
+        ("WHERE (chave) > (cursor) ORDER BY chave LIMIT n"), então pelo índice cada página custa o tamanho dela,
+        não importa quão longe esteja na lista. A chave é (ordenacao, id), pra desempatar nomes repetidos.
+        'montar' transforma cada linha (as 'colunas' do SELECT, a primeira é o id) no objeto da página (None = pula);
+        o cursor da página são os ids da primeira e da última linha lida, tenham virado item ou não.
+        """
+        if limite < 1:
+            raise ValueError("O tamanho da página deve ser pelo menos 1.")
+        if depois_de is not None and antes_de is not None:
+            raise ValueError("Informe só um cursor: depois_de ou antes_de.")
+        condicoes, params = list(condicoes or []), list(params or [])
+        chave = ["id"] if ordenacao == 'id' else [ordenacao, "id"]
+        cursor = depois_de if depois_de is not None else antes_de
+        para_tras = antes_de is not None
+        # indo pra trás, a consulta anda ao contrário e a página é desvirada no fim
+        sentido_desc = decrescente != para_tras
+        if cursor is not None:
+            valores = [cursor]
+            if ordenacao != 'id':
+                row = self.db.execute_query(f"SELECT {ordenacao} FROM {tabela} WHERE id = ?", (cursor,), fetch='one')
+                if not row:
+                    raise ValueError(f"Cursor inválido: registro {cursor} não encontrado.")
+                valores = [row[0], cursor]
+            condicoes.append(f"({', '.join(chave)}) {'<' if sentido_desc else '>'} ({', '.join('?' * len(valores))})")
+            params.extend(valores)
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        ordem = ", ".join(f"{c} {'DESC' if sentido_desc else 'ASC'}" for c in chave)
+        # uma linha a mais só pra saber se tem mais página depois desta
+        rows = self.db.execute_query(f"SELECT {colunas} FROM {tabela} {where} ORDER BY {ordem} LIMIT ?",
+                                     (*params, limite + 1), fetch='all') or []
+        tem_mais = len(rows) > limite
+        rows = rows[:limite]
+        if para_tras:
+            rows.reverse()
+        itens = [item for row in rows if (item := montar(row)) is not None]
+        pontas = {'id_inicio': rows[0][0], 'id_fim': rows[-1][0]} if rows else {}
+        if para_tras:
+            return Pagina(itens, tem_anterior=tem_mais, tem_proxima=True, **pontas)
+        return Pagina(itens, tem_anterior=cursor is not None, tem_proxima=tem_mais, **pontas)
+
+    def listar_produtos(self, depois_de: int | None = None, limite: int = 20, filtro: str | None = None,
+                        ordenacao: str = 'id', antes_de: int | None = None) -> Pagina:
+        """
+        Uma página de produtos. 'filtro' procura no nome, na categoria e no código de barras;
+        'ordenacao' é 'id' ou 'nome'. Pra navegar, passe o ultimo_id da página como 'depois_de'
+        (ou o primeiro_id como 'antes_de', pra voltar).
+        """
+        if ordenacao not in ('id', 'nome'):
+            raise ValueError("Ordenação inválida. Use 'id' ou 'nome'.")
+        condicoes, params = [], []
+        if filtro:
+            condicoes.append("(nome LIKE ? OR categoria LIKE ? OR codigo_barras LIKE ?)")
+            params.extend([f"%{filtro}%"] * 3)
+        return self._paginar("produtos", lambda row: self.produtos.get(row[0]), limite, depois_de, antes_de,
+                             ordenacao, condicoes=condicoes, params=params)
+
+    @staticmethod
+    def _ordenacao_documentos(ordenacao: str) -> bool:
+        """documentos (OCs, vendas, devoluções, movimentos) saem dos mais recentes pros mais antigos por padrão"""
+        if ordenacao not in ('recentes', 'antigos'):
+            raise ValueError("Ordenação inválida. Use 'recentes' ou 'antigos'.")
+        return ordenacao == 'recentes'
+
+    def listar_ordens_compra(self, depois_de: int | None = None, limite: int = 20, status: str | None = None,
+                             fornecedor_id: int | None = None, ordenacao: str = 'recentes', antes_de: int | None = None) -> Pagina:
+        """Uma página de ordens de compra, opcionalmente só de um status e/ou fornecedor."""
+        condicoes, params = [], []
+        if status:
+            condicoes.append("status = ?")
+            params.append(status)
+        if fornecedor_id is not None:
+            condicoes.append("fornecedor_id = ?")
+            params.append(fornecedor_id)
+        return self._paginar("ordens_compra", lambda row: self.ordens_compra.get(row[0]), limite, depois_de, antes_de,
+                             decrescente=self._ordenacao_documentos(ordenacao), condicoes=condicoes, params=params)
+
+    def listar_vendas(self, depois_de: int | None = None, limite: int = 20, cliente: str | None = None,
+                      ordenacao: str = 'recentes', antes_de: int | None = None) -> Pagina:
+        """Uma página de vendas, opcionalmente filtrando pelo nome do cliente (trecho do nome)."""
+        condicoes, params = [], []
+        if cliente:
+            condicoes.append("cliente_nome LIKE ?")
+            params.append(f"%{cliente}%")
+        return self._paginar("vendas", lambda row: self.vendas.get(row[0]), limite, depois_de, antes_de,
+                             decrescente=self._ordenacao_documentos(ordenacao), condicoes=condicoes, params=params)
+
+    def listar_devolucoes(self, depois_de: int | None = None, limite: int = 20, status: str | None = None,
+                          ordenacao: str = 'recentes', antes_de: int | None = None) -> Pagina:
+        """Uma página de devoluções, opcionalmente só de um status."""
+        condicoes, params = [], []
+        if status:
+            condicoes.append("status = ?")
+            params.append(status)
+        return self._paginar("devolucoes", lambda row: self.devolucoes.get(row[0]), limite, depois_de, antes_de,
+                             decrescente=self._ordenacao_documentos(ordenacao), condicoes=condicoes, params=params)
+
+    def listar_transferencias(self, depois_de: int | None = None, limite: int = 20, status: str | None = None,
+                              ordenacao: str = 'recentes', antes_de: int | None = None) -> Pagina:
+        """Uma página de documentos de transferência, opcionalmente só de um status."""
+        condicoes, params = [], []
+        if status:
+            condicoes.append("status = ?")
+            params.append(status)
+        return self._paginar("transferencias", lambda row: self.transferencias.get(row[0]), limite, depois_de, antes_de,
+                             decrescente=self._ordenacao_documentos(ordenacao), condicoes=condicoes, params=params)
+
+    def listar_ordens_montagem(self, depois_de: int | None = None, limite: int = 20, kit_id: int | None = None,
+                               ordenacao: str = 'recentes', antes_de: int | None = None) -> Pagina:
+        """Uma página de ordens de montagem/desmontagem, opcionalmente só de um kit."""
+        condicoes, params = [], []
+        if kit_id is not None:
+            condicoes.append("kit_id = ?")
+            params.append(kit_id)
+        return self._paginar("ordens_montagem", lambda row: self.ordens_montagem.get(row[0]), limite, depois_de, antes_de,
+                             decrescente=self._ordenacao_documentos(ordenacao), condicoes=condicoes, params=params)
+
+    def listar_movimentos(self, depois_de: int | None = None, limite: int = 50, produto_id: int | None = None,
+                          localizacao_id: int | None = None, tipo: str | None = None, ordenacao: str = 'recentes',
+                          antes_de: int | None = None) -> Pagina:
+        """
+        Uma página do histórico de movimentações (só o que ainda não foi arquivado), direto do banco.
+        Os movimentos da página vêm com o 'id' preenchido, que é o cursor.
+        """
+        self.sincronizar_escrita()
+        condicoes, params = [], []
+        for coluna, valor in (("produto_id", produto_id), ("localizacao_id", localizacao_id), ("tipo", tipo)):
+            if valor is not None:
+                condicoes.append(f"{coluna} = ?")
+                params.append(valor)
+
+        def montar(row):
+            mov_id, p_id, l_id, tipo_mov, qtd, data_str = row
+            if (produto := self.produtos.get(p_id)) and (localizacao := self.localizacoes.get(l_id)):
+                return HistoricoMovimento(produto, tipo_mov, qtd, localizacao, datetime.fromisoformat(data_str), mov_id)
+            return None
+
+        return self._paginar("historico_movimentos", montar, limite, depois_de, antes_de,
+                             decrescente=self._ordenacao_documentos(ordenacao), condicoes=condicoes, params=params,
+                             colunas="id, produto_id, localizacao_id, tipo, quantidade, data")
+    #endregion
+
+    #region Feed de eventos (outbox)
+    def _registrar_eventos(self, eventos: list[tuple[str, int | None, dict]], data: datetime | None = None):
+        """Grava (tipo, entidade_id, dados) no feed de eventos. Chamar dentro da transação da mudança que eles descrevem."""
+        data_str = (data or datetime.now()).isoformat()
+        self.db.execute_many("INSERT INTO eventos (tipo, entidade_id, dados, data) VALUES (?, ?, ?, ?)",
+                             [(tipo, entidade_id, json.dumps(dados, ensure_ascii=False), data_str) for tipo, entidade_id, dados in eventos])
+
+    def ler_eventos(self, consumidor: str, limite: int = 500) -> list[Evento]:
+        """
+        Lê os próximos eventos depois do cursor do consumidor (no máximo 'limite'), em ordem.
+        Não mexe no cursor: depois de processar, o consumidor chama confirmar_eventos com o id do último.
+        Um consumidor novo é registrado começando do início do feed (quem lê de várias threads, como o servidor,
+        registra antes pelo caminho de escrita com registrar_consumidor_eventos, e aqui fica só a leitura).
+        """
+        self.registrar_consumidor_eventos(consumidor)
+        rows = self.db.execute_query(
+            """SELECT id, tipo, entidade_id, dados, data FROM eventos
+               WHERE id > (SELECT cursor FROM consumidores_eventos WHERE nome = ?) ORDER BY id LIMIT ?""",
+            (consumidor, limite), fetch='all') or []
+        return [Evento(e_id, tipo, entidade_id, json.loads(dados), datetime.fromisoformat(data_str))
+                for e_id, tipo, entidade_id, dados, data_str in rows]
+
+    def registrar_consumidor_eventos(self, consumidor: str):
+        """Registra o consumidor (começando do início do feed) se ele ainda não existe. É uma escrita só na primeira vez."""
+        if not consumidor:
+            raise ValueError("Informe o nome do consumidor.")
+        if consumidor in self._consumidores_eventos:
+            return
+        self.db.execute_query("INSERT OR IGNORE INTO consumidores_eventos (nome, cursor, atualizado_em) VALUES (?, 0, ?)",
+                              (consumidor, datetime.now().isoformat()))
+        self._consumidores_eventos.add(consumidor)
+
+    def confirmar_eventos(self, consumidor: str, ate_id: int) -> int:
+        """
+        Avança o cursor do consumidor até 'ate_id' (o cursor nunca volta) e retorna o cursor que ficou. Um 'ate_id'
+        além do último evento gravado vira o último evento: senão o consumidor pularia, sem ler, os eventos que ainda vão ser gravados.
+        """
+        # o sqlite_sequence guarda o maior id já usado (vale mesmo se os eventos foram todos compactados)
+        cursor = self.db.execute_query(
+            """INSERT INTO consumidores_eventos (nome, cursor, atualizado_em)
+               VALUES (?, MIN(?, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'eventos'), 0)), ?)
+               ON CONFLICT(nome) DO UPDATE SET cursor = MAX(cursor, excluded.cursor), atualizado_em = excluded.atualizado_em
+               RETURNING cursor""",
+            (consumidor, ate_id, datetime.now().isoformat()), fetch='one')
+        self._consumidores_eventos.add(consumidor)
+        return cursor[0]
+
+    def listar_consumidores_eventos(self) -> list[tuple[str, int, int]]:
+        """(nome, cursor, eventos pendentes) de cada consumidor registrado."""
+        return self.db.execute_query(
+            """SELECT c.nome, c.cursor, (SELECT COUNT(*) FROM eventos e WHERE e.id > c.cursor)
+               FROM consumidores_eventos c ORDER BY c.nome""", fetch='all') or []
+
+    def remover_consumidor_eventos(self, consumidor: str) -> bool:
+        """Esquece um consumidor (os eventos que só ele não tinha lido passam a poder ser compactados)."""
+        existe = self.db.execute_query("SELECT 1 FROM consumidores_eventos WHERE nome = ?", (consumidor,), fetch='one')
+        if existe:
+            self.db.execute_query("DELETE FROM consumidores_eventos WHERE nome = ?", (consumidor,))
+        self._consumidores_eventos.discard(consumidor)
+        return bool(existe)
+
+    def compactar_eventos(self) -> int:
+        """
+        Apaga os eventos que todos os consumidores registrados já confirmaram.
+        Sem nenhum consumidor registrado, nada é apagado. Retorna quantos eventos saíram.
+        """
+        with self.db.transacao():
+            row = self.db.execute_query("SELECT MIN(cursor) FROM consumidores_eventos", fetch='one')
+            if not row or row[0] is None:
+                return 0
+            antes = self.db.execute_query("SELECT COUNT(*) FROM eventos WHERE id <= ?", (row[0],), fetch='one')[0]
+            self.db.execute_query("DELETE FROM eventos WHERE id <= ?", (row[0],))
+        return antes
+    #endregion
+
+    #region Escrita adiada (write-behind)
+    @property
+    def _arquivo_diario_escrita(self) -> str:
+        return f"{self.db.db_file}.diario"
+
+    def _reaplicar_diario_escrita(self, verboso: bool = True) -> int:
+        """
+        Reaplica no banco os movimentos do diário da escrita adiada que não chegaram a ser gravados
+        (o programa caiu antes do commit). Retorna quantos foram reaplicados e zera o diário.
+        """
+        registros = ler_diario(self._arquivo_diario_escrita)
+        if not registros:
+            return 0
+        row = self.db.execute_query("SELECT ultimo_seq FROM escrita_adiada WHERE id = 1", fetch='one')
+        pendentes = [r for r in registros if r[0] > (row[0] if row else 0)]
+        reaplicados = 0
+        if pendentes:
+            try:
+                self._gravar_lote_adiado([tuple(r[1:]) for r in pendentes], pendentes[-1][0])
+                reaplicados = len(pendentes)
+            except sqlite3.IntegrityError:
+                # algum movimento deixaria saldo negativo: reaplica um por um e descarta só os recusados
+                for registro in pendentes:
+                    try:
+                        self._gravar_lote_adiado([tuple(registro[1:])], registro[0])
+                        reaplicados += 1
+                    except sqlite3.IntegrityError:
+                        print(f"Aviso: movimento do diário descartado (saldo ficaria negativo): {registro}")
+            if verboso:
+                print(f"{reaplicados} movimento(s) pendente(s) da escrita adiada reaplicado(s) no banco.")
+        os.truncate(self._arquivo_diario_escrita, 0)
+        return reaplicados
+
+    def _iniciar_escrita_adiada(self):
+        row = self.db.execute_query("SELECT ultimo_seq FROM escrita_adiada WHERE id = 1", fetch='one')
+        # a contagem pro checkpoint fica fora do gravar_lote: o que acontece depois do commit não pode derrubar a fila
+        self._fila_escrita = FilaEscrita(self._gravar_lote_adiado, self._arquivo_diario_escrita, ultimo_seq=row[0] if row else 0,
+                                         depois_de_gravar=self._contabilizar_movimentos)
+
+    def _gravar_lote_adiado(self, registros: list[tuple[int, int, int, str, str]], ultimo_seq: int):
+        """Grava um lote de movimentos da escrita adiada num commit só, junto com o último seq do diário."""
+        with self.db.transacao():
+            self._gravar_movimentos_datados(registros)
+            self.db.execute_query("""INSERT INTO escrita_adiada (id, ultimo_seq) VALUES (1, ?)
+                                     ON CONFLICT(id) DO UPDATE SET ultimo_seq = excluded.ultimo_seq""", (ultimo_seq,))
+
+    def _movimentar_estoque_adiado(self, produto: Produto, localizacao: Localizacao, quantidade: int, tipo_movimento: str):
+        """movimentar_estoque com a escrita adiada: valida com a memória, atualiza a memória e enfileira a gravação"""
+        celula = (produto.id, localizacao.id)
+        with self._travar_estoque([celula], sincronizar=False):
+            saldo = produto.estoque_por_local.get(localizacao.nome, 0)
+            # aqui não tem o trigger do banco pra segurar: a memória é quem diz se tem estoque
+            if saldo + quantidade < 0:
+                raise ValueError(f"Estoque insuficiente de '{produto.nome}' em '{localizacao.nome}'.")
+            estoque_anterior = produto.get_estoque_total()
+            agora = datetime.now()
+            self._seq_escrita_por_celula[celula] = self._fila_escrita.enfileirar(
+                (produto.id, localizacao.id, quantidade, tipo_movimento, agora.isoformat()))
+            with self._trava_estoque_memoria:
+                produto.estoque_por_local[localizacao.nome] = saldo + quantidade
+            self._invalidar_kits([celula])
+            self.historico.append(HistoricoMovimento(produto, tipo_movimento, quantidade, localizacao, agora))
+
+        atingiu_ponto = estoque_anterior > produto.ponto_ressuprimento >= produto.get_estoque_total()
+        return True, (produto if atingiu_ponto else None)
+
+    def sincronizar_escrita(self, timeout: float | None = None) -> bool:
+        """
+        Barreira da escrita adiada: espera tudo o que já foi movimentado estar confirmado no banco
+        (ex: antes de imprimir um comprovante). Sem a escrita adiada, retorna na hora.
+        """
+        return self._fila_escrita.aguardar(timeout=timeout) if self._fila_escrita else True
+
+    def encerrar(self):
+        """
+        Grava o que estiver pendente na fila da escrita adiada e para as threads da escrita adiada e dos
+        checkpoints (chamar antes de fechar o banco).
+        """
+        self._parar_thread_checkpoint()
+        if self._fila_escrita:
+            fila, self._fila_escrita = self._fila_escrita, None
+            fila.parar()
+    #endregion
+
+    #region Consistência do estoque
+    def verificar_consistencia_estoque(self) -> list[tuple[int, int, int, int]]:
+        """
+        Compara, direto no SQL, o saldo gravado em 'estoque' com a soma do histórico de movimentos.
+        Retorna uma lista de (produto_id, localizacao_id, qtd_estoque, qtd_historico) para cada célula divergente.
+        """
+        self.sincronizar_escrita()
+        query = """
+        WITH historico AS (
+            SELECT produto_id, localizacao_id, SUM(quantidade) AS quantidade FROM (
+                SELECT produto_id, localizacao_id, quantidade FROM historico_movimentos
+                UNION ALL
+                SELECT produto_id, localizacao_id, quantidade FROM resumo_movimentos_mensal
+            ) GROUP BY produto_id, localizacao_id
+        ), celulas AS (
+            SELECT produto_id, localizacao_id FROM estoque
+            UNION
+            SELECT produto_id, localizacao_id FROM historico
+        )
+        SELECT c.produto_id, c.localizacao_id, COALESCE(e.quantidade, 0), COALESCE(h.quantidade, 0)
+        FROM celulas c
+        LEFT JOIN estoque e ON e.produto_id = c.produto_id AND e.localizacao_id = c.localizacao_id
+        LEFT JOIN historico h ON h.produto_id = c.produto_id AND h.localizacao_id = c.localizacao_id
+        WHERE COALESCE(e.quantidade, 0) != COALESCE(h.quantidade, 0)
+        ORDER BY c.produto_id, c.localizacao_id
+        """
+        return self.db.execute_query(query, fetch='all') or []
+
+    def reconstruir_estoque_do_historico(self, processos: int | None = None) -> int:
+        """
+        Reconstrói a tabela 'estoque' a partir do histórico de movimentos.
+        O histórico é dividido em faixas de produto_id somadas em paralelo (um processo por faixa),
+        e a tabela é reescrita numa transação só. Retorna a quantidade de células gravadas.
+        """
+        self.sincronizar_escrita()
+        processos = processos or os.cpu_count() or 1
+        limites = self.db.execute_query("""SELECT MIN(produto_id), MAX(produto_id) FROM (
+                                               SELECT produto_id FROM historico_movimentos
+                                               UNION ALL SELECT produto_id FROM resumo_movimentos_mensal)""", fetch='one')
+        saldos = []
+        if limites and limites[0] is not None:
+            id_min, id_max = limites
+            tamanho_faixa = max(1, (id_max - id_min + processos) // processos)
+            faixas = [(inicio, min(inicio + tamanho_faixa - 1, id_max)) for inicio in range(id_min, id_max + 1, tamanho_faixa)]
+            if self.db.em_memoria:
+                # o banco em memória só existe neste processo: soma tudo aqui mesmo
+                saldos = self.db.execute_query(_QUERY_SOMA_FAIXA, (id_min, id_max, id_min, id_max), fetch='all') or []
+            elif len(faixas) == 1:
+                saldos = _somar_movimentos_faixa(self.db.db_file, *faixas[0])
+            else:
+                with ProcessPoolExecutor(max_workers=len(faixas)) as executor:
+                    futuros = [executor.submit(_somar_movimentos_faixa, self.db.db_file, inicio, fim) for inicio, fim in faixas]
+                    for futuro in futuros:
+                        saldos.extend(futuro.result())
+
+        try:
+            with self.db.transacao():
+                self.db.execute_query("DELETE FROM estoque")
+                self.db.execute_many("INSERT INTO estoque (produto_id, localizacao_id, quantidade) VALUES (?, ?, ?)", saldos)
+        except sqlite3.IntegrityError:
+            raise ValueError("O histórico resulta em saldo negativo para algum produto. O estoque não foi alterado.")
+
+        self._recarregar_estoque_em_memoria()
+        return len(saldos)
+    #endregion
+
+    #region Checkpoints e estoque em uma data
+    def _contabilizar_movimentos(self, quantidade_movimentos: int):
+        """
+        Conta as movimentações gravadas e, quando passar do limite (ou do intervalo de tempo), pede um checkpoint
+        para a thread de checkpoints. Não mexe no banco: só conta, então pode ser chamado de dentro de uma transação.
+        """
+        with self._trava_checkpoint:
+            self._movimentos_desde_checkpoint += quantidade_movimentos
+            intervalo_vencido = (self._data_ultimo_checkpoint is None or
+                                 datetime.now() - self._data_ultimo_checkpoint >= timedelta(hours=CHECKPOINT_INTERVALO_HORAS))
+            if not (self._movimentos_desde_checkpoint >= CHECKPOINT_A_CADA_MOVIMENTOS or intervalo_vencido):
+                return
+            if self._parar_checkpoints:
+                return
+            if self._thread_checkpoint is None:
+                self._thread_checkpoint = threading.Thread(target=self._gravar_checkpoints, name="checkpoint-estoque", daemon=True)
+                self._thread_checkpoint.start()
+        self._pedido_checkpoint.set()
+
+    def _gravar_checkpoints(self):
+        """Corpo da thread de checkpoints: espera um pedido e grava. Um erro aqui só vira aviso (tenta de novo no próximo pedido)."""
+        while True:
+            self._pedido_checkpoint.wait()
+            self._pedido_checkpoint.clear()
+            if self._parar_checkpoints:
+                return
+            try:
+                self.criar_checkpoint_estoque()
+            except Exception as e:
+                print(f"Aviso: não foi possível gravar o checkpoint do estoque: {e}")
+
+    def _parar_thread_checkpoint(self):
+        with self._trava_checkpoint:
+            self._parar_checkpoints = True
+            thread, self._thread_checkpoint = self._thread_checkpoint, None
+        if thread:
+            self._pedido_checkpoint.set()
+            thread.join()
+
+    def criar_checkpoint_estoque(self) -> int:
+        """
+        Grava uma fotografia da matriz produto x localização, amarrada ao último movimento do histórico,
+        e apaga os checkpoints mais velhos que os CHECKPOINT_RETENCAO últimos.
+        """
+        agora = datetime.now()
+        with self.db.transacao():
+            row = self.db.execute_query("SELECT COALESCE(MAX(id), 0) FROM historico_movimentos", fetch='one')
+            checkpoint_id = self.db.execute_query("INSERT INTO checkpoints_estoque (data, ultimo_movimento_id) VALUES (?, ?)",
+                                                  (agora.isoformat(), row[0]))
+            self.db.execute_query("""INSERT INTO itens_checkpoint_estoque (checkpoint_id, produto_id, localizacao_id, quantidade)
+                                     SELECT ?, produto_id, localizacao_id, quantidade FROM estoque WHERE quantidade != 0""",
+                                  (checkpoint_id,))
+            # os itens saem junto (ON DELETE CASCADE)
+            self.db.execute_query("""DELETE FROM checkpoints_estoque WHERE id NOT IN
+                                     (SELECT id FROM checkpoints_estoque ORDER BY id DESC LIMIT ?)""", (CHECKPOINT_RETENCAO,))
+            # os movimentos contados até aqui estão todos na fotografia (a trava vem depois da do banco: ver _travar_estoque)
+            with self._trava_checkpoint:
+                self._movimentos_desde_checkpoint = 0
+                self._data_ultimo_checkpoint = agora
+        return checkpoint_id
+
+    def estoque_em(self, data: datetime) -> dict[int, dict[str, int]]:
+        """
+        Retorna o estoque de cada produto por localização (mesmo formato de 'estoque_por_local') em uma data.
+        Parte do checkpoint mais próximo anterior à data e reaplica só os movimentos posteriores a ele.
+        """
+        self.sincronizar_escrita()
+        data_str = data.isoformat()
+        checkpoint = self.db.execute_query(
+            "SELECT id, ultimo_movimento_id FROM checkpoints_estoque WHERE data <= ? ORDER BY data DESC, id DESC LIMIT 1",
+            (data_str,), fetch='one')
+        checkpoint_id, ultimo_movimento_id = checkpoint if checkpoint else (None, 0)
+
+        query = """
+        SELECT produto_id, localizacao_id, SUM(quantidade) FROM (
+            SELECT produto_id, localizacao_id, quantidade FROM itens_checkpoint_estoque WHERE checkpoint_id = ?
+            UNION ALL
+            SELECT produto_id, localizacao_id, quantidade FROM historico_movimentos WHERE id > ? AND data <= ?
+        ) GROUP BY produto_id, localizacao_id
+        """
+        saldos = Counter()
+        for produto_id, localizacao_id, qtd in self.db.execute_query(query, (checkpoint_id, ultimo_movimento_id, data_str), fetch='all') or []:
+            saldos[(produto_id, localizacao_id)] += qtd
+        # movimentos entre o checkpoint e a data que já foram para o arquivo
+        for _, produto_id, localizacao_id, _, qtd, data_mov in self._movimentos_arquivados(apos_id=ultimo_movimento_id, ate_mes=data_str[:7]):
+            if data_mov <= data_str:
+                saldos[(produto_id, localizacao_id)] += qtd
+
+        estoque = {}
+        for (produto_id, localizacao_id), qtd in saldos.items():
+            if qtd and (localizacao := self.localizacoes.get(localizacao_id)):
+                estoque.setdefault(produto_id, {})[localizacao.nome] = qtd
+        return estoque
+
+    def gerar_relatorio_valor_estoque_em(self, data: datetime) -> str:
+        """Gera a valoração do inventário em uma data passada (quantidades da data x preço de compra atual)."""
+        estoque = self.estoque_em(data)
+        report = f"""RELATÓRIO DE VALOR DO INVENTÁRIO EM {data.strftime('%d/%m/%Y %H:%M')}
+Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
+(Quantidades da data informada, valoradas pelo preço de compra atual)
+{'='*80}\n
+"""
+        valor_total = 0.0
+        linhas = []
+        for produto_id, por_local in estoque.items():
+            if not (produto := self.produtos.get(produto_id)):
+                continue
+            qtd_total = sum(por_local.values())
+            valor = qtd_total * produto.preco_compra
+            valor_total += valor
+            locais = ", ".join(f"{local}: {qtd}" for local, qtd in sorted(por_local.items()))
+            linhas.append((produto.nome, f"ID: {produto.id} - {produto.nome} | Qtd: {qtd_total} | Valor: R$ {valor:,.2f}\n   Por local: {locais}\n"))
+
+        if not linhas:
+            return report + "Nenhum estoque registrado nesta data."
+        for _, linha in sorted(linhas):
+            report += linha
+        report += f"\n{'-'*30}\nValor Total na Data: R$ {valor_total:,.2f}\n"
+        return report
+    #endregion
+
+    #region Arquivamento do histórico
+    def _movimentos_arquivados(self, apos_id: int = 0, ate_mes: str | None = None):
+        """
+        Gera (id, produto_id, localizacao_id, tipo, quantidade, data) dos movimentos que estão no banco de arquivo,
+        descompactando só os lotes mensais que podem conter movimentos depois de 'apos_id' (e até 'ate_mes', 'AAAA-MM').
+        """
+        if not self.db.arquivo_file:
+            return
+        query = "SELECT dados FROM arquivo.lotes_movimentos WHERE ultimo_movimento_id > ?"
+        params = [apos_id]
+        if ate_mes:
+            query += " AND mes <= ?"
+            params.append(ate_mes)
+        for (dados,) in self.db.execute_query(query + " ORDER BY primeiro_movimento_id", tuple(params), fetch='all') or []:
+            for movimento in json.loads(zlib.decompress(dados)):
+                if movimento[0] > apos_id:
+                    yield tuple(movimento)
+
+    def _historico_completo(self, produto_id: int | None = None, fornecedor_id: int | None = None,
+                            localizacao_id: int | None = None) -> list[HistoricoMovimento]:
+        """
+        Histórico (em memória, ou do banco no catálogo sob demanda) somado aos movimentos arquivados, para os
+        relatórios de movimentação; os filtros (combinados com AND) deixam só os movimentos que interessam.
+        """
+        produtos_do_fornecedor = None
+        if fornecedor_id is not None:
+            produtos_do_fornecedor = {p_id for (p_id,) in self.db.execute_query(
+                "SELECT id FROM produtos WHERE fornecedor_id = ?", (fornecedor_id,), fetch='all') or []}
+
+        def serve(p_id: int, l_id: int) -> bool:
+            return ((produto_id is None or p_id == produto_id) and (localizacao_id is None or l_id == localizacao_id)
+                    and (produtos_do_fornecedor is None or p_id in produtos_do_fornecedor))
+
+        movimentos = []
+        for _, p_id, l_id, tipo, qtd, data_str in self._movimentos_arquivados():
+            if serve(p_id, l_id) and (produto := self._produto_do_documento(p_id)) and (localizacao := self.localizacoes.get(l_id)):
+                movimentos.append(HistoricoMovimento(produto, tipo, qtd, localizacao, datetime.fromisoformat(data_str)))
+        if not self._catalogo_sob_demanda:
+            return movimentos + [m for m in self.historico if serve(m.produto.id, m.localizacao.id)]
+
+        # o banco filtra pelos índices do histórico; os produtos vêm como referência
+        condicoes, params = [], []
+        if produto_id is not None:
+            condicoes.append("produto_id = ?")
+            params.append(produto_id)
+        if fornecedor_id is not None:
+            condicoes.append("produto_id IN (SELECT id FROM produtos WHERE fornecedor_id = ?)")
+            params.append(fornecedor_id)
+        if localizacao_id is not None:
+            condicoes.append("localizacao_id = ?")
+            params.append(localizacao_id)
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        for p_id, l_id, tipo, qtd, data_str in self.db.execute_query(
+                f"SELECT produto_id, localizacao_id, tipo, quantidade, data FROM historico_movimentos {where} ORDER BY id",
+                tuple(params), fetch='all') or []:
+            if (produto := self._produto_do_documento(p_id)) and (localizacao := self.localizacoes.get(l_id)):
+                movimentos.append(HistoricoMovimento(produto, tipo, qtd, localizacao, datetime.fromisoformat(data_str)))
+        return movimentos
+
+    def arquivar_movimentos(self, horizonte_dias: int = HORIZONTE_ARQUIVAMENTO_DIAS) -> int:
+        """
+        Move para o banco de arquivo os movimentos dos meses (inteiros) mais antigos que o horizonte.
+        Cada mês vira um lote compactado, e o resumo mensal por produto/local fica no banco principal,
+        então as somas do histórico (consistência, reconstrução, estoque em uma data) continuam batendo.
+        Retorna quantos movimentos foram arquivados.
+        """
+        if not self.db.arquivo_file:
+            raise ValueError("Nenhum banco de arquivo configurado.")
+        self.sincronizar_escrita()
+        data_horizonte = datetime.now() - timedelta(days=horizonte_dias)
+        # corta no primeiro dia do mês do horizonte, para só arquivar meses fechados
+        limite = data_horizonte.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
+
+        rows = self.db.execute_query(
+            "SELECT id, produto_id, localizacao_id, tipo, quantidade, data FROM historico_movimentos WHERE data < ? ORDER BY id",
+            (limite,), fetch='all') or []
+        if not rows:
+            return 0
+
+        lotes: dict[str, list] = {}
+        for row in rows:
+            lotes.setdefault(row[5][:7], []).append(row)
+
+        with self.db.transacao():
+            self.db.execute_many(
+                """INSERT INTO arquivo.lotes_movimentos (mes, quantidade_movimentos, primeiro_movimento_id, ultimo_movimento_id, dados)
+                   VALUES (?, ?, ?, ?, ?)""",
+                [(mes, len(movs), movs[0][0], movs[-1][0], zlib.compress(json.dumps(movs).encode('utf-8')))
+                 for mes, movs in lotes.items()])
+            self.db.execute_query("""
+                INSERT INTO resumo_movimentos_mensal (mes, produto_id, localizacao_id, quantidade, quantidade_movimentos)
+                SELECT substr(data, 1, 7), produto_id, localizacao_id, SUM(quantidade), COUNT(*)
+                FROM historico_movimentos WHERE data < ? GROUP BY substr(data, 1, 7), produto_id, localizacao_id
+                ON CONFLICT(mes, produto_id, localizacao_id) DO UPDATE SET
+                    quantidade = quantidade + excluded.quantidade,
+                    quantidade_movimentos = quantidade_movimentos + excluded.quantidade_movimentos
+            """, (limite,))
+            self.db.execute_query("DELETE FROM historico_movimentos WHERE data < ?", (limite,))
+
+        limite_dt = datetime.fromisoformat(limite)
+        self.historico = [m for m in self.historico if m.data >= limite_dt]
+        return len(rows)
+    #endregion
 
     #region Reports
     def verificar_alertas_ressuprimento(self):
         """Retorna uma lista de produtos cujo estoque total está no ponto de ressuprimento ou abaixo."""
         # Alertas só se aplicam a produtos individuais com estoque físico.
+        if self._catalogo_sob_demanda:
+            # o banco acha quem está no ponto; só esses são carregados
+            rows = self.db.execute_query("""SELECT p.id FROM produtos p LEFT JOIN estoque e ON e.produto_id = p.id
+                                            WHERE p.tipo_produto = 'individual' GROUP BY p.id
+                                            HAVING COALESCE(SUM(e.quantidade), 0) <= p.ponto_ressuprimento ORDER BY p.id""", fetch='all') or []
+            return [p for (p_id,) in rows if (p := self.produtos.get(p_id))]
         return [p for p in self.produtos.values() if p.tipoProduto == 'individual' and p.get_estoque_total() <= p.ponto_ressuprimento]
 
     def calcular_valor_total_estoque(self):
-        """Calcula o valor total do inventário com base no preço de compra dos produtos individuais."""
-        return sum(p.get_estoque_total() * p.preco_compra for p in self.produtos.values() if p.tipoProduto == 'individual')
+        """Calcula o valor total do inventário com base no preço de compra dos produtos individuais e dos kits já montados."""
+        if self._catalogo_sob_demanda:
+            # na tabela de estoque o kit só tem os já montados, então é a mesma conta feita pelo banco
+            row = self.db.execute_query("""SELECT COALESCE(SUM(e.quantidade * p.preco_compra), 0)
+                                           FROM estoque e JOIN produtos p ON p.id = e.produto_id""", fetch='one')
+            return row[0] if row else 0
+        return sum((p.get_estoque_total() if p.tipoProduto == 'individual' else p.get_estoque_montado()) * p.preco_compra
+                   for p in self.produtos.values())
 
     def gerar_relatorio_estoque_simplificado(self):
         """Gera um relatório textual com o status do estoque de todos os produtos."""
@@ -554,11 +2708,19 @@ class GerenciadorEstoque:
 Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
 Valor Total do Estoque (Individuais): R$ {self.calcular_valor_total_estoque():.2f}
 {'='*80}\n\n"""
-        for produto in sorted(self.produtos.values(), key=lambda p: p.nome):
+        if self._catalogo_sob_demanda:
+            # o banco ordena pelo índice do nome; cada produto é carregado só na sua vez
+            ids = self.db.execute_query("SELECT id FROM produtos ORDER BY nome", fetch='all') or []
+            produtos = (p for (p_id,) in ids if (p := self.produtos.get(p_id)))
+        else:
+            produtos = sorted(self.produtos.values(), key=lambda p: p.nome)
+        for produto in produtos:
             report += f"ID: {produto.id} - {produto.nome} ({produto.categoria})"
             if produto.tipoProduto == 'kit':
                 report += " [KIT]\n"
                 report += f"   Estoque Montável: {produto.get_estoque_total()} kits\n"
+                for local, qtd in self.estoque_kit_por_local(produto.id).items():
+                    report += f"    - {local}: {qtd} montável(is)\n"
                 report += f"   Custo Componentes: R$ {produto.preco_compra:,.2f} | Preço Venda: R$ {produto.preco_venda:,.2f}\n"
                 if not produto.componentes:
                     report += "   - Kit sem componentes definidos.\n"
@@ -577,6 +2739,14 @@ Valor Total do Estoque (Individuais): R$ {self.calcular_valor_total_estoque():.2
             report += f"{'-'*30}\n"
         return report
 
+    def matriz_estoque(self) -> list[tuple[int, str, str, str, int]]:
+        """O estoque físico célula a célula, (produto_id, codigo_barras, nome, localizacao, quantidade), por produto e local."""
+        self.sincronizar_escrita()
+        return self.db.execute_query("""SELECT p.id, p.codigo_barras, p.nome, l.nome, e.quantidade
+                                        FROM estoque e JOIN produtos p ON p.id = e.produto_id
+                                        JOIN localizacoes l ON l.id = e.localizacao_id
+                                        ORDER BY p.id, l.nome""", fetch='all') or []
+
     def gerar_relatorio_valor_total(self):
         """Gera um relatório simples com o valor total do inventário."""
         valor_total = self.calcular_valor_total_estoque()
@@ -604,9 +2774,15 @@ Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
     def gerar_relatorio_mais_vendidos(self):
         """Gera um ranking de produtos mais vendidos."""
         vendas = Counter()
-        for v in self.vendas.values():
-            for item in v.itens:
-                vendas[item.produto.nome] += item.quantidade
+        if self._catalogo_sob_demanda:
+            # soma no banco por produto; só os nomes vêm do catálogo
+            for p_id, qtd in self.db.execute_query("SELECT produto_id, SUM(quantidade) FROM itens_venda GROUP BY produto_id", fetch='all') or []:
+                if produto := self.produtos.get(p_id):
+                    vendas[produto.nome] += qtd
+        else:
+            for v in self.vendas.values():
+                for item in v.itens:
+                    vendas[item.produto.nome] += item.quantidade
 
         report = f"""RELATÓRIO DE PRODUTOS E KITS MAIS VENDIDOS
 Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
@@ -624,11 +2800,8 @@ Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
         """Gera um extrato de todas as movimentações de um produto específico."""
         if not (produto := self.produtos.get(produto_id)):
             return "Erro: Produto não encontrado."
-            
-        if produto.tipoProduto == 'kit':
-            return f"Erro: '{produto.nome}' é um kit. Kits não possuem histórico de movimentação direto. Verifique o histórico de seus componentes."
 
-        movimentos_produto = [m for m in self.historico if m.produto.id == produto_id]
+        movimentos_produto = self._historico_completo(produto_id=produto_id)
 
         report = f"""HISTÓRICO DE MOVIMENTAÇÃO DO PRODUTO: {produto.nome.upper()} (ID: {produto.id})
 Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
@@ -650,8 +2823,7 @@ Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
         if not (fornecedor := self.fornecedores.get(fornecedor_id)):
             return "Erro: Fornecedor não encontrado."
 
-        produtos_do_fornecedor = [p.id for p in self.produtos.values() if p.fornecedor.id == fornecedor_id]
-        movimentos_fornecedor = [m for m in self.historico if m.produto.id in produtos_do_fornecedor]
+        movimentos_fornecedor = self._historico_completo(fornecedor_id=fornecedor_id)
 
         report = f"""HISTÓRICO DE MOVIMENTAÇÃO POR FORNECEDOR: {fornecedor.empresa.upper()} (ID: {fornecedor.id})
 Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
@@ -674,7 +2846,7 @@ Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
         if not (localizacao := self.localizacoes.get(localizacao_id)):
             return "Erro: Localização não encontrada."
 
-        movimentos_localizacao = [m for m in self.historico if m.localizacao.id == localizacao_id]
+        movimentos_localizacao = self._historico_completo(localizacao_id=localizacao_id)
 
         report = f"""HISTÓRICO DE MOVIMENTAÇÃO POR LOCALIZAÇÃO: {localizacao.nome.upper()} (ID: {localizacao.id})
 Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
@@ -694,7 +2866,13 @@ Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
 
     def gerar_relatorio_vendas_periodo(self, data_inicio: datetime, data_fim: datetime):
         """Gera um relatório detalhado de vendas dentro de um período de datas."""
-        vendas_periodo = [v for v in self.vendas.values() if data_inicio <= v.data <= data_fim]
+        if self._catalogo_sob_demanda:
+            # só as vendas do período são lidas (pelo índice da data)
+            ids = self.db.execute_query("SELECT id FROM vendas WHERE data BETWEEN ? AND ?",
+                                        (data_inicio.isoformat(), data_fim.isoformat()), fetch='all') or []
+            vendas_periodo = [v for (v_id,) in ids if (v := self.vendas.get(v_id))]
+        else:
+            vendas_periodo = [v for v in self.vendas.values() if data_inicio <= v.data <= data_fim]
 
         report = f"""RELATÓRIO DE VENDAS POR PERÍODO
 Período: {data_inicio.strftime('%d/%m/%Y')} a {data_fim.strftime('%d/%m/%Y')}
@@ -726,10 +2904,17 @@ Período: {data_inicio.strftime('%d/%m/%Y')} a {data_fim.strftime('%d/%m/%Y')}
     def gerar_relatorio_kits_mais_vendidos(self) -> str:
         """Gera um relatório com os kits mais vendidos."""
         vendas_kits = Counter()
-        for v in self.vendas.values():
-            for item in v.itens:
-                if item.produto.tipoProduto == 'kit':
-                    vendas_kits[item.produto.nome] += item.quantidade
+        if self._catalogo_sob_demanda:
+            for p_id, qtd in self.db.execute_query("""SELECT i.produto_id, SUM(i.quantidade) FROM itens_venda i
+                                                      JOIN produtos p ON p.id = i.produto_id WHERE p.tipo_produto = 'kit'
+                                                      GROUP BY i.produto_id""", fetch='all') or []:
+                if kit := self.produtos.get(p_id):
+                    vendas_kits[kit.nome] += qtd
+        else:
+            for v in self.vendas.values():
+                for item in v.itens:
+                    if item.produto.tipoProduto == 'kit':
+                        vendas_kits[item.produto.nome] += item.quantidade
         
         report = f"""RELATÓRIO DE KITS MAIS VENDIDOS
 Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
@@ -749,7 +2934,7 @@ Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
 Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
 {'='*60}\n
 """
-        kits = [p for p in self.produtos.values() if p.tipoProduto == 'kit']
+        kits = self._todos_os_kits()
         if not kits:
             return report + "Nenhum kit cadastrado."
             
@@ -792,16 +2977,20 @@ Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
                 raise ValueError(f"Quantidade de devolução para o produto ID {produto_id} excede a quantidade vendida.")
 
         agora = datetime.now()
-        query_dev = "INSERT INTO devolucoes (venda_original_id, cliente_nome, status, data, observacoes) VALUES (?, ?, ?, ?, ?)"
-        novo_id_dev = self.db.execute_query(query_dev, (venda_id, venda_original.cliente, "solicitada", agora.isoformat(), observacoes))
-
         itens_dev_obj = []
-        for item_dev_info in itens_devolucao_info:
-            produto = self.produtos[item_dev_info['produto_id']]
-            query_item = "INSERT INTO itens_devolucao (devolucao_id, produto_id, quantidade, motivo_devolucao, condicao_produto) VALUES (?, ?, ?, ?, ?)"
-            self.db.execute_query(query_item, (novo_id_dev, produto.id, item_dev_info['quantidade'], item_dev_info['motivo'], item_dev_info['condicao']))
-            itens_dev_obj.append(ItemDevolucao(produto, item_dev_info['quantidade'], item_dev_info['motivo'], item_dev_info['condicao']))
-        
+        with self.db.transacao():
+            query_dev = "INSERT INTO devolucoes (venda_original_id, cliente_nome, status, data, observacoes) VALUES (?, ?, ?, ?, ?)"
+            novo_id_dev = self.db.execute_query(query_dev, (venda_id, venda_original.cliente, "solicitada", agora.isoformat(), observacoes))
+
+            for item_dev_info in itens_devolucao_info:
+                produto = self.produtos[item_dev_info['produto_id']]
+                query_item = "INSERT INTO itens_devolucao (devolucao_id, produto_id, quantidade, motivo_devolucao, condicao_produto) VALUES (?, ?, ?, ?, ?)"
+                self.db.execute_query(query_item, (novo_id_dev, produto.id, item_dev_info['quantidade'], item_dev_info['motivo'], item_dev_info['condicao']))
+                itens_dev_obj.append(ItemDevolucao(self._produto_do_documento(produto.id), item_dev_info['quantidade'], item_dev_info['motivo'], item_dev_info['condicao']))
+            self._registrar_eventos([('devolucao', novo_id_dev, {
+                'status': "solicitada", 'venda_id': venda_id,
+                'itens': [{'produto_id': i.produto.id, 'quantidade': i.quantidade, 'motivo': i.motivo_devolucao} for i in itens_dev_obj]})], agora)
+
         nova_devolucao = Devolucao(novo_id_dev, venda_original, venda_original.cliente, itens_dev_obj, "solicitada", agora, observacoes)
         self.devolucoes[novo_id_dev] = nova_devolucao
         return nova_devolucao
@@ -820,10 +3009,10 @@ Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
             produto_devolvido = item.produto
             # Se um kit for devolvido, o estoque de seus componentes retorna.
             if produto_devolvido.tipoProduto == 'kit':
-                for comp in produto_devolvido.componentes:
-                    qtd_retorno = item.quantidade * comp.quantidade
+                for folha, qtd in produto_devolvido.componentes_folha():
+                    qtd_retorno = item.quantidade * qtd
                     self.movimentar_estoque(
-                        produto_id=comp.produto.id,
+                        produto_id=folha.id,
                         localizacao_id=local_retorno_id,
                         quantidade=qtd_retorno,
                         tipo_movimento=f"Retorno Componente Kit Dev. #{devolucao.id}"
@@ -857,19 +3046,20 @@ Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
             tipo_transacao = "pagamento_troca" if valor_troca_paga > 0 else "credito_troca"
             
             valor_final_transacao = valor_troca_paga if valor_troca_paga > 0 else (valor_credito - valor_total_troca)
-            
-            # Insere a transação no banco
-            query_trans = "INSERT INTO transacoes (devolucao_id, tipo, valor, data) VALUES (?, ?, ?, ?)"
-            trans_id = self.db.execute_query(query_trans, (devolucao.id, tipo_transacao, valor_final_transacao, datetime.now().isoformat()))
-            devolucao.transacao = Transacao(trans_id, devolucao.id, tipo_transacao, valor_final_transacao)
 
         else: # Ação é 'reembolso'
-            query_trans = "INSERT INTO transacoes (devolucao_id, tipo, valor, data) VALUES (?, ?, ?, ?)"
-            trans_id = self.db.execute_query(query_trans, (devolucao.id, "reembolso", valor_credito, datetime.now().isoformat()))
-            devolucao.transacao = Transacao(trans_id, devolucao.id, "reembolso", valor_credito)
+            tipo_transacao, valor_final_transacao = "reembolso", valor_credito
 
-        # Passo 3: Atualiza o status da devolução para 'concluida'
-        self.db.execute_query("UPDATE devolucoes SET status = 'concluida' WHERE id = ?", (devolucao.id,))
+        # Passo 3: Insere a transação no banco e atualiza o status da devolução para 'concluida' (junto com o evento)
+        agora = datetime.now()
+        with self.db.transacao():
+            query_trans = "INSERT INTO transacoes (devolucao_id, tipo, valor, data) VALUES (?, ?, ?, ?)"
+            trans_id = self.db.execute_query(query_trans, (devolucao.id, tipo_transacao, valor_final_transacao, agora.isoformat()))
+            self.db.execute_query("UPDATE devolucoes SET status = 'concluida' WHERE id = ?", (devolucao.id,))
+            self._registrar_eventos([('devolucao', devolucao.id, {
+                'status': "concluida", 'acao': acao, 'localizacao_id': local_retorno_id, 'transacao': tipo_transacao,
+                'valor': valor_final_transacao, 'venda_troca_id': devolucao.nova_venda_troca.id if devolucao.nova_venda_troca else None})], agora)
+        devolucao.transacao = Transacao(trans_id, devolucao.id, tipo_transacao, valor_final_transacao, agora)
         devolucao.status = 'concluida'
         
         return devolucao, valor_troca_paga
@@ -881,9 +3071,13 @@ Data de Geração: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
 {'='*70}\n
 """
         motivos = Counter()
-        for devolucao in self.devolucoes.values():
-            for item in devolucao.itens:
-                motivos[item.motivo_devolucao] += item.quantidade
+        if self._catalogo_sob_demanda:
+            motivos.update(dict(self.db.execute_query(
+                "SELECT motivo_devolucao, SUM(quantidade) FROM itens_devolucao GROUP BY motivo_devolucao", fetch='all') or []))
+        else:
+            for devolucao in self.devolucoes.values():
+                for item in devolucao.itens:
+                    motivos[item.motivo_devolucao] += item.quantidade
         
         if not motivos:
             return report + "Nenhuma devolução registrada."
@@ -2,8 +2,9 @@
 # contém as definições de todas as classes de dados (dataclasses) da aplicação.
 from __future__ import annotations # Permite referenciar a própria classe em type hints
 from dataclasses import dataclass, field
-from collections import defaultdict
+from collections import defaultdict, Counter
 from datetime import datetime
+from time import monotonic
 
 #  Classes de Dados (Models)
 
@@ -54,35 +55,65 @@ class Produto:
     ponto_ressuprimento: int # Para produtos individuais, é o estoque mínimo
     tipoProduto: str = "individual" # "individual" ou "kit"
     
-    # Para produtos individuais, armazena a quantidade por nome de localização
+    # Quantidade por nome de localização (para kits, são os kits já montados, ver OrdemMontagem)
     estoque_por_local: defaultdict[str, int] = field(default_factory=lambda: defaultdict(int))
-    # Para kits, armazena a lista de seus componentes
+    # Para kits, armazena a lista de seus componentes (que podem ser outros kits)
     componentes: list[ComponenteKit] = field(default_factory=list)
+    # kit "explodido" até os produtos individuais: {produto_id: (produto, unidades por kit)}; None = calcular de novo
+    _folhas: dict[int, tuple[Produto, int]] | None = field(default=None, init=False, repr=False, compare=False)
+
+    def componentes_folha(self) -> list[tuple[Produto, int]]:
+        """
+        Os produtos individuais que uma unidade consome e quantos de cada, descendo pelos kits dentro de kits
+        (um individual é folha de si mesmo). Cada kit calcula isso uma vez a partir das folhas dos seus
+        componentes e guarda; quem muda a composição de algum kit chama invalidar_componentes_folha em todos.
+        """
+        if self.tipoProduto != 'kit':
+            return [(self, 1)]
+        if self._folhas is None:
+            folhas: dict[int, tuple[Produto, int]] = {}
+            for c in self.componentes:
+                for folha, qtd in c.produto.componentes_folha():
+                    anterior = folhas.get(folha.id, (folha, 0))[1]
+                    folhas[folha.id] = (folha, anterior + c.quantidade * qtd)
+            self._folhas = folhas
+        return list(self._folhas.values())
+
+    def invalidar_componentes_folha(self):
+        self._folhas = None
 
     def recalcular_preco_compra(self):
-        """Recalcula o preço de compra de um kit somando os preços dos componentes."""
+        """
+        Recalcula o preço de compra de um kit somando os preços dos componentes.
+        Com kits dentro de kits, os de baixo têm que ser recalculados antes (ordem topológica).
+        """
         if self.tipoProduto == 'kit':
             self.preco_compra = sum(c.produto.preco_compra * c.quantidade for c in self.componentes)
 
+    def get_estoque_montado(self) -> int:
+        """unidades físicas em estoque (para kits, os já montados numa ordem de montagem)"""
+        return sum(self.estoque_por_local.values())
+
     def get_estoque_total(self) -> int:
         """
         Calcula o estoque total.
         - Para produtos 'individuais', soma o estoque de todas as localizações.
-        - Para produtos 'kit', calcula a quantidade máxima de kits que podem ser montados
-          com base no estoque disponível de seus componentes.
+        - Para produtos 'kit', soma os kits já montados com a quantidade máxima de kits que ainda podem ser
+          montados com base no estoque disponível dos produtos individuais que ele consome (as folhas).
         """
         if self.tipoProduto == 'individual':
             return sum(self.estoque_por_local.values())
         elif self.tipoProduto == 'kit':
-            if not self.componentes:
-                return 0
+            montados = self.get_estoque_montado()
+            if not (folhas := self.componentes_folha()):
+                return montados
             try:
-                # Calcula quantos kits podem ser feitos com base em cada componente
+                # Calcula quantos kits podem ser feitos com base em cada folha
                 # e retorna o menor valor (o gargalo da produção)
-                return min(c.produto.get_estoque_total() // c.quantidade for c in self.componentes)
+                return montados + min(folha.get_estoque_total() // qtd for folha, qtd in folhas)
             except ZeroDivisionError:
                 # Acontece se um componente requer 0 unidades, o que não deve ocorrer.
-                return 0
+                return montados
 
     def __str__(self):
         """representação em string para listas e seleções"""
@@ -101,6 +132,8 @@ class HistoricoMovimento:
     quantidade: int
     localizacao: Localizacao
     data: datetime = field(default_factory=datetime.now)
+    # id da linha em 'historico_movimentos' (só preenchido nas listagens paginadas, que usam ele como cursor)
+    id: int | None = None
 
 @dataclass
 class ItemOrdemCompra:
@@ -109,19 +142,26 @@ class ItemOrdemCompra:
     produto: Produto
     quantidade: int
     preco_unitario: float
+    quantidade_recebida: int = 0 # pode chegar aos poucos (recebimento parcial)
+    id: int | None = None
 
     @property
     def subtotal(self) -> float:
         """calculo do valro subtotal do item da ordem de compra"""
         return self.quantidade * self.preco_unitario
 
+    @property
+    def quantidade_pendente(self) -> int:
+        """o que ainda falta chegar (backorder)"""
+        return max(self.quantidade - self.quantidade_recebida, 0)
+
 @dataclass
 class OrdemCompra:
     """aqui, nós ja temoos a nossa tal ordem de compra kkkkk ai meu deus eu tô ficando louco"""
     id: int
     fornecedor: Fornecedor
     itens: list[ItemOrdemCompra]
-    status: str # : pendente, recebida, cancelada
+    status: str # : pendente, parcialmente recebida, recebida, cancelada
     data_criacao: datetime = field(default_factory=datetime.now)
 
     @property
@@ -129,6 +169,15 @@ class OrdemCompra:
         """calcolo do valor total da ordem de compra"""
         return sum(item.subtotal for item in self.itens)
 
+    def status_pelo_recebimento(self) -> str:
+        """o status que a OC deve ter de acordo com o que já chegou em relação ao que foi pedido"""
+        recebido = sum(item.quantidade_recebida for item in self.itens)
+        if recebido == 0:
+            return "Pendente"
+        if recebido < sum(item.quantidade for item in self.itens):
+            return "Parcialmente Recebida"
+        return "Recebida"
+
     def __str__(self):
         """Representação em string para listas e seleções."""
         # Usando ,.2f para formatar o número com separador de milhar e duas casas decimais
@@ -138,6 +187,32 @@ class OrdemCompra:
                 f"Fornecedor: {self.fornecedor.empresa} | "
                 f"{valor_formatado} | Status: {self.status}")
 
+@dataclass
+class ItemTransferencia:
+    """uma linha de um documento de transferência"""
+    produto: Produto
+    quantidade: int
+
+@dataclass
+class DocumentoTransferencia:
+    """documento de transferência entre localizações (cabeçalho + linhas)"""
+    id: int
+    origem: Localizacao
+    destino: Localizacao
+    itens: list[ItemTransferencia]
+    status: str # Em Trânsito, Recebida, Cancelada
+    data_criacao: datetime = field(default_factory=datetime.now)
+    data_recebimento: datetime | None = None
+
+    @property
+    def quantidade_total(self) -> int:
+        return sum(item.quantidade for item in self.itens)
+
+    def __str__(self):
+        data_formatada = self.data_criacao.strftime('%d/%m/%Y')
+        return (f"Transf. #{self.id} | {data_formatada} | {self.origem.nome} -> {self.destino.nome} | "
+                f"{len(self.itens)} item(ns), {self.quantidade_total} un. | Status: {self.status}")
+
 @dataclass
 class ItemVenda:
     produto: Produto
@@ -165,6 +240,139 @@ class Venda:
         data_formatada = self.data.strftime('%d/%m/%Y')
         return f"Venda #{self.id} | Data: {data_formatada} | Cliente: {self.cliente} | Valor: {valor_formatado}"
 
+@dataclass
+class Carrinho:
+    """
+    Venda sendo montada numa localização. Guarda quanto de cada produto individual as linhas já comprometem
+    (avulso ou dentro de kits), então adicionar/remover e consultar o que sobra custa O(componentes), e dois
+    kits que dividem um componente são conferidos juntos contra o estoque do local.
+    """
+    localizacao: Localizacao
+    itens: dict[int, ItemVenda] = field(default_factory=dict)  # produto_id -> linha, na ordem em que entrou
+    reservado: Counter[int] = field(default_factory=Counter)    # produto individual -> unidades comprometidas
+    # reservas de estoque de todo mundo ((produto_id, localizacao_id) -> unidades), que não estão disponíveis...
+    reservas_de_todos: Counter[tuple[int, int]] = field(default_factory=Counter)
+    # ...menos as deste carrinho (os tokens e o que eles seguram de cada produto individual)
+    reservas: list[str] = field(default_factory=list)
+    reservado_proprio: Counter[int] = field(default_factory=Counter)
+    # kit_id -> quantas unidades da linha saem de kits já montados (o resto é montado na hora com os individuais)
+    montados: Counter[int] = field(default_factory=Counter)
+
+    @staticmethod
+    def _debitos(produto: Produto, quantidade: int, montados: int = 0) -> list[tuple[Produto, int]]:
+        """
+        o que a linha tira do estoque: o próprio produto, ou (kit) 'montados' kits prontos mais os individuais
+        do resto (descendo pelos kits de dentro)
+        """
+        debitos = [(produto, montados)] if montados else []
+        if resto := quantidade - montados:
+            debitos += [(folha, qtd * resto) for folha, qtd in produto.componentes_folha()]
+        return debitos
+
+    def debitos_do_item(self, produto_id: int) -> list[tuple[Produto, int]]:
+        """o que a linha do produto vai tirar do estoque quando a venda for registrada"""
+        item = self.itens[produto_id]
+        return self._debitos(item.produto, item.quantidade, self.montados[produto_id])
+
+    def _livre(self, produto: Produto) -> int:
+        reservado_por_outros = max(0, self.reservas_de_todos.get((produto.id, self.localizacao.id), 0) - self.reservado_proprio[produto.id])
+        return produto.estoque_por_local.get(self.localizacao.nome, 0) - reservado_por_outros - self.reservado[produto.id]
+
+    def montaveis(self, kit: Produto) -> int:
+        """Quantos kits ainda dá pra montar com os individuais que o carrinho não comprometeu."""
+        if not (folhas := kit.componentes_folha()):
+            return 0
+        return max(0, min((self._livre(folha) // qtd if qtd > 0 else 0) for folha, qtd in folhas))
+
+    def disponivel(self, produto: Produto) -> int:
+        """Quanto ainda dá pra colocar do produto (ou do kit: montados + montáveis) com o que o carrinho não comprometeu."""
+        if produto.tipoProduto == 'kit':
+            return max(0, self._livre(produto)) + self.montaveis(produto)
+        return max(0, self._livre(produto))
+
+    def adicionar(self, produto: Produto, quantidade: int):
+        """Coloca 'quantidade' do produto/kit no carrinho (ValueError se o local não tiver o suficiente)."""
+        if quantidade <= 0:
+            raise ValueError("A quantidade deve ser maior que zero.")
+        if (disponivel := self.disponivel(produto)) < quantidade:
+            if produto.tipoProduto == 'kit':
+                raise ValueError(f"Estoque de componentes insuficiente em '{self.localizacao.nome}' para montar {quantidade} unidade(s) do kit '{produto.nome}'. Apenas {disponivel} possível(is).")
+            raise ValueError(f"Estoque insuficiente para '{produto.nome}' na localização '{self.localizacao.nome}'.")
+        # kit: primeiro os já montados, o que faltar é montado com os individuais
+        montados = min(quantidade, max(0, self._livre(produto))) if produto.tipoProduto == 'kit' else 0
+        for individual, qtd in self._debitos(produto, quantidade, montados):
+            self.reservado[individual.id] += qtd
+        if montados:
+            self.montados[produto.id] += montados
+        if item := self.itens.get(produto.id):
+            item.quantidade += quantidade
+        else:
+            self.itens[produto.id] = ItemVenda(produto, quantidade, produto.preco_venda)
+
+    def remover(self, produto_id: int, quantidade: int | None = None):
+        """Tira 'quantidade' (por padrão, a linha toda) do produto/kit do carrinho."""
+        if not (item := self.itens.get(produto_id)):
+            raise ValueError("Produto não está no carrinho.")
+        quantidade = item.quantidade if quantidade is None else min(quantidade, item.quantidade)
+        # devolve primeiro a parte que seria montada na hora, depois os kits prontos
+        montados = max(0, quantidade - (item.quantidade - self.montados[produto_id]))
+        for individual, qtd in self._debitos(item.produto, quantidade, montados):
+            if (self.reservado[individual.id] - qtd) > 0:
+                self.reservado[individual.id] -= qtd
+            else:
+                del self.reservado[individual.id]
+        if (self.montados[produto_id] - montados) > 0:
+            self.montados[produto_id] -= montados
+        else:
+            self.montados.pop(produto_id, None)
+        item.quantidade -= quantidade
+        if item.quantidade <= 0:
+            del self.itens[produto_id]
+
+    def validar(self):
+        """Confere o carrinho inteiro contra o estoque atual do local (pode ter mudado desde que os itens entraram)."""
+        for produto_id in self.itens:
+            for individual, _ in self.debitos_do_item(produto_id):
+                if self._livre(individual) < 0:
+                    raise ValueError(f"Estoque insuficiente para '{individual.nome}' na localização '{self.localizacao.nome}'.")
+
+    def itens_venda(self) -> list[dict]:
+        """as linhas no formato que o registrar_venda recebe"""
+        return [{'produto_id': p_id, 'quantidade': item.quantidade} for p_id, item in self.itens.items()]
+
+    @property
+    def valor_total(self) -> float:
+        return sum(item.subtotal for item in self.itens.values())
+
+@dataclass
+class OrdemMontagem:
+    """ordem de montagem (componentes -> kits prontos) ou de desmontagem (o contrário) numa localização"""
+    id: int
+    kit: Produto
+    localizacao: Localizacao
+    tipo: str  # montagem, desmontagem
+    quantidade: int
+    data: datetime = field(default_factory=datetime.now)
+
+    def __str__(self):
+        data_formatada = self.data.strftime('%d/%m/%Y %H:%M')
+        return f"{self.tipo.capitalize()} #{self.id} | {data_formatada} | {self.quantidade}x {self.kit.nome} | {self.localizacao.nome}"
+
+@dataclass
+class Reserva:
+    """unidades separadas pra alguém (um carrinho, uma transferência) até confirmar, liberar ou expirar"""
+    token: str
+    produto: Produto
+    localizacao: Localizacao
+    quantidade: int
+    debitos: list[tuple[int, int]]  # (produto individual, unidades) que ela segura: o produto ou os componentes do kit
+    expira_em: float                # no relógio monotonic()
+    data: datetime = field(default_factory=datetime.now)
+
+    @property
+    def segundos_restantes(self) -> float:
+        return max(0.0, self.expira_em - monotonic())
+
 @dataclass
 class ItemDevolucao:
     """representa um produto específico dentro de um processo de devolução"""
@@ -211,4 +419,109 @@ class Devolucao:
                 f"Venda Orig.: #{self.venda_original.id} | Cliente: {self.cliente_nome} | "
                 f"Status: {self.status}")
 
+@dataclass
+class Evento:
+    """um registro do feed de eventos (outbox): movimento de estoque, venda, status de OC, devolução, preço..."""
+    id: int
+    tipo: str
+    entidade_id: int | None
+    dados: dict
+    data: datetime
+
+    def como_dict(self) -> dict:
+        return {'id': self.id, 'tipo': self.tipo, 'entidade_id': self.entidade_id,
+                'dados': self.dados, 'data': self.data.isoformat()}
+
+@dataclass
+class ResultadoImportacao:
+    """resumo de uma importação em lote: quantos registros entraram e quais linhas foram rejeitadas"""
+    fornecedores: int = 0
+    produtos: int = 0
+    kits: int = 0
+    movimentos_estoque: int = 0
+    # (arquivo, número da linha, motivo)
+    rejeitadas: list[tuple[str, int, str]] = field(default_factory=list)
+
+    def __str__(self):
+        return (f"{self.fornecedores} fornecedor(es), {self.produtos} produto(s) ({self.kits} kit(s)), "
+                f"{self.movimentos_estoque} lançamento(s) de estoque importados; {len(self.rejeitadas)} linha(s) rejeitada(s)")
+
+@dataclass
+class DivergenciaContagem:
+    """diferença entre o que foi contado fisicamente e o que o sistema diz ter numa localização"""
+    produto: Produto
+    localizacao: Localizacao
+    quantidade_sistema: int
+    quantidade_contada: int
+
+    @property
+    def diferenca(self) -> int:
+        return self.quantidade_contada - self.quantidade_sistema
+
+    @property
+    def valor(self) -> float:
+        """valor da diferença a preço de compra (negativo = perda)"""
+        return self.diferenca * self.produto.preco_compra
+
+@dataclass
+class ConciliacaoInventario:
+    """resultado da leitura de um arquivo de contagem: as divergências encontradas e as linhas rejeitadas"""
+    arquivo: str
+    divergencias: list[DivergenciaContagem] = field(default_factory=list)
+    # tudo o que foi contado, com ou sem divergência na prévia: {(produto_id, localizacao_id): quantidade contada}
+    contagem: dict[tuple[int, int], int] = field(default_factory=dict)
+    celulas_contadas: int = 0
+    # (número da linha, motivo)
+    rejeitadas: list[tuple[int, str]] = field(default_factory=list)
+
+    @property
+    def valor_total(self) -> float:
+        return sum(d.valor for d in self.divergencias)
+
+@dataclass
+class ResultadoIngestao:
+    """resumo de uma ingestão do log de vendas do PDV"""
+    arquivo: str
+    offset_inicial: int = 0
+    offset_final: int = 0
+    vendas: int = 0
+    lotes: int = 0
+    segundos: float = 0.0
+    # (número da linha, motivo)
+    rejeitadas: list[tuple[int, str]] = field(default_factory=list)
+
+    @property
+    def vendas_por_segundo(self) -> float:
+        return self.vendas / self.segundos if self.segundos else 0.0
+
+    def __str__(self):
+        return (f"{self.vendas} venda(s) ingerida(s) em {self.lotes} lote(s), {len(self.rejeitadas)} rejeitada(s), "
+                f"{self.segundos:.2f}s ({self.vendas_por_segundo:,.0f} vendas/s)")
+
+@dataclass
+class Pagina:
+    """
+    uma página de uma listagem paginada por cursor: pra próxima, passe o ultimo_id como 'depois_de';
+    pra anterior, o primeiro_id como 'antes_de'
+    """
+    itens: list
+    tem_anterior: bool = False
+    tem_proxima: bool = False
+    # ids da primeira e da última linha lida (o cursor de verdade): uma linha pulada na montagem
+    # não pode fazer a próxima página começar antes dela. Sem eles, valem os ids dos itens
+    id_inicio: int | None = None
+    id_fim: int | None = None
+
+    @property
+    def primeiro_id(self) -> int | None:
+        if self.id_inicio is not None:
+            return self.id_inicio
+        return self.itens[0].id if self.itens else None
+
+    @property
+    def ultimo_id(self) -> int | None:
+        if self.id_fim is not None:
+            return self.id_fim
+        return self.itens[-1].id if self.itens else None
+
 #endregion
\ No newline at end of file
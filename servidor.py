@@ -0,0 +1,277 @@
+# servidor.py
+# Contém o ServidorEstoque, um servidor HTTP/JSON (só com a biblioteca padrão, usando asyncio) que expõe o
+# GerenciadorEstoque pra vários caixas ao mesmo tempo, todos enxergando a mesma memória.
+# - tudo o que grava no banco roda numa única thread escritora, fora do loop;
+# - as leituras (produto, estoque, listas, relatórios) rodam num pool de threads de leitura: no catálogo sob demanda
+#   elas vão ao banco, e o estoque é copiado com a trava do gerenciador enquanto a escritora mexe nele.
+#   O loop só recebe as requisições e devolve as respostas, então nenhum caixa espera a consulta de outro.
+#
+# Rotas:
+#   GET  /produtos                       lista resumida (id, nome, código de barras, estoque) do catálogo inteiro
+#   GET  /produtos?limite=50&depois_de=<proximo>&filtro=...&ordenacao=nome   a mesma lista, uma página por vez
+#   GET  /produtos/<id>                  detalhes de um produto
+#   GET  /produtos/codigo/<codigo>       busca pelo código de barras
+#   GET  /estoque/<produto_id>           estoque por localização
+#   GET  /relatorios/<tipo>?data=DD/MM/AAAA&produto=1...   (os mesmos tipos do modo em lote)
+#   GET  /eventos?consumidor=loja-virtual&limite=500  próximos eventos do feed depois do cursor do consumidor
+#   POST /eventos/confirmar  {"consumidor": "loja-virtual", "ate_id": 1234}
+#   POST /reservas        {"localizacao_id": 2, "codigo_barras": "789...", "quantidade": 1, "ttl": 900}  -> {"token": ...}
+#   POST /reservas/<token>/liberar
+#   POST /vendas          {"localizacao_id": 2, "cliente": "João", "itens": [{"codigo_barras": "789...", "quantidade": 1}],
+#                          "reservas": ["<token>", ...]}   (reservas opcionais, consumidas pela venda)
+#   POST /transferencias  {"origem_id": 1, "destino_id": 2, "em_transito": false, "itens": [{"produto_id": 3, "quantidade": 5}],
+#                          "reservas": [...]}
+
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from config import SERVIDOR_HOST, SERVIDOR_PORTA, RESERVA_TTL_SEGUNDOS
+from manager import GerenciadorEstoque
+from models import Produto
+
+MOTIVOS_HTTP = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                413: "Payload Too Large", 500: "Internal Server Error"}
+TAMANHO_MAXIMO_CORPO = 1024 * 1024
+
+
+class ErroHTTP(Exception):
+    """erro que vira uma resposta HTTP com o status e a mensagem informados"""
+    def __init__(self, status: int, mensagem: str):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def _produto_json(gerenciador: GerenciadorEstoque, produto: Produto) -> dict:
+    # kit: em cada local valem os kits já montados mais o que dá pra montar com os componentes de lá
+    estoque_total, estoque_por_local = gerenciador.fotografia_estoque(produto)
+    return {
+        'id': produto.id, 'nome': produto.nome, 'codigo_barras': produto.codigo_barras,
+        'categoria': produto.categoria, 'tipo': produto.tipoProduto, 'preco_venda': produto.preco_venda,
+        'estoque_total': estoque_total, 'estoque_por_local': estoque_por_local,
+    }
+
+
+def _resumo_json(gerenciador: GerenciadorEstoque, produto: Produto) -> dict:
+    return {'id': produto.id, 'nome': produto.nome, 'codigo_barras': produto.codigo_barras,
+            'tipo': produto.tipoProduto, 'estoque_total': gerenciador.fotografia_estoque(produto)[0]}
+
+
+class ServidorEstoque:
+    """servidor HTTP/JSON assíncrono em cima de um GerenciadorEstoque já carregado"""
+    def __init__(self, gerenciador: GerenciadorEstoque, host: str = SERVIDOR_HOST, porta: int = SERVIDOR_PORTA,
+                 threads_leitura: int = 4):
+        self.gerenciador = gerenciador
+        self.host = host
+        self.porta = porta
+        # uma thread só pra gravar: as escritas saem em fila, na ordem em que chegaram
+        self._escritor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="escritor")
+        self._leitores = ThreadPoolExecutor(max_workers=threads_leitura, thread_name_prefix="leitor")
+        self._servidor: asyncio.AbstractServer | None = None
+
+    async def iniciar(self):
+        self._servidor = await asyncio.start_server(self._atender_conexao, self.host, self.porta, backlog=1024)
+        # porta 0 = o sistema escolhe uma livre; guarda a que foi usada de fato
+        self.porta = self._servidor.sockets[0].getsockname()[1]
+
+    async def servir_para_sempre(self):
+        await self.iniciar()
+        print(f"Servidor de estoque ouvindo em http://{self.host}:{self.porta} (Ctrl+C para parar)")
+        try:
+            async with self._servidor:
+                await self._servidor.serve_forever()
+        finally:
+            self.encerrar()
+
+    def encerrar(self):
+        if self._servidor:
+            self._servidor.close()
+        # espera as gravações que já estavam na fila terminarem
+        self._escritor.shutdown(wait=True)
+        self._leitores.shutdown(wait=True)
+
+    # --- HTTP ---
+
+    async def _atender_conexao(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Atende uma conexão (com keep-alive: um caixa manda várias requisições pela mesma conexão)."""
+        try:
+            while True:
+                linha = await reader.readline()
+                if not linha.strip():
+                    break
+                try:
+                    metodo, alvo, _ = linha.decode('latin-1').split(' ', 2)
+                except ValueError:
+                    await self._responder(writer, 400, {'erro': "linha de requisição inválida"}, manter_aberta=False)
+                    break
+
+                cabecalhos = {}
+                while (cabecalho := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    nome, _, valor = cabecalho.decode('latin-1').partition(':')
+                    cabecalhos[nome.strip().lower()] = valor.strip()
+                tamanho = int(cabecalhos.get('content-length') or 0)
+                if tamanho > TAMANHO_MAXIMO_CORPO:
+                    await self._responder(writer, 413, {'erro': "corpo da requisição muito grande"}, manter_aberta=False)
+                    break
+                corpo = await reader.readexactly(tamanho) if tamanho else b''
+                manter_aberta = cabecalhos.get('connection', '').lower() != 'close'
+
+                try:
+                    status, resposta = await self._despachar(metodo.upper(), alvo, corpo)
+                except ErroHTTP as e:
+                    status, resposta = e.status, {'erro': str(e)}
+                except (ValueError, KeyError, TypeError, argparse.ArgumentTypeError) as e:
+                    status, resposta = 400, {'erro': str(e).strip("'")}
+                except Exception as e:
+                    status, resposta = 500, {'erro': f"erro interno: {e}"}
+                await self._responder(writer, status, resposta, manter_aberta)
+                if not manter_aberta:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _responder(writer: asyncio.StreamWriter, status: int, resposta, manter_aberta: bool):
+        if isinstance(resposta, str):
+            corpo, tipo = resposta.encode('utf-8'), "text/plain; charset=utf-8"
+        else:
+            corpo, tipo = json.dumps(resposta, ensure_ascii=False).encode('utf-8'), "application/json; charset=utf-8"
+        cabecalho = (f"HTTP/1.1 {status} {MOTIVOS_HTTP.get(status, '')}\r\n"
+                     f"Content-Type: {tipo}\r\nContent-Length: {len(corpo)}\r\n"
+                     f"Connection: {'keep-alive' if manter_aberta else 'close'}\r\n\r\n")
+        writer.write(cabecalho.encode('latin-1') + corpo)
+        await writer.drain()
+
+    # --- Rotas ---
+
+    async def _despachar(self, metodo: str, alvo: str, corpo: bytes) -> tuple[int, object]:
+        url = urlsplit(alvo)
+        partes = [unquote(p) for p in url.path.strip('/').split('/') if p]
+        parametros = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        if metodo == 'GET':
+            match partes:
+                case ['produtos']:
+                    if 'limite' not in parametros:
+                        # o catálogo inteiro pode ter milhões de produtos (e vir do banco, no catálogo sob demanda)
+                        return 200, await self._ler(lambda: [_resumo_json(self.gerenciador, p) for p in list(self.gerenciador.produtos.values())])
+                    # paginado por cursor: ?limite=50&depois_de=<proximo da página anterior>&filtro=...&ordenacao=nome
+                    return 200, await self._ler(self._pagina_produtos_json, parametros)
+                case ['produtos', 'codigo', codigo]:
+                    return 200, await self._ler(self._produto_por_codigo_json, codigo)
+                case ['produtos', produto_id]:
+                    return 200, await self._ler(lambda: _produto_json(self.gerenciador, self._produto(produto_id)))
+                case ['estoque', produto_id]:
+                    return 200, await self._ler(self._estoque_json, produto_id)
+                case ['relatorios', tipo]:
+                    return 200, await self._ler(self._gerar_relatorio, tipo, parametros)
+                case ['eventos']:
+                    # um consumidor novo é gravado pela thread escritora; a leitura em si fica no pool de leitura
+                    await self._gravar(self.gerenciador.registrar_consumidor_eventos, parametros.get('consumidor', ''))
+                    eventos = await self._ler(self.gerenciador.ler_eventos, parametros.get('consumidor', ''), int(parametros.get('limite', 500)))
+                    return 200, [e.como_dict() for e in eventos]
+        elif metodo == 'POST':
+            dados = self._ler_json(corpo)
+            match partes:
+                case ['vendas']:
+                    venda, alertas = await self._gravar(self.gerenciador.registrar_venda, await self._ler(self._itens, dados),
+                                                        dados.get('cliente') or "Consumidor (PDV)", int(dados['localizacao_id']),
+                                                        None, [str(t) for t in dados.get('reservas') or []])
+                    return 201, {'venda_id': venda.id, 'valor_total': venda.valor_total,
+                                 'alertas_ressuprimento': [p.id for p in alertas]}
+                case ['transferencias']:
+                    documento = await self._gravar(self.gerenciador.criar_transferencia, int(dados['origem_id']),
+                                                   int(dados['destino_id']), await self._ler(self._itens, dados), bool(dados.get('em_transito', False)),
+                                                   [str(t) for t in dados.get('reservas') or []])
+                    return 201, {'transferencia_id': documento.id, 'status': documento.status}
+                case ['reservas']:
+                    # a reserva só mexe na memória (não grava no banco), mas passa pela escritora pra ficar na fila das vendas
+                    item, = await self._ler(self._itens, {'itens': [dados]})
+                    ttl = float(dados.get('ttl', RESERVA_TTL_SEGUNDOS))
+                    token = await self._gravar(self.gerenciador.reservar, item['produto_id'], int(dados['localizacao_id']),
+                                               item['quantidade'], ttl)
+                    return 201, {'token': token, 'ttl': ttl}
+                case ['reservas', token, 'liberar']:
+                    if not await self._gravar(self.gerenciador.liberar_reserva, token):
+                        raise ErroHTTP(404, "reserva não encontrada (já confirmada, liberada ou expirada)")
+                    return 200, {'token': token, 'liberada': True}
+                case ['eventos', 'confirmar']:
+                    cursor = await self._gravar(self.gerenciador.confirmar_eventos, str(dados['consumidor']), int(dados['ate_id']))
+                    return 200, {'consumidor': dados['consumidor'], 'cursor': cursor}
+        else:
+            raise ErroHTTP(405, f"método {metodo} não suportado")
+        raise ErroHTTP(404, f"rota não encontrada: {metodo} {url.path}")
+
+    async def _gravar(self, funcao, *args):
+        """Roda uma operação que grava no banco na thread escritora, sem travar o loop."""
+        return await asyncio.get_running_loop().run_in_executor(self._escritor, funcao, *args)
+
+    async def _ler(self, funcao, *args):
+        """Roda uma leitura (que pode ir ao banco ou copiar o estoque com a trava) no pool de leitura, sem travar o loop."""
+        return await asyncio.get_running_loop().run_in_executor(self._leitores, funcao, *args)
+
+    def _pagina_produtos_json(self, parametros: dict) -> dict:
+        pagina = self.gerenciador.listar_produtos(
+            int(parametros['depois_de']) if 'depois_de' in parametros else None, int(parametros['limite']),
+            parametros.get('filtro'), parametros.get('ordenacao', 'id'))
+        return {'itens': [_resumo_json(self.gerenciador, p) for p in pagina.itens],
+                'proximo': pagina.ultimo_id if pagina.tem_proxima else None}
+
+    def _produto_por_codigo_json(self, codigo: str) -> dict:
+        if not (produto := self.gerenciador.buscar_produto_por_codigo_barras(codigo)):
+            raise ErroHTTP(404, f"nenhum produto com o código de barras '{codigo}'")
+        return _produto_json(self.gerenciador, produto)
+
+    def _estoque_json(self, produto_id: str) -> dict:
+        produto = self._produto(produto_id)
+        estoque_total, estoque_por_local = self.gerenciador.fotografia_estoque(produto)
+        return {'produto_id': produto.id, 'estoque_total': estoque_total, 'estoque_por_local': estoque_por_local}
+
+    def _produto(self, produto_id: str) -> Produto:
+        if not produto_id.isdigit() or not (produto := self.gerenciador.produtos.get(int(produto_id))):
+            raise ErroHTTP(404, f"produto '{produto_id}' não encontrado")
+        return produto
+
+    @staticmethod
+    def _ler_json(corpo: bytes) -> dict:
+        try:
+            dados = json.loads(corpo or b'{}')
+        except ValueError:
+            raise ErroHTTP(400, "corpo não é um JSON válido")
+        if not isinstance(dados, dict):
+            raise ErroHTTP(400, "o corpo deve ser um objeto JSON")
+        return dados
+
+    def _itens(self, dados: dict) -> list[dict]:
+        """Converte os itens do JSON (por produto_id ou codigo_barras) no formato do gerenciador."""
+        itens = []
+        for item in dados.get('itens') or []:
+            if 'codigo_barras' in item:
+                if not (produto := self.gerenciador.buscar_produto_por_codigo_barras(str(item['codigo_barras']))):
+                    raise ErroHTTP(400, f"nenhum produto com o código de barras '{item['codigo_barras']}'")
+                produto_id = produto.id
+            else:
+                produto_id = int(item['produto_id'])
+                if produto_id not in self.gerenciador.produtos:
+                    raise ErroHTTP(400, f"produto '{produto_id}' não encontrado")
+            itens.append({'produto_id': produto_id, 'quantidade': int(item.get('quantidade', 1))})
+        return itens
+
+    def _gerar_relatorio(self, tipo: str, parametros: dict) -> str:
+        # os relatórios são os mesmos do modo em lote, com os parâmetros vindos da query string
+        from comandos import RELATORIOS, _data
+        if tipo not in RELATORIOS:
+            raise ErroHTTP(404, f"relatório '{tipo}' não existe (opções: {', '.join(sorted(RELATORIOS))})")
+        args = argparse.Namespace(
+            inicio=_data(parametros['inicio']) if 'inicio' in parametros else None,
+            fim=_data(parametros['fim']) if 'fim' in parametros else None,
+            data=_data(parametros['data']) if 'data' in parametros else None,
+            produto=int(parametros['produto']) if 'produto' in parametros else None,
+            fornecedor=int(parametros['fornecedor']) if 'fornecedor' in parametros else None,
+            local=int(parametros['local']) if 'local' in parametros else None,
+        )
+        return RELATORIOS[tipo](self.gerenciador, args)